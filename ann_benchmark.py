@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import pickle
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree, KDTree
+import player_store
+import similarity
+from loadtest import git_commit
+
+try:
+    import hnswlib
+except ImportError:  # the hnsw rows are skipped
+    hnswlib = None
+
+try:
+    import faiss
+except ImportError:  # the faiss rows are skipped
+    faiss = None
+
+try:
+    from annoy import AnnoyIndex
+except ImportError:  # the annoy rows are skipped
+    AnnoyIndex = None
+
+# -----------------------------
+# Config
+# -----------------------------
+K            = 10
+N_QUERIES    = 1000   # batched queries per dataset; recall and role precision are averaged over these
+N_SINGLE     = 200    # of those, timed one at a time
+NOISE        = 0.05   # synthetic players: a real player plus this share of each feature's std as noise
+SEED         = 7
+EXACT_CHUNK  = 64     # query rows per distance block in exact search
+DEFAULT_SIZES   = ['real', '10000', '100000', '1000000']
+DEFAULT_METHODS = ['exact', 'balltree', 'kdtree', 'hnsw', 'faiss-ivf', 'annoy']
+
+
+# -----------------------------
+# Datasets
+# -----------------------------
+def real_dataset():
+    # The matching vectors the similarity engine serves, with roles and the notebook's neighbours
+    df, vectors, _, _ = similarity.matching_vectors(player_store.load_source(), similarity.load_spatial_features())
+    return {'name': 'real', 'X': vectors, 'ids': df['id'].to_numpy(dtype = np.int64),
+            'roles': df['role'].to_numpy(dtype = object), 'top_knn_ids': df['top_knn_ids'].tolist()}
+
+def scale_up(base, n, noise = NOISE, seed = SEED):
+    # n players drawn from the real ones with per-feature Gaussian jitter; each keeps its source's role
+    rng  = np.random.default_rng(seed)
+    rows = rng.integers(0, len(base['X']), n)
+    std  = base['X'].std(axis = 0)
+    X    = base['X'][rows] + rng.standard_normal((n, base['X'].shape[1]), dtype = np.float32) * (noise * std)
+    return {'name': str(n), 'X': X.astype(np.float32), 'ids': np.arange(n, dtype = np.int64),
+            'roles': base['roles'][rows], 'top_knn_ids': None}
+
+
+# -----------------------------
+# Exact search
+# -----------------------------
+def exact_search(X, Q, k, sq_norms = None):
+    # Squared L2 through one matrix product per block of queries
+    sq_norms = (X * X).sum(axis = 1) if sq_norms is None else sq_norms
+    out = np.empty((len(Q), k), dtype = np.int64)
+    for start in range(0, len(Q), EXACT_CHUNK):
+        q     = Q[start:start + EXACT_CHUNK]
+        dists = sq_norms[None, :] - 2 * (q @ X.T)
+        top   = np.argpartition(dists, k - 1, axis = 1)[:, :k]
+        order = np.argsort(np.take_along_axis(dists, top, axis = 1), axis = 1, kind = 'stable')
+        out[start:start + len(q)] = np.take_along_axis(top, order, axis = 1)
+    return out
+
+def _file_bytes(save):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'index')
+        save(path)
+        return os.path.getsize(path)
+
+
+# -----------------------------
+# Methods
+# -----------------------------
+# Each method builds once and is then queried under every setting in `settings`
+# (e.g. HNSW ef); search returns row indices, best first.
+
+class Exact:
+    name = 'exact'
+
+    def build(self, X):
+        self.X, self.sq_norms = X, (X * X).sum(axis = 1)
+
+    def settings(self):
+        return [{}]
+
+    def search(self, Q, k, setting):
+        return exact_search(self.X, Q, k, self.sq_norms)
+
+    def nbytes(self):
+        return self.X.nbytes
+
+
+class SklearnTree:
+    def __init__(self, cls, leaf_size = 40):
+        self.cls       = cls
+        self.name      = cls.__name__.lower()
+        self.leaf_size = leaf_size
+
+    def build(self, X):
+        self.tree = self.cls(X, leaf_size = self.leaf_size)
+
+    def settings(self):
+        return [{'leaf_size': self.leaf_size}]
+
+    def search(self, Q, k, setting):
+        return self.tree.query(Q, k = k, return_distance = False)
+
+    def nbytes(self):
+        return len(pickle.dumps(self.tree))
+
+
+class Hnsw:
+    name = 'hnsw'
+
+    def __init__(self, M = similarity.HNSW_M, ef_construction = similarity.HNSW_EF_BUILD, efs = (16, 32, 64, 128, 256)):
+        self.M, self.ef_construction, self.efs = M, ef_construction, efs
+
+    def build(self, X):
+        self.index = hnswlib.Index(space = 'l2', dim = X.shape[1])
+        self.index.init_index(max_elements = len(X), ef_construction = self.ef_construction, M = self.M, random_seed = SEED)
+        self.index.add_items(X, np.arange(len(X)))
+
+    def settings(self):
+        return [{'M': self.M, 'ef_construction': self.ef_construction, 'ef': ef} for ef in self.efs]
+
+    def search(self, Q, k, setting):
+        self.index.set_ef(max(setting['ef'], k))
+        return self.index.knn_query(Q, k = k)[0].astype(np.int64)
+
+    def nbytes(self):
+        return _file_bytes(self.index.save_index)
+
+
+class FaissIvf:
+    name = 'faiss-ivf'
+
+    def __init__(self, nprobes = (1, 4, 16, 64)):
+        self.nprobes = nprobes
+
+    def build(self, X):
+        self.nlist     = max(1, int(4 * np.sqrt(len(X))))
+        self.quantizer = faiss.IndexFlatL2(X.shape[1])   # must outlive the index
+        self.index     = faiss.IndexIVFFlat(self.quantizer, X.shape[1], self.nlist)
+        self.index.train(X)
+        self.index.add(X)
+
+    def settings(self):
+        return [{'nlist': self.nlist, 'nprobe': p} for p in self.nprobes if p <= self.nlist]
+
+    def search(self, Q, k, setting):
+        # -1 fills the slots past the last hit when the probed lists hold fewer than k vectors
+        self.index.nprobe = setting['nprobe']
+        return self.index.search(np.ascontiguousarray(Q), k)[1].astype(np.int64)
+
+    def nbytes(self):
+        return faiss.serialize_index(self.index).nbytes
+
+
+class Annoy:
+    name = 'annoy'
+
+    def __init__(self, n_trees = 50, search_ks = (-1, 5000, 20000)):
+        self.n_trees, self.search_ks = n_trees, search_ks
+
+    def build(self, X):
+        self.index = AnnoyIndex(X.shape[1], 'euclidean')
+        self.index.set_seed(SEED)
+        for i, row in enumerate(X):
+            self.index.add_item(i, row)
+        self.index.build(self.n_trees)
+
+    def settings(self):
+        return [{'n_trees': self.n_trees, 'search_k': s} for s in self.search_ks]
+
+    def search(self, Q, k, setting):
+        return np.array([self.index.get_nns_by_vector(q, k, search_k = setting['search_k']) for q in Q], dtype = np.int64)
+
+    def nbytes(self):
+        return _file_bytes(self.index.save)
+
+
+def make_methods(names, efs = None):
+    available = {
+        'exact':     lambda: Exact(),
+        'balltree':  lambda: SklearnTree(BallTree),
+        'kdtree':    lambda: SklearnTree(KDTree),
+        'hnsw':      (lambda: Hnsw(efs = efs) if efs else Hnsw()) if hnswlib is not None else None,
+        'faiss-ivf': (lambda: FaissIvf()) if faiss is not None else None,
+        'annoy':     (lambda: Annoy()) if AnnoyIndex is not None else None,
+    }
+    methods = []
+    for name in names:
+        if name not in available:
+            raise ValueError(f"Unknown method {name!r}")
+        if available[name] is None:
+            print(f"Skipping {name}: library not installed")
+            continue
+        methods.append(available[name]())
+    return methods
+
+
+# -----------------------------
+# Scoring
+# -----------------------------
+def drop_self(labels, rows, k):
+    # Queries are players of the dataset: each asks for k + 1 and loses itself (or its last hit)
+    keep = labels != rows[:, None]
+    keep[keep.all(axis = 1), -1] = False
+    return labels[keep].reshape(len(labels), -1)[:, :k]
+
+# Methods may return fewer than k hits, padded with -1 (faiss IVF when the probed
+# lists are short); a padded slot scores as a miss and is never used as a row index
+
+def recall_at_k(labels, truth):
+    return float(np.mean([len(np.intersect1d(a[a >= 0], b)) / len(b) for a, b in zip(labels, truth)]))
+
+def role_precision_at_k(labels, rows, roles):
+    valid = labels >= 0
+    same  = roles[np.where(valid, labels, 0)] == roles[rows][:, None]
+    return float(np.mean(same & valid))
+
+def knn_jaccard(labels, rows, ids, top_knn_ids):
+    # Overlap with the neighbour lists stored in final_player_df (real dataset only)
+    scores = []
+    for hits, row in zip(labels, rows):
+        stored = set(top_knn_ids[row][:labels.shape[1]])
+        found  = set(ids[hits[hits >= 0]].tolist())
+        if stored:
+            scores.append(len(found & stored) / len(found | stored))
+    return float(np.mean(scores)) if scores else float('nan')
+
+def benchmark(dataset, methods, k = K, n_queries = N_QUERIES, n_single = N_SINGLE, seed = SEED):
+    X     = np.ascontiguousarray(dataset['X'], dtype = np.float32)
+    rng   = np.random.default_rng(seed)
+    rows  = np.sort(rng.choice(len(X), min(n_queries, len(X)), replace = False))
+    Q     = X[rows]
+    truth = drop_self(exact_search(X, Q, k + 1), rows, k)
+    single = min(n_single, len(rows))
+
+    results = []
+    for method in methods:
+        start = time.perf_counter()
+        method.build(X)
+        build_seconds = time.perf_counter() - start
+        # Serialized size is the memory figure: an RSS delta misses allocator reuse
+        # across methods in this process and reads 0 for most builds
+        index_mb = method.nbytes() / 1e6
+
+        for setting in method.settings():
+            start  = time.perf_counter()
+            labels = method.search(Q, k + 1, setting)
+            batch_seconds = time.perf_counter() - start
+
+            latencies = np.empty(single)
+            for i in range(single):
+                start = time.perf_counter()
+                method.search(Q[i:i + 1], k + 1, setting)
+                latencies[i] = time.perf_counter() - start
+
+            labels = drop_self(labels, rows, k)
+            results.append({
+                'dataset':          dataset['name'],
+                'n':                len(X),
+                'dim':              X.shape[1],
+                'method':           method.name,
+                'params':           json.dumps(setting, sort_keys = True),
+                'build_s':          build_seconds,
+                'index_mb':         index_mb,
+                f'recall@{k}':      recall_at_k(labels, truth),
+                f'role_prec@{k}':   role_precision_at_k(labels, rows, dataset['roles']),
+                f'knn_jaccard@{k}': (knn_jaccard(labels, rows, dataset['ids'], dataset['top_knn_ids'])
+                                     if dataset['top_knn_ids'] is not None else float('nan')),
+                'single_qps':       single / latencies.sum(),
+                'single_p50_ms':    float(np.percentile(latencies, 50) * 1e3),
+                'single_p99_ms':    float(np.percentile(latencies, 99) * 1e3),
+                'batch_qps':        len(Q) / batch_seconds,
+            })
+            print(f"{dataset['name']:>8} {method.name:<9} {results[-1]['params']:<50} "
+                  f"recall {results[-1][f'recall@{k}']:.3f}  {results[-1]['batch_qps']:,.0f} q/s batched")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Nearest-neighbour index benchmark over the player matching vectors')
+    parser.add_argument('--sizes', nargs = '+', default = DEFAULT_SIZES,
+                        help = "'real' for final_player_df, or a number of synthetic players")
+    parser.add_argument('--methods', nargs = '+', default = DEFAULT_METHODS)
+    parser.add_argument('-k', type = int, default = K)
+    parser.add_argument('--queries', type = int, default = N_QUERIES)
+    parser.add_argument('--single', type = int, default = N_SINGLE, help = 'Queries timed one at a time')
+    parser.add_argument('--hnsw-ef', type = int, nargs = '+', help = 'ef values to sweep')
+    parser.add_argument('--seed', type = int, default = SEED)
+    parser.add_argument('--output', help = 'Write the results table and run config to this JSON file')
+    args = parser.parse_args()
+
+    base    = real_dataset()
+    methods = make_methods(args.methods, args.hnsw_ef)
+    results = []
+    for size in args.sizes:
+        dataset = base if size == 'real' else scale_up(base, int(size), seed = args.seed)
+        results.extend(benchmark(dataset, methods, args.k, args.queries, args.single, args.seed))
+
+    table = pd.DataFrame(results)
+    with pd.option_context('display.width', 250, 'display.max_columns', None, 'display.max_colwidth', 50):
+        print(table.drop(columns = ['dim']).to_string(index = False, float_format = lambda v: f"{v:.3f}"))
+
+    if args.output:
+        config = dict(vars(args), commit = git_commit(), cpu_count = os.cpu_count(), noise = NOISE,
+                      libraries = {'hnswlib': hnswlib is not None, 'faiss': faiss is not None,
+                                   'annoy': AnnoyIndex is not None})
+        with open(args.output, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent = 2)
+        print(f"Wrote {len(results)} rows to {args.output}")
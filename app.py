@@ -1,59 +1,218 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
-import pandas as pd
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
 import os
-import ast
-from datetime import datetime
+import time
+import threading
+import concurrent.futures
+import pandas as pd
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+import player_store
+import similarity
+import density_plots
+import name_search
+import response_cache
+
+app   = Flask(__name__, template_folder = 'templates', static_folder = 'static')
+store = player_store.open_store()
+
+# The ANN engine is only needed for filtered queries, so it is loaded on first use
+engine      = None
+engine_lock = threading.Lock()
+
+def get_engine():
+    global engine
+    with engine_lock:
+        if engine is None:
+            engine = similarity.open_engine()
+    return engine
+
+# Density plots are rendered on first request, so the positions are only loaded then too
+plots      = None
+plots_lock = threading.Lock()
+
+def get_plots():
+    global plots
+    with plots_lock:
+        if plots is None and os.path.exists(density_plots.POSITIONS_PATH):
+            plots = density_plots.DensityPlots()
+    return plots
+
+# Name search index; the page asks /search as the user types instead of shipping every name
+names = name_search.NameIndex.from_store(store)
+
+# Serialized /player and /similar_players responses for the loaded dataset
+DATASET_POLL_SECONDS = float(os.environ.get('DATASET_POLL_SECONDS', 30))
+
+responses       = response_cache.ResponseCache(store.version, app.json.dumps)
+dataset_lock    = threading.Lock()
+dataset_watcher = None   # pid of the process the watcher thread was started in
+
+def reload_dataset():
+    # Swaps in a regenerated player table, whether this process rebuilt the store or
+    # another worker did; the new version empties the response cache
+    global store, names
+    if player_store.refresh_store(player_store.SOURCE_PATH, store.path) == store.version:
+        return
+    new_store = player_store.PlayerStore(store.path)
+    new_names = name_search.NameIndex.from_store(new_store)
+    store, names = new_store, new_names
+    responses.set_version(new_store.version)
+    print(f"Loaded new player dataset ({len(new_store)} players, version {new_store.version})")
+
+    # A loaded engine takes the new table as an upsert, so streamed players stay in it
+    with engine_lock:
+        ann = engine
+    if ann is not None:
+        n_new = ann.add_players(player_store.load_source(player_store.SOURCE_PATH), similarity.load_spatial_features())
+        ann.save()
+        print(f"Similarity engine updated ({n_new} new players, {len(ann)} total)")
 
-app = Flask(__name__, template_folder = 'templates', static_folder = 'static')
-df  = pd.read_csv('final_player_df.csv')
-df.set_index('id', inplace = True)
+def watch_dataset():
+    while True:
+        time.sleep(DATASET_POLL_SECONDS)
+        try:
+            reload_dataset()
+        except Exception as e:
+            # Keep serving the loaded dataset; the next poll tries again
+            print(f"Dataset reload failed: {e}")
 
-# Create player name to ID dictionary
-player_dict = {row['full_name']: idx for idx, row in df.iterrows()}
+@app.before_request
+def start_dataset_watcher():
+    # One watcher thread per worker process, started on its first request so that
+    # workers forked from a preloaded app each get their own
+    global dataset_watcher
+    if dataset_watcher == os.getpid() or DATASET_POLL_SECONDS <= 0:
+        return
+    with dataset_lock:
+        if dataset_watcher != os.getpid():
+            dataset_watcher = os.getpid()
+            threading.Thread(target = watch_dataset, name = 'dataset-watcher', daemon = True).start()
 
 @app.route("/")
 def home():
-    return render_template('index.html', player_names = list(player_dict.keys()))
+    return render_template('index.html')
+
+@app.route('/search')
+def search_players():
+    hits = names.search(request.args.get('q', ''),
+                        limit = request.args.get('limit', name_search.DEFAULT_LIMIT, type = int))
+    return jsonify({'results': hits})
+
+def player_payload(player_id):
+    row = store.row_of(player_id)
+    if row is None:
+        return {'error': 'Player not found'}, 404
+    # Display fields (contract date, market value, density plot url) are preformatted in the store
+    return store.record(row), 200
+
+def similar_payload(player_id):
+    row = store.row_of(player_id)
+    if row is None:
+        return {'error': 'Player not found'}, 404
+    return {'similar_players': store.similar([row])[0]}, 200
 
 @app.route('/player/<int:player_id>')
 def get_player(player_id):
-    if player_id not in df.index:
-        return jsonify({'error': 'Player not found'}), 404
-    row = df.loc[player_id].drop('top_knn_ids').to_dict()
-    row['density_plot_url']         = f"/static/density_plots/{player_id}.png"
-    row['contract_expiration_date'] = datetime.strptime(row['contract_expiration_date'],'%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d')
-    row['market_value_in_eur']      = "€{:,.0f}".format(row['market_value_in_eur'])
-    return jsonify(row)
+    return responses.respond('player', player_id, lambda: player_payload(player_id), request, Response)
 
 @app.route('/similar_players/<int:player_id>')
 def get_similar(player_id):
-    if player_id not in df.index:
+    # Plain requests are served from the precomputed neighbor matrix
+    if not request.args:
+        return responses.respond('similar_players', player_id, lambda: similar_payload(player_id), request, Response)
+
+    # k / role / max_value go through the live similarity engine
+    ann = get_engine()
+    if player_id not in ann:
         return jsonify({'error': 'Player not found'}), 404
 
-    top_ids = pd.unique(df.loc[player_id]['top_knn_ids'])
+    hits = ann.query(player_id,
+                     k         = request.args.get('k', 10, type = int),
+                     role      = request.args.get('role'),
+                     max_value = request.args.get('max_value', type = float))
 
+    rows    = store.rows_of([pid for pid, _ in hits])
+    records = iter(store.take(rows[rows >= 0]))
     players = []
-    for sid in top_ids:
-        if sid in df.index:
-            row = df.loc[sid]
-            if isinstance(row, pd.DataFrame): # If df.loc[sid] returns multiple rows, take the first one
-                row = row.iloc[0]
-
-            players.append({
-                'id': int(sid),
-                'full_name': str(row['full_name']),
-                'club': str(row['club']),
-                'role': str(row['role']),
-                'image_url': str(row['image_url'])
-            })
+    for (pid, dist), row in zip(hits, rows):
+        # Players streamed into the engine may not be in the store yet
+        player = next(records) if row >= 0 else {'id': pid}
+        player['distance'] = dist
+        players.append(player)
 
     return jsonify({'similar_players': players})
 
+@app.route('/similar_players/players', methods=['POST'])
+def add_similar_players():
+    # Upserts streamed player stats (final_player_df or process_data() columns) into
+    # the similarity engine and persists the grown index
+    players = (request.json or {}).get('players') or []
+    if not players:
+        return jsonify({'added': 0, 'updated': 0})
+    ann = get_engine()
+    try:
+        n_new = ann.add_players(pd.DataFrame.from_records(players))
+    except (KeyError, ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid players: {e}'}), 400
+    ann.save()
+    return jsonify({'added': n_new, 'updated': len({player.get('id') for player in players}) - n_new})
+
+@app.route('/similar_players/batch', methods=['POST'])
+def get_similar_batch():
+    try:
+        body = request.json or {}
+        ids  = body.get('ids', []) if isinstance(body, dict) else None
+        if not isinstance(ids, list):
+            raise TypeError("expected a JSON object with a list of ids")
+        player_ids = [int(pid) for pid in ids]
+        rows       = store.rows_of(player_ids)
+    except (TypeError, ValueError, OverflowError) as e:
+        # Ids past int64 overflow in rows_of
+        return jsonify({'error': f'Invalid ids: {e}'}), 400
+    found = rows >= 0
+
+    similar   = store.similar(rows[found])
+    found_ids = [pid for pid, ok in zip(player_ids, found) if ok]
+    return jsonify({
+        'similar_players': {str(pid): players for pid, players in zip(found_ids, similar)},
+        'not_found': [pid for pid, ok in zip(player_ids, found) if not ok]
+    })
+
+@app.route('/density_plot/<int:player_id>.png')
+def get_density_plot(player_id):
+    renderer = get_plots()
+    etag     = renderer.etag(player_id) if renderer is not None else None
+    if etag is None:
+        return jsonify({'error': 'No density plot for this player'}), 404
+
+    if etag in request.if_none_match:
+        response = Response(status = 304)
+    else:
+        try:
+            _, png = renderer.get(player_id)
+        except concurrent.futures.TimeoutError:
+            # The render keeps going in the pool; the retry is served from the cache
+            return (jsonify({'status': 'Density plot is still rendering'}), 202,
+                    {'Retry-After': str(density_plots.RETRY_AFTER), 'Cache-Control': 'no-store'})
+        except Exception as e:
+            # A failed render is not cached, so a later request tries again
+            print(f"Density plot for player {player_id} failed: {e!r}")
+            return jsonify({'error': 'Density plot could not be rendered'}), 500, {'Cache-Control': 'no-store'}
+        response = Response(png, mimetype = 'image/png')
+
+    response.set_etag(etag)
+    response.cache_control.public  = True
+    response.cache_control.max_age = density_plots.MAX_AGE
+    return response
+
 @app.route('/get_player_id', methods=['POST'])
 def get_player_id():
-    name = request.json.get("name")
-    player_id = player_dict.get(name)
-    return jsonify({"player_id": player_id})
+    # Several players can share a name; player_id stays the first one for older clients
+    player_ids = names.exact(request.json.get("name") or '')
+    return jsonify({"player_id": player_ids[0] if player_ids else None, "player_ids": player_ids})
+
+@app.route('/metrics')
+def metrics():
+    return Response(generate_latest(), mimetype = CONTENT_TYPE_LATEST)
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
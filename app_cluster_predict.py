@@ -1,15 +1,36 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+from typing import Dict, List
+import os
+import asyncio
 import mlflow
-import mlflow.sklearn
-import pandas as pd
 from prometheus_fastapi_instrumentator import Instrumentator
+from batching import MicroBatcher, QueueFullError
+import features
+from model_cache import ModelManager
+import forest
+import drift
+from prediction_table import PredictionTable
 
-# Configure MLflow tracking URI
-mlflow.set_tracking_uri("http://129.114.26.77:8000")
+# Configure MLflow tracking URI (MLFLOW_TRACKING_URI can point at a local file store)
+mlflow.set_tracking_uri(os.environ.get("MLFLOW_TRACKING_URI", "http://129.114.26.77:8000"))
 
-# Load latest model from MLflow by name
-model = mlflow.sklearn.load_model("models:/player_cluster_model/Production")
+def load_model(path):
+    # Each model version carries the reference profile of the data it was trained on
+    model = forest.load_model(path)
+    model.drift_reference = drift.load_reference(path)
+    return model
+
+def activate(model, version):
+    # Runs once a version has warmed up and been swapped in, so a failed load never
+    # leaves the monitor on the profile of a model that is not serving
+    monitor.set_reference(getattr(model, "drift_reference", None))
+    predictions.rebuild_async(model, version)
+
+# Production model from the local content-addressed cache (downloaded once per version),
+# served as a flattened forest; a watcher thread swaps in newly promoted versions,
+# and every activated version rescores the player table in the background
+models = ModelManager("player_cluster_model", "Production", loader=load_model, on_activate=activate)
 
 # Define FastAPI app
 app = FastAPI(
@@ -33,19 +54,100 @@ class PlayerRequest(BaseModel):
 class ClusterPredictionResponse(BaseModel):
     cluster: int
 
-@app.post("/predict-cluster", response_model=ClusterPredictionResponse)
-def predict_cluster(player: PlayerRequest):
-    try:
-        # Convert input to DataFrame
-        player_df = pd.DataFrame([player.dict()])
+class BatchPlayerRequest(BaseModel):
+    players: List[PlayerRequest]
+
+class BatchClusterPredictionResponse(BaseModel):
+    clusters: List[int]
+
+class PlayerClusterResponse(BaseModel):
+    player_id: int
+    cluster: int
+    probabilities: Dict[str, float]
+    model_version: str
+    source: str
+
+# Column order of the feature rows handed to the model
+FEATURE_NAMES = list(PlayerRequest.__fields__)
+
+# Streaming sketches of the request features, compared against the reference on a schedule
+monitor = drift.DriftMonitor(FEATURE_NAMES)
+# Precomputed (player id, model version) -> cluster for every player in the source table
+predictions = PredictionTable(models.name)
+models.load_initial()
 
-        # Run inference
-        cluster = model.predict(player_df)[0]
+def to_rows(players):
+    return features.as_matrix([p.dict() for p in players], FEATURE_NAMES)
 
-        return ClusterPredictionResponse(cluster=int(cluster))
+# Concurrent requests are stacked into a single predict call
+batcher = MicroBatcher(lambda batch: models.predict(batch))
 
+@app.on_event("startup")
+async def start_batcher():
+    await batcher.start()
+    models.start_watcher()
+    monitor.start()
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    monitor.stop()
+    models.stop_watcher()
+    await batcher.stop()
+
+async def run_inference(players):
+    try:
+        rows = to_rows(players)
+        monitor.observe(rows)
+        return await batcher.submit(rows)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        # The request features do not fit the serving model, e.g. a different feature count
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Inference error: {str(e)}")
 
+@app.post("/predict-cluster", response_model=ClusterPredictionResponse)
+async def predict_cluster(player: PlayerRequest):
+    clusters = await run_inference([player])
+    return ClusterPredictionResponse(cluster=int(clusters[0]))
+
+@app.post("/predict-cluster/batch", response_model=BatchClusterPredictionResponse)
+async def predict_cluster_batch(request: BatchPlayerRequest):
+    if not request.players:
+        return BatchClusterPredictionResponse(clusters=[])
+    clusters = await run_inference(request.players)
+    return BatchClusterPredictionResponse(clusters=[int(c) for c in clusters])
+
+@app.get("/predict-cluster/by-id/{player_id}", response_model=PlayerClusterResponse)
+async def predict_cluster_by_id(player_id: int):
+    model, version = models.model, models.version
+    hit = predictions.lookup(player_id, version)
+    if hit is not None:
+        cluster, classes, proba = hit
+        source = "table"
+    else:
+        # Unseen player, or features changed since the table was built: score live
+        row = predictions.features_of(player_id)
+        if row is None and not predictions.ready:
+            raise HTTPException(status_code=503, detail="Player features are not loaded yet",
+                                headers={"Retry-After": "5"})
+        if row is None:
+            raise HTTPException(status_code=404, detail=f"Player {player_id} not found")
+        try:
+            proba = (await asyncio.get_running_loop().run_in_executor(None, model.predict_proba, row))[0]
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Inference error: {str(e)}")
+        classes = model.classes_
+        cluster = classes[proba.argmax()]
+        source = "live"
+    return PlayerClusterResponse(player_id=player_id, cluster=int(cluster),
+                                 probabilities={str(c): float(p) for c, p in zip(classes, proba)},
+                                 model_version=version, source=source)
+
+@app.get("/model-info")
+def model_info():
+    return {"name": models.name, "stage": models.stage, "version": models.version}
+
 # Enable Prometheus metrics
 Instrumentator().instrument(app).expose(app)
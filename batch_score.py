@@ -0,0 +1,155 @@
+import os
+import time
+import shutil
+import resource
+import argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from threadpoolctl import threadpool_limits
+import features
+import forest
+
+# -----------------------------
+# Config
+# -----------------------------
+CHUNK_ROWS    = int(os.environ.get('BATCH_SCORE_CHUNK_ROWS', 50000))
+SCORE_WORKERS = int(os.environ.get('BATCH_SCORE_WORKERS', os.cpu_count() or 1))
+IN_FLIGHT     = 2   # chunks queued per worker; with the chunk size this bounds peak memory
+REPORT_EVERY  = 10  # seconds between progress lines
+
+
+# -----------------------------
+# Model
+# -----------------------------
+def resolve_model(name, stage, version = None):
+    # Local directory of a registry version, through the content-addressed model cache
+    from mlflow.tracking import MlflowClient
+    from model_cache import ModelCache
+    if version is None:
+        versions = MlflowClient().get_latest_versions(name, stages = [stage])
+        if not versions:
+            raise RuntimeError(f"No {stage} version registered for {name}")
+        version = max(versions, key = lambda v: int(v.version)).version
+    return ModelCache().fetch(name, version), str(version)
+
+
+# -----------------------------
+# Worker side
+# -----------------------------
+_worker = {}
+
+def _init_worker(model_path, model_version, output_dir, partition_by):
+    # One BLAS / OpenMP thread per process; the pool provides the parallelism
+    threadpool_limits(1)
+    _worker.update(model = forest.load_model(model_path), model_version = model_version,
+                   output_dir = output_dir, partition_by = partition_by)
+
+def score_chunk(task):
+    # Transform, predict and write one chunk; only the row count goes back to the parent
+    index, batch = task
+    df    = batch.to_pandas()
+    model = _worker['model']
+    proba = model.predict_proba(features.transform(df))
+    best  = np.argmax(proba, axis = 1)
+
+    columns = {features.ID_COLUMN: df[features.ID_COLUMN].to_numpy(),
+               'cluster': np.asarray(model.classes_).take(best),
+               'probability': proba[np.arange(len(proba)), best].astype(np.float32),
+               'model_version': np.full(len(df), _worker['model_version'])}
+    for col in _worker['partition_by']:
+        columns[col] = df[col].to_numpy()
+    table = pa.table(columns)
+
+    # Named by chunk number inside a fresh staging directory, see score_file
+    pq.write_to_dataset(table, _worker['output_dir'], partition_cols = _worker['partition_by'] or None,
+                        basename_template = f"part-{index:06d}-{{i}}.parquet",
+                        existing_data_behavior = 'overwrite_or_ignore')
+    return len(table)
+
+
+# -----------------------------
+# Driver
+# -----------------------------
+def read_chunks(path, columns, chunk_rows = CHUNK_ROWS):
+    # Row groups streamed in chunk_rows slices, reading only the projected columns
+    source = pq.ParquetFile(path)
+    for batch in source.iter_batches(batch_size = chunk_rows, columns = columns):
+        yield batch
+
+def _swap_in(staging_dir, output_dir):
+    # The previous run's dataset is replaced as a whole, so no file of an older run
+    # (other chunk size, other model version) is left next to the new ones
+    old_dir = f"{output_dir}.old-{os.getpid()}"
+    if os.path.exists(output_dir):
+        os.rename(output_dir, old_dir)
+    os.rename(staging_dir, output_dir)
+    shutil.rmtree(old_dir, ignore_errors = True)
+
+def score_file(input_path, output_dir, model_path, model_version, partition_by = (), chunk_rows = CHUNK_ROWS,
+               workers = SCORE_WORKERS):
+    partition_by = list(partition_by)
+    columns = [features.ID_COLUMN] + list(features.FEATURE_COLUMNS) + [c for c in partition_by if c != features.ID_COLUMN]
+    total   = pq.ParquetFile(input_path).metadata.num_rows
+
+    # Chunks are written to a staging directory next to the output and swapped in at
+    # the end; a failed run leaves the previous dataset untouched
+    output_dir  = output_dir.rstrip(os.sep)
+    staging_dir = f"{output_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(staging_dir, ignore_errors = True)
+    os.makedirs(staging_dir)
+
+    start, rows, next_report = time.perf_counter(), 0, time.perf_counter() + REPORT_EVERY
+    try:
+        with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker,
+                                 initargs = (model_path, model_version, staging_dir, partition_by)) as pool:
+            pending = set()
+            for index, batch in enumerate(read_chunks(input_path, columns, chunk_rows)):
+                # Reading waits for a free slot, so at most workers * IN_FLIGHT chunks are in memory
+                if len(pending) >= workers * IN_FLIGHT:
+                    done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                    rows += sum(f.result() for f in done)
+                pending.add(pool.submit(score_chunk, (index, batch)))
+                del batch
+
+                if time.perf_counter() >= next_report:
+                    elapsed = time.perf_counter() - start
+                    print(f"{rows}/{total} rows, {rows / elapsed:,.0f} rows/s")
+                    next_report = time.perf_counter() + REPORT_EVERY
+            rows += sum(f.result() for f in wait(pending).done)
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors = True)
+        raise
+    _swap_in(staging_dir, output_dir)
+
+    elapsed = time.perf_counter() - start
+    return {'rows': rows, 'seconds': elapsed, 'rows_per_second': rows / elapsed if elapsed else float('nan')}
+
+
+if __name__ == '__main__':
+    import model_cache
+    parser = argparse.ArgumentParser(description = 'Score a Parquet player table in chunks into partitioned Parquet')
+    parser.add_argument('--input', default = features.SOURCE_PATH)
+    parser.add_argument('--output', default = 'scored_players', help = 'Output dataset directory')
+    parser.add_argument('--model-path', help = 'Local model directory (default: the registry version below)')
+    parser.add_argument('--model-name', default = model_cache.MODEL_NAME)
+    parser.add_argument('--stage', default = model_cache.MODEL_STAGE)
+    parser.add_argument('--version', help = 'Registry version (default: latest in --stage)')
+    parser.add_argument('--partition-by', nargs = '*', default = [], help = 'Hive-style partition columns, e.g. league season')
+    parser.add_argument('--chunk-rows', type = int, default = CHUNK_ROWS)
+    parser.add_argument('--workers', type = int, default = SCORE_WORKERS)
+    args = parser.parse_args()
+
+    if args.model_path:
+        model_path, model_version = args.model_path, args.version or 'local'
+    else:
+        model_path, model_version = resolve_model(args.model_name, args.stage, args.version)
+    # Flattened once here, so workers load the .flat.npz instead of each unpickling the forest
+    forest.load_model(model_path)
+
+    stats = score_file(args.input, args.output, model_path, model_version, args.partition_by, args.chunk_rows,
+                       args.workers)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Scored {stats['rows']} rows in {stats['seconds']:.2f}s ({stats['rows_per_second']:,.0f} rows/s) "
+          f"with {args.workers} workers -> {args.output} (driver peak RSS {peak_mb:.0f} MB)")
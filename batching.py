@@ -0,0 +1,110 @@
+import os
+import time
+import asyncio
+import numpy as np
+from prometheus_client import Gauge, Histogram
+
+# -----------------------------
+# Config
+# -----------------------------
+MAX_BATCH_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 64))
+MAX_WAIT_MS    = float(os.environ.get('BATCH_MAX_WAIT_MS', 5))
+MAX_QUEUE      = int(os.environ.get('BATCH_MAX_QUEUE', 1024))
+
+# -----------------------------
+# Prometheus metrics
+# -----------------------------
+batch_size_rows = Histogram('inference_batch_size', 'Rows per model predict call',
+                            buckets = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512])
+queue_depth     = Gauge('inference_queue_depth', 'Requests waiting for the next predict call')
+queue_wait      = Histogram('inference_queue_wait_seconds', 'Time a request waits before its batch is dispatched',
+                            buckets = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25])
+predict_latency = Histogram('inference_predict_seconds', 'Time spent in a single batched predict call')
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class MicroBatcher:
+    # Collects concurrent requests for up to max_wait_ms or max_batch_size rows,
+    # runs one predict call on the stacked array and fans the results back out.
+
+    def __init__(self, predict_fn, max_batch_size = MAX_BATCH_SIZE, max_wait_ms = MAX_WAIT_MS, max_queue = MAX_QUEUE):
+        self.predict_fn     = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait       = max_wait_ms / 1000
+        self.max_queue      = max_queue
+        self._queue         = None
+        self._worker        = None
+
+    async def start(self):
+        self._queue  = asyncio.Queue(maxsize = self.max_queue)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, rows):
+        # rows: (n, n_features) array; resolves to the n predictions for those rows
+        rows   = np.asarray(rows, dtype = np.float64).reshape(-1, np.shape(rows)[-1])
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((rows, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Inference queue is full ({self.max_queue} pending requests)")
+        queue_depth.set(self._queue.qsize())
+        return await future
+
+    async def _collect(self):
+        items    = [await self._queue.get()]
+        n_rows   = len(items[0][0])
+        deadline = time.perf_counter() + self.max_wait
+
+        while n_rows < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            items.append(item)
+            n_rows += len(item[0])
+
+        queue_depth.set(self._queue.qsize())
+        return items
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+
+            dispatched = time.perf_counter()
+            for _, _, enqueued in items:
+                queue_wait.observe(dispatched - enqueued)
+
+            batch = np.ascontiguousarray(np.concatenate([rows for rows, _, _ in items]))
+            batch_size_rows.observe(len(batch))
+
+            try:
+                with predict_latency.time():
+                    # Keep the event loop free while sklearn runs
+                    preds = await loop.run_in_executor(None, self.predict_fn, batch)
+            except Exception as e:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            start = 0
+            for rows, future, _ in items:
+                if not future.done():
+                    future.set_result(preds[start:start + len(rows)])
+                start += len(rows)
@@ -0,0 +1,171 @@
+import os
+import time
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.mixture import GaussianMixture
+from sklearn.metrics import silhouette_score, davies_bouldin_score, calinski_harabasz_score
+from threadpoolctl import threadpool_limits
+import features
+import player_store
+import similarity
+
+# -----------------------------
+# Config
+# -----------------------------
+EMBEDDING_DIR     = os.path.join(features.CACHE_DIR, 'embeddings')
+SWEEP_WORKERS     = int(os.environ.get('SWEEP_WORKERS', os.cpu_count() or 1))
+SILHOUETTE_SAMPLE = int(os.environ.get('SILHOUETTE_SAMPLE', 5000))  # exact silhouette is O(n^2)
+SEED              = 7   # same seed as "4. Player Matching.ipynb"
+
+EMBEDDINGS = ['raw', 'pca', 'umap', 'tsne']
+ALGORITHMS = ['kmeans', 'minibatch', 'gmm']
+
+
+# -----------------------------
+# Matching feature matrix
+# -----------------------------
+def matching_matrix(df = None, spatial = None):
+    # The matrix the matching notebook clusters (same one the similarity engine searches)
+    df      = player_store.load_source() if df is None else df
+    spatial = similarity.load_spatial_features() if spatial is None else spatial
+    return np.ascontiguousarray(similarity.matching_vectors(df, spatial)[1])
+
+def matrix_hash(X):
+    digest = hashlib.sha256(f"{X.dtype}:{X.shape}".encode())
+    digest.update(np.ascontiguousarray(X).tobytes())
+    return digest.hexdigest()[:24]
+
+
+# -----------------------------
+# Cached embeddings
+# -----------------------------
+def _project(X, method):
+    if method == 'pca':
+        from sklearn.decomposition import PCA
+        return PCA(n_components = 2).fit_transform(X)
+    if method == 'tsne':
+        from sklearn.manifold import TSNE
+        return TSNE(n_components = 2, random_state = SEED).fit_transform(X)
+    if method == 'umap':
+        import umap
+        return umap.UMAP(random_state = SEED).fit_transform(X)
+    raise ValueError(f"Unknown embedding {method!r}")
+
+def embedding_path(X, method, cache_dir = EMBEDDING_DIR):
+    # Projections are the slow part of the notebook; each one is computed once per feature matrix
+    if method == 'raw':
+        path = os.path.join(cache_dir, f"{matrix_hash(X)}-raw.npy")
+        if not os.path.exists(path):
+            os.makedirs(cache_dir, exist_ok = True)
+            features._save(path, X)
+        return path
+
+    path = os.path.join(cache_dir, f"{matrix_hash(X)}-{method}-{SEED}.npy")
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        embedding = _project(X, method).astype(np.float32)
+        os.makedirs(cache_dir, exist_ok = True)
+        features._save(path, embedding)
+        print(f"Computed {method} embedding in {time.perf_counter() - start:.1f}s, cached at {path}")
+    return path
+
+
+# -----------------------------
+# Worker side
+# -----------------------------
+_embeddings = {}
+
+def _init_worker():
+    # One BLAS / OpenMP thread per process; the pool provides the parallelism
+    threadpool_limits(1)
+
+def _open(path):
+    if path not in _embeddings:
+        _embeddings[path] = np.load(path, mmap_mode = 'r')
+    return _embeddings[path]
+
+def make_clusterer(algorithm, k, random_state = SEED):
+    if algorithm == 'kmeans':
+        return KMeans(n_clusters = k, random_state = random_state)
+    if algorithm == 'minibatch':
+        return MiniBatchKMeans(n_clusters = k, batch_size = 1024, n_init = 3, random_state = random_state)
+    if algorithm == 'gmm':
+        return GaussianMixture(n_components = k, random_state = random_state)
+    raise ValueError(f"Unknown algorithm {algorithm!r}")
+
+def score_labels(X, labels, sample_size = SILHOUETTE_SAMPLE, random_state = SEED):
+    if len(np.unique(labels)) < 2:
+        return np.nan, np.nan, np.nan
+    sample = sample_size if len(X) > sample_size else None
+    return (silhouette_score(X, labels, sample_size = sample, random_state = random_state),
+            davies_bouldin_score(X, labels), calinski_harabasz_score(X, labels))
+
+def run_fit(task):
+    X = np.asarray(_open(task['path']))
+    model = make_clusterer(task['algorithm'], task['k'])
+    start = time.perf_counter()
+    labels = model.fit_predict(X)
+    fit_seconds = time.perf_counter() - start
+    silhouette, davies_bouldin, calinski_harabasz = score_labels(X, labels, task['silhouette_sample'])
+    # GMMs have no inertia; the negative log-likelihood plays the elbow role for them
+    inertia = model.inertia_ if hasattr(model, 'inertia_') else -model.score(X) * len(X)
+    return {'embedding': task['embedding'], 'algorithm': task['algorithm'], 'k': task['k'],
+            'inertia': float(inertia), 'silhouette': float(silhouette), 'davies_bouldin': float(davies_bouldin),
+            'calinski_harabasz': float(calinski_harabasz), 'fit_seconds': fit_seconds}
+
+
+# -----------------------------
+# Sweep
+# -----------------------------
+def sweep(X, embeddings = ('raw',), algorithms = ('kmeans',), ks = range(2, 61), workers = SWEEP_WORKERS,
+          silhouette_sample = SILHOUETTE_SAMPLE):
+    # One row per (embedding, algorithm, k); largest k first so the slow fits do not trail at the end
+    paths = {method: embedding_path(X, method) for method in embeddings}
+    tasks = [{'embedding': method, 'path': paths[method], 'algorithm': algorithm, 'k': k,
+              'silhouette_sample': silhouette_sample}
+             for method in embeddings for algorithm in algorithms for k in sorted(ks, reverse = True)]
+
+    with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker) as pool:
+        results = list(pool.map(run_fit, tasks))
+    return (pd.DataFrame(results)
+            .sort_values(['embedding', 'algorithm', 'k'])
+            .reset_index(drop = True))
+
+def best_per_group(results):
+    # Highest silhouette for each embedding / algorithm pair
+    rows = results.dropna(subset = ['silhouette']).groupby(['embedding', 'algorithm'])['silhouette'].idxmax()
+    return results.loc[rows].reset_index(drop = True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Clustering model selection sweep over the matching feature matrix')
+    parser.add_argument('--embeddings', nargs = '+', default = ['raw', 'pca'], choices = EMBEDDINGS)
+    parser.add_argument('--algorithms', nargs = '+', default = ['kmeans'], choices = ALGORITHMS,
+                        help = 'minibatch = MiniBatchKMeans, for large k ranges or many players')
+    parser.add_argument('--k-min', type = int, default = 2)
+    parser.add_argument('--k-max', type = int, default = 60)
+    parser.add_argument('--workers', type = int, default = SWEEP_WORKERS)
+    parser.add_argument('--silhouette-sample', type = int, default = SILHOUETTE_SAMPLE)
+    parser.add_argument('--output', help = 'Write the full results table to this CSV')
+    args = parser.parse_args()
+
+    X = matching_matrix()
+    print(f"Matching matrix: {X.shape[0]} players x {X.shape[1]} features ({matrix_hash(X)})")
+
+    start   = time.perf_counter()
+    results = sweep(X, args.embeddings, args.algorithms, range(args.k_min, args.k_max + 1),
+                    args.workers, args.silhouette_sample)
+    print(f"{len(results)} fits in {time.perf_counter() - start:.1f}s on {args.workers} workers\n")
+
+    with pd.option_context('display.max_rows', None, 'display.width', 150):
+        print(results.to_string(index = False, float_format = lambda v: f"{v:.4f}"))
+        print("\nBest k by silhouette:")
+        print(best_per_group(results).to_string(index = False, float_format = lambda v: f"{v:.4f}"))
+
+    if args.output:
+        results.to_csv(args.output, index = False)
+        print(f"\nWrote results to {args.output}")
@@ -0,0 +1,244 @@
+import os
+import io
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+import numpy as np
+
+# -----------------------------
+# Config
+# -----------------------------
+POSITIONS_PATH = os.environ.get('PLAYER_POSITIONS_PATH', 'player_positions.npz')
+CACHE_DIR      = os.environ.get('DENSITY_PLOT_CACHE_DIR', 'density_plot_cache')
+MEMORY_BYTES   = int(float(os.environ.get('DENSITY_PLOT_MEMORY_MB', 64)) * 2**20)
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 2))
+RENDER_WAIT    = float(os.environ.get('RENDER_WAIT_SECONDS', 0.5))  # longer renders get a 202, not a blocked worker
+RETRY_AFTER    = 1
+MAX_AGE        = 24 * 3600
+MIN_EVENTS     = 5   # same cut-off as the heatmap notebook
+STYLE_VERSION  = 1   # part of every ETag; bump when the plot style below changes
+
+
+# -----------------------------
+# Event positions
+# -----------------------------
+class PositionStore:
+    # Reads the player_positions.npz written by source/heatmap_features.py
+    def __init__(self, path = POSITIONS_PATH):
+        with np.load(path) as data:
+            self.ids     = data['ids']
+            self.offsets = data['offsets']
+            self.x       = data['x']
+            self.y       = data['y']
+
+    def __contains__(self, player_id):
+        return self.positions(player_id) is not None
+
+    def positions(self, player_id):
+        i = np.searchsorted(self.ids, player_id)
+        if i == len(self.ids) or self.ids[i] != player_id:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if end - start < MIN_EVENTS:
+            return None
+        return self.x[start:end], self.y[start:end]
+
+def plot_etag(x, y):
+    # Content hash of what gets drawn, so new events for a player invalidate old renders
+    digest = hashlib.sha256(f"v{STYLE_VERSION}".encode())
+    digest.update(x.tobytes())
+    digest.update(y.tobytes())
+    return digest.hexdigest()[:32]
+
+
+# -----------------------------
+# Rendering (runs in the pool)
+# -----------------------------
+_pitch = None
+
+def render_png(x, y):
+    # Same figure as "3. Visualize Heatmap.ipynb"
+    global _pitch
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LinearSegmentedColormap
+    from mplsoccer import Pitch
+
+    if _pitch is None:
+        _pitch = Pitch(pitch_type = 'wyscout', corner_arcs = True)
+    custom_cmap = LinearSegmentedColormap.from_list("custom_orange_red", ["white", "blue", "navy"])
+
+    fig, ax = _pitch.draw(figsize = (10, 6))
+    try:
+        _pitch.kdeplot(x, y, ax = ax, cmap = custom_cmap, shade = True, levels = 100, alpha = 0.4)
+        ax.set_xticks(range(0, 101, 10))
+        ax.set_yticks(range(0, 101, 10))
+        ax.grid(color = 'black', linestyle = '--', linewidth = 0.5, alpha = 0.4)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format = 'png', dpi = 150, bbox_inches = 'tight')
+    finally:
+        plt.close(fig)
+    return buffer.getvalue()
+
+
+# -----------------------------
+# Caches
+# -----------------------------
+class LRUCache:
+    # Size-bounded (in bytes) in-memory tier
+    def __init__(self, max_bytes = MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes    = 0
+        self.items     = OrderedDict()
+        self.lock      = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self.items[key] = value
+            self.nbytes    += len(value)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.items.popitem(last = False)
+                self.nbytes -= len(evicted)
+
+
+class DensityPlots:
+    # Memory LRU -> disk (<cache>/<player id>-<etag>.png) -> render in a process pool.
+    # Concurrent requests for the same plot share one render.
+
+    def __init__(self, positions = None, cache_dir = CACHE_DIR, memory_bytes = MEMORY_BYTES, workers = RENDER_WORKERS):
+        self.positions = positions or PositionStore()
+        self.cache_dir = cache_dir
+        self.memory    = LRUCache(memory_bytes)
+        self.workers   = workers
+        self.stats     = {'memory': 0, 'disk': 0, 'rendered': 0}
+        self._pool     = None
+        self._pending  = {}
+        self._lock     = threading.Lock()
+        os.makedirs(cache_dir, exist_ok = True)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn, not fork: the web process has threads running
+                self._pool = ProcessPoolExecutor(max_workers = self.workers,
+                                                 mp_context = multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _disk_path(self, player_id, etag):
+        return os.path.join(self.cache_dir, f"{player_id}-{etag}.png")
+
+    def etag(self, player_id):
+        positions = self.positions.positions(player_id)
+        return None if positions is None else plot_etag(*positions)
+
+    def _finish(self, player_id, etag, future):
+        # Stored before the pending entry goes away, so no request renders it twice
+        if future.exception() is None:
+            png  = future.result()
+            path = self._disk_path(player_id, etag)
+            tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            with open(tmp_path, 'wb') as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+            self.memory.put((player_id, etag), png)
+            self.stats['rendered'] += 1
+        with self._lock:
+            self._pending.pop((player_id, etag), None)
+
+    def submit(self, player_id):
+        # (etag, future of the png bytes), or None for players without enough events
+        positions = self.positions.positions(player_id)
+        if positions is None:
+            return None
+        etag = plot_etag(*positions)
+        key  = (player_id, etag)
+
+        png = self.memory.get(key)
+        if png is not None:
+            self.stats['memory'] += 1
+            return etag, _done(png)
+
+        path = self._disk_path(player_id, etag)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                png = f.read()
+            self.memory.put(key, png)
+            self.stats['disk'] += 1
+            return etag, _done(png)
+
+        pool = self._get_pool()
+        with self._lock:
+            future  = self._pending.get(key)
+            created = future is None
+            if created:
+                future = pool.submit(render_png, np.array(positions[0]), np.array(positions[1]))
+                self._pending[key] = future
+        if created:
+            # Outside the lock: the callback runs right here if the render already finished
+            future.add_done_callback(lambda f: self._finish(player_id, etag, f))
+        return etag, future
+
+    def get(self, player_id, timeout = RENDER_WAIT):
+        # (etag, png bytes); raises concurrent.futures.TimeoutError if the render is still running
+        submitted = self.submit(player_id)
+        if submitted is None:
+            return None
+        etag, future = submitted
+        return etag, future.result(timeout = timeout)
+
+    def prewarm(self, player_ids):
+        futures = [s[1] for s in (self.submit(pid) for pid in player_ids) if s is not None]
+        wait(futures)
+        return sum(f.exception() is None for f in futures)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def _done(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+# -----------------------------
+# Prewarm
+# -----------------------------
+def popular_players(n):
+    # No request logs yet, so market value stands in for popularity
+    import player_store
+    df = player_store.load_source().drop_duplicates('id')
+    return df.sort_values('market_value_in_eur', ascending = False)['id'].head(n).astype(int).tolist()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Render density plots into the disk cache ahead of time')
+    parser.add_argument('--top', type = int, default = 200, help = 'Number of most valuable players to render')
+    parser.add_argument('--ids', type = int, nargs = '*', help = 'Explicit player ids (overrides --top)')
+    parser.add_argument('--workers', type = int, default = RENDER_WORKERS)
+    args = parser.parse_args()
+
+    plots = DensityPlots(workers = args.workers)
+    ids   = args.ids or popular_players(args.top)
+    rendered = plots.prewarm(ids)
+    plots.close()
+    print(f"Prewarmed {len(ids)} players: {plots.stats['rendered']} rendered, {plots.stats['disk']} already on disk, "
+          f"{len(ids) - rendered} without enough events or failed")
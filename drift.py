@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import inspect
+import tempfile
+import threading
+from collections import deque
+import numpy as np
+from prometheus_client import Counter, Gauge
+
+# -----------------------------
+# Config
+# -----------------------------
+REFERENCE_FILE = 'reference_profile.json'   # stored next to the model in its artifact directory
+REFERENCE_PATH = os.environ.get('DRIFT_REFERENCE_PATH', '')  # fallback when the model has none
+N_BINS         = 20      # quantile bins of the training distribution per feature
+INTERVAL       = float(os.environ.get('DRIFT_INTERVAL_SECONDS', 60))
+DECAY          = float(os.environ.get('DRIFT_DECAY', 0.5))   # weight kept by older traffic after each evaluation
+MIN_ROWS       = 50      # no statistics before the window holds this many rows
+MAX_PENDING    = 10000   # request batches waiting for the sketch thread; older ones are dropped
+EPSILON        = 1e-4    # PSI smoothing for empty bins
+
+# -----------------------------
+# Prometheus metrics
+# -----------------------------
+drift_psi     = Gauge('feature_drift_psi', 'Population stability index of recent requests vs the training data', ['feature'])
+drift_ks      = Gauge('feature_drift_ks', 'Kolmogorov-Smirnov distance (on the reference bins) vs the training data', ['feature'])
+window_rows   = Gauge('feature_drift_window_rows', 'Decayed number of request rows in the drift window')
+observed_rows = Counter('feature_drift_observed_rows_total', 'Request rows added to the drift sketches')
+
+
+# -----------------------------
+# Reference profile (train time)
+# -----------------------------
+def build_reference(df, n_bins = N_BINS):
+    # Per feature: interior quantile edges of the training data and the share of rows per bin
+    profile = {'n_rows': int(len(df)), 'features': {}}
+    for name in df.columns:
+        values = np.asarray(df[name], dtype = np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            continue
+        edges  = np.unique(np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1]))
+        counts = np.bincount(np.searchsorted(edges, values, side = 'right'), minlength = len(edges) + 1)
+        profile['features'][name] = {'edges': edges.tolist(), 'fractions': (counts / counts.sum()).tolist()}
+    return profile
+
+def save_reference(profile, path):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(profile, f)
+    os.replace(tmp_path, path)
+    return path
+
+def log_model_with_reference(log_model, df, artifact_path, **kwargs):
+    # The profile has to end up inside the directory a models:/ URI downloads. Flavors
+    # that take extra_files copy it there (under extra_files/); on older MLflow the model
+    # directory is the run's artifact directory, so logging it next to MLmodel is enough.
+    import mlflow
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = save_reference(build_reference(df), os.path.join(tmp_dir, REFERENCE_FILE))
+        if 'extra_files' in inspect.signature(log_model).parameters:
+            return log_model(artifact_path = artifact_path, extra_files = [path], **kwargs)
+        model_info = log_model(artifact_path = artifact_path, **kwargs)
+        mlflow.log_artifact(path, artifact_path)
+        return model_info
+
+def load_reference(model_path = None):
+    paths = [os.path.join(model_path, REFERENCE_FILE), os.path.join(model_path, 'extra_files', REFERENCE_FILE)] if model_path else []
+    for path in paths + [REFERENCE_PATH]:
+        if path and os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+    return None
+
+
+# -----------------------------
+# Statistics
+# -----------------------------
+def psi(expected, actual, epsilon = EPSILON):
+    expected = np.maximum(expected, epsilon)
+    actual   = np.maximum(actual, epsilon)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+def ks(expected, actual):
+    # Largest CDF gap at the bin edges, a lower bound of the exact KS statistic
+    return float(np.max(np.abs(np.cumsum(expected) - np.cumsum(actual))))
+
+
+# -----------------------------
+# Streaming sketches (serving time)
+# -----------------------------
+class DriftMonitor:
+    # One fixed histogram per feature, on the reference profile's bins. Requests only
+    # append their rows to a bounded deque; a background thread bins them and, every
+    # interval, publishes PSI / KS per feature and decays the window.
+
+    def __init__(self, feature_names, interval = INTERVAL, decay = DECAY, min_rows = MIN_ROWS):
+        self.feature_names = list(feature_names)
+        self.interval      = interval
+        self.decay         = decay
+        self.min_rows      = min_rows
+        self.pending       = deque(maxlen = MAX_PENDING)
+        self.lock          = threading.Lock()
+        self.columns       = None
+        self._stop         = threading.Event()
+        self._thread       = None
+
+    def set_reference(self, profile):
+        # Only request fields the reference knows about are sketched
+        with self.lock:
+            if profile is None:
+                self.columns = None
+                return
+            known = [(i, name) for i, name in enumerate(self.feature_names) if name in profile['features']]
+            self.columns   = np.array([i for i, _ in known], dtype = np.int64)
+            self.names     = [name for _, name in known]
+            self.edges     = [np.asarray(profile['features'][name]['edges']) for name in self.names]
+            self.expected  = [np.asarray(profile['features'][name]['fractions']) for name in self.names]
+            self.offsets   = np.concatenate([[0], np.cumsum([len(e) + 1 for e in self.edges])]).astype(np.int64)
+            self.counts    = np.zeros(self.offsets[-1], dtype = np.float64)
+            self.n_rows    = 0.0
+            missing = sorted(set(self.feature_names) - set(self.names))
+            print(f"Drift monitor: {len(self.names)} features against the reference"
+                  + (f", no reference for {', '.join(missing)}" if missing else ''))
+
+    def observe(self, rows):
+        # Request path: one deque append
+        self.pending.append(rows)
+
+    def _drain(self):
+        batches = []
+        while self.pending:
+            batches.append(self.pending.popleft())
+        if not batches or self.columns is None or not len(self.columns):
+            return
+        rows = np.concatenate(batches)[:, self.columns]
+        bins = np.stack([np.searchsorted(edges, rows[:, j], side = 'right') for j, edges in enumerate(self.edges)], axis = 1)
+        self.counts += np.bincount((bins + self.offsets[:-1]).ravel(), minlength = len(self.counts))
+        self.n_rows += len(rows)
+        observed_rows.inc(len(rows))
+
+    def evaluate(self):
+        with self.lock:
+            self._drain()
+            if self.columns is None:
+                return {}
+            window_rows.set(self.n_rows)
+            stats = {}
+            if self.n_rows >= self.min_rows:
+                for j, name in enumerate(self.names):
+                    actual = self.counts[self.offsets[j]:self.offsets[j + 1]] / self.n_rows
+                    stats[name] = {'psi': psi(self.expected[j], actual), 'ks': ks(self.expected[j], actual)}
+                    drift_psi.labels(name).set(stats[name]['psi'])
+                    drift_ks.labels(name).set(stats[name]['ks'])
+                self.counts *= self.decay
+                self.n_rows *= self.decay
+            return stats
+
+    def _run(self):
+        next_eval = time.monotonic() + self.interval
+        while not self._stop.wait(min(1.0, self.interval)):
+            with self.lock:
+                self._drain()
+            if time.monotonic() >= next_eval:
+                self.evaluate()
+                next_eval = time.monotonic() + self.interval
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target = self._run, name = 'drift-monitor', daemon = True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,155 @@
+import os
+import hashlib
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+# -----------------------------
+# Feature schema
+# -----------------------------
+SOURCE_PATH = os.environ.get('PLAYER_DATA_PATH', 'final_player_df.parquet')
+CACHE_DIR   = os.environ.get('FEATURE_CACHE_DIR', 'feature_cache')
+
+# Per-player stat columns, in final_player_df order
+STAT_COLUMNS = [
+    'matches_played', 'total_shots', 'accurate_shots', 'shot_accuracy', 'goals', 'shot_conversion',
+    'penalties_taken', 'penalties_scored', 'penalty_conversion',
+    'total_passes', 'accurate_passes', 'pass_accuracy', 'key_passes', 'assists',
+    'run_attempts_with_ball', 'successful_runs_with_ball', 'perc_successful_runs_with_ball',
+    'crosses', 'dribbles', 'free_kick_shots', 'free_kick_crosses',
+    'aerial_duels', 'aerial_duels_won', 'perc_aerial_duels_won',
+    'ground_defensive_duels_won', 'loose_ball_duels', 'loose_balls_won', 'perc_loose_balls_won',
+    'sliding_tackles', 'interceptions', 'clearances', 'blocks', 'possession_regained', 'own_goals',
+    'gk_balls_attacked', 'gk_save_attempts', 'gk_successful_save_attempts', 'perc_gk_save_success'
+]
+
+# Stored as "16.7%" strings in the player table
+PERCENT_COLUMNS = [
+    'shot_accuracy', 'shot_conversion', 'penalty_conversion', 'pass_accuracy', 'perc_successful_runs_with_ball',
+    'perc_aerial_duels_won', 'perc_loose_balls_won', 'perc_gk_save_success'
+]
+
+# Model inputs: every stat except clearances, which the cluster model was never trained on
+FEATURE_COLUMNS = [c for c in STAT_COLUMNS if c != 'clearances']
+TARGET_COLUMN   = 'cluster'
+ID_COLUMN       = 'id'
+
+# Bump when the transform changes so stale cache entries are not reused
+SCHEMA_VERSION = 1
+
+FeatureSet = namedtuple('FeatureSet', ['X', 'y', 'ids', 'columns'])
+
+
+# -----------------------------
+# Transform
+# -----------------------------
+def parse_percentages(values, decimals = None):
+    # "16.7%" -> 0.167 for a whole column at once; numbers pass through unchanged
+    series = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(np.float64)
+    parsed = pd.to_numeric(series.astype(str).str.strip().str.rstrip('%').str.strip(), errors = 'coerce') / 100
+    parsed = parsed.where(series.notna())
+    if decimals is None:
+        return parsed
+    # Python's round works on the exact binary value; numpy's scaled rint disagrees on
+    # ties like 0.595 and the model was trained on the former
+    return pd.Series([round(v, decimals) for v in parsed.tolist()], index = parsed.index, dtype = np.float64)
+
+def transform(df, columns = FEATURE_COLUMNS, decimals = 2):
+    # The model was trained on percentages rounded to two decimals, so that is the default
+    out = np.empty((len(df), len(columns)), dtype = np.float32)
+    for j, col in enumerate(columns):
+        values = parse_percentages(df[col], decimals) if col in PERCENT_COLUMNS else df[col]
+        out[:, j] = pd.to_numeric(values, errors = 'coerce').to_numpy(dtype = np.float64, na_value = np.nan)
+    return out
+
+def as_matrix(records, columns):
+    # Request payloads (dicts) -> contiguous rows in schema order. Validated numeric
+    # payloads skip pandas entirely; anything else (e.g. "16.7%") goes through transform
+    try:
+        return np.array([[record[col] for col in columns] for record in records], dtype = np.float32)
+    except (TypeError, ValueError):
+        return transform(pd.DataFrame.from_records(records, columns = columns), columns)
+
+
+# -----------------------------
+# Cached feature matrix
+# -----------------------------
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_key(source_path):
+    schema = f"{SCHEMA_VERSION}:{','.join(FEATURE_COLUMNS)}:{TARGET_COLUMN}".encode()
+    return hashlib.sha256(file_hash(source_path).encode() + schema).hexdigest()[:24]
+
+def read_source(source_path = SOURCE_PATH):
+    if source_path.endswith('.csv'):
+        return pd.read_csv(source_path)
+    return pd.read_parquet(source_path)
+
+def _save(path, array):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(tmp_path, path)
+
+def build_features(df):
+    return FeatureSet(transform(df), df[TARGET_COLUMN].to_numpy(dtype = np.int64),
+                      df[ID_COLUMN].to_numpy(dtype = np.int64), list(FEATURE_COLUMNS))
+
+def _entry_paths(entry):
+    return {name: os.path.join(entry, f"{name}.npy") for name in ('X', 'y', 'ids')}
+
+def cache_entry(source_path = SOURCE_PATH, cache_dir = CACHE_DIR):
+    # Directory holding X.npy / y.npy / ids.npy for this exact source file
+    return os.path.join(cache_dir, cache_key(source_path))
+
+def open_entry(entry, mmap = True):
+    # Used by worker processes: they map the cached arrays instead of receiving pickled copies
+    paths = _entry_paths(entry)
+    return FeatureSet(np.load(paths['X'], mmap_mode = 'r' if mmap else None), np.load(paths['y']),
+                      np.load(paths['ids']), list(FEATURE_COLUMNS))
+
+def load_features(source_path = SOURCE_PATH, cache_dir = CACHE_DIR, mmap = True):
+    # X is float32 (what sklearn trees convert to anyway) and memory-mapped from
+    # the cache when the source file is unchanged, so the parse only runs once
+    entry = cache_entry(source_path, cache_dir)
+    paths = _entry_paths(entry)
+
+    if not all(os.path.exists(p) for p in paths.values()):
+        features = build_features(read_source(source_path))
+        os.makedirs(entry, exist_ok = True)
+        # X last: its presence marks a complete entry
+        _save(paths['y'], features.y)
+        _save(paths['ids'], features.ids)
+        _save(paths['X'], features.X)
+        print(f"Cached {features.X.shape[0]} x {features.X.shape[1]} feature matrix at {entry}")
+
+    return open_entry(entry, mmap)
+
+def frame(features, rows = None):
+    # Named view for APIs that want column names (MLflow signatures, importances)
+    X = features.X if rows is None else features.X[rows]
+    return pd.DataFrame(X, columns = features.columns)
+
+
+# -----------------------------
+# Splits
+# -----------------------------
+def split_indices(n, random_state = 42):
+    # Same 80/10/10 train/val/test split train.py has always used
+    rows = np.arange(n)
+    train, val  = train_test_split(rows, test_size = 0.2, random_state = random_state)
+    val, test   = train_test_split(val, test_size = 0.5, random_state = random_state)
+    return train, val, test
+
+
+if __name__ == '__main__':
+    features = load_features()
+    print(f"{features.X.shape[0]} players, {features.X.shape[1]} features")
@@ -0,0 +1,175 @@
+import os
+import time
+import pickle
+import numpy as np
+
+# -----------------------------
+# Flattened forest
+# -----------------------------
+# Every tree of a fitted RandomForestClassifier concatenated into flat node arrays.
+# Leaves point to themselves, so walking a fixed max_depth steps lands every
+# (row, tree) pair on its leaf without per-row branching.
+FLAT_SUFFIX = '.flat.npz'
+
+
+class FlatForest:
+    def __init__(self, feature, threshold, left, right, leaf_slot, leaf_proba, roots, classes, depth, n_features):
+        self.feature     = feature      # int32, 0 at leaves
+        self.threshold   = threshold    # float64, compared against float32 inputs like sklearn
+        self.left        = left         # int32, global node ids
+        self.right       = right
+        self.leaf_slot   = leaf_slot    # int32 node -> row of leaf_proba, -1 for split nodes
+        self.leaf_proba  = leaf_proba   # float64 (n_distinct, n_classes) class distributions of the leaves
+        self.roots       = roots        # int32 root node of each tree
+        self.classes_    = classes
+        self.depth       = int(depth)
+        self.n_features_in_ = int(n_features)
+
+    @classmethod
+    def from_sklearn(cls, rf):
+        feature, threshold, left, right, leaf_slot, leaf_proba, roots = [], [], [], [], [], [], []
+        offset, n_leaves = 0, 0
+        for estimator in rf.estimators_:
+            tree   = estimator.tree_
+            nodes  = np.arange(tree.node_count)
+            leaf   = tree.children_left == -1
+            roots.append(offset)
+
+            feature.append(np.where(leaf, 0, tree.feature).astype(np.int32))
+            threshold.append(np.where(leaf, 0.0, tree.threshold))
+            left.append(np.where(leaf, nodes, tree.children_left) + offset)
+            right.append(np.where(leaf, nodes, tree.children_right) + offset)
+
+            slots = np.full(tree.node_count, -1, dtype = np.int64)
+            slots[leaf] = np.arange(leaf.sum()) + n_leaves
+            leaf_slot.append(slots)
+
+            # Same normalisation DecisionTreeClassifier.predict_proba applies
+            values = tree.value[leaf, 0, :].astype(np.float64)
+            normalizer = values.sum(axis = 1, keepdims = True)
+            normalizer[normalizer == 0.0] = 1.0
+            leaf_proba.append(values / normalizer)
+
+            offset   += tree.node_count
+            n_leaves += int(leaf.sum())
+
+        # Fully grown trees mostly end in pure leaves, so distinct distributions are few
+        leaf_proba, inverse = np.unique(np.concatenate(leaf_proba), axis = 0, return_inverse = True)
+        leaf_slot = np.concatenate(leaf_slot)
+        leaf_slot[leaf_slot >= 0] = inverse.ravel()[leaf_slot[leaf_slot >= 0]]
+
+        return cls(np.concatenate(feature), np.concatenate(threshold),
+                   np.concatenate(left).astype(np.int32), np.concatenate(right).astype(np.int32),
+                   leaf_slot.astype(np.int32), leaf_proba,
+                   np.asarray(roots, dtype = np.int32), np.asarray(rf.classes_),
+                   max(e.tree_.max_depth for e in rf.estimators_), rf.n_features_in_)
+
+    def __len__(self):
+        return len(self.roots)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in
+                   ('feature', 'threshold', 'left', 'right', 'leaf_slot', 'leaf_proba', 'roots', 'classes_'))
+
+    # -----------------------------
+    # Inference
+    # -----------------------------
+    def apply(self, X):
+        # (n_rows, n_trees) leaf node ids, all trees walked together one level per step
+        X    = np.asarray(X, dtype = np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            # Same check as sklearn; a wider input would otherwise be scored on the wrong columns
+            raise ValueError(f"X has {X.shape[-1]} features, but the forest is expecting "
+                             f"{self.n_features_in_} features as input")
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node    = np.where(go_left, self.left[node], self.right[node])
+        return node
+
+    def predict_proba(self, X):
+        leaves = self.leaf_slot[self.apply(X)]
+        return self.leaf_proba[leaves].sum(axis = 1) / len(self.roots)
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis = 1))
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def save(self, path):
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, feature = self.feature, threshold = self.threshold, left = self.left, right = self.right,
+                     leaf_slot = self.leaf_slot, leaf_proba = self.leaf_proba, roots = self.roots,
+                     classes = self.classes_, depth = self.depth, n_features = self.n_features_in_)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['feature'], data['threshold'], data['left'], data['right'], data['leaf_slot'],
+                       data['leaf_proba'], data['roots'], data['classes'], data['depth'], data['n_features'])
+
+
+def flatten(model):
+    return model if isinstance(model, FlatForest) else FlatForest.from_sklearn(model)
+
+def load_model(path):
+    # ModelManager loader: an MLflow sklearn model directory, served as a flat forest.
+    # The flattened copy is kept next to the cached artifacts so restarts skip unpickling.
+    flat_path = path.rstrip(os.sep) + FLAT_SUFFIX
+    if os.path.exists(flat_path):
+        return FlatForest.load(flat_path)
+
+    import mlflow.sklearn
+    model = mlflow.sklearn.load_model(path)
+    if not hasattr(model, 'estimators_'):
+        return model  # not a forest: serve the estimator as is
+
+    flat = FlatForest.from_sklearn(model)
+    flat.save(flat_path)
+    return flat
+
+
+# -----------------------------
+# Correctness check
+# -----------------------------
+def check_against(model, flat, X):
+    # Predictions must match sklearn exactly; probabilities up to summation order
+    X = np.asarray(X, dtype = np.float32)
+    expected, actual = model.predict(X), flat.predict(X)
+    mismatches = int((expected != actual).sum())
+    max_diff   = float(np.abs(model.predict_proba(X) - flat.predict_proba(X)).max()) if len(X) else 0.0
+    print(f"Flat forest vs sklearn on {len(X)} rows: {mismatches} prediction mismatches, max |proba diff| {max_diff:.2e}")
+    if mismatches or max_diff > 1e-9:
+        raise AssertionError("Flattened forest disagrees with the sklearn model")
+    return mismatches, max_diff
+
+
+if __name__ == '__main__':
+    # Standalone check without MLflow: train.py's model on train.py's split
+    from sklearn.ensemble import RandomForestClassifier
+    from features import load_features, split_indices
+
+    features = load_features()
+    train_rows, _, test_rows = split_indices(len(features.y))
+    model = RandomForestClassifier(n_estimators = 100, random_state = 42, n_jobs = -1)
+    model.fit(features.X[train_rows], features.y[train_rows])
+    flat = FlatForest.from_sklearn(model)
+    check_against(model, flat, features.X[test_rows])
+
+    print(f"Pickled estimator: {len(pickle.dumps(model)) / 1e6:.1f} MB, flat arrays: {flat.nbytes / 1e6:.1f} MB "
+          f"({len(flat)} trees, depth {flat.depth})")
+
+    row = features.X[test_rows[:1]]
+    for name, predict in [('sklearn', model.predict), ('flat', flat.predict)]:
+        timings = []
+        for _ in range(200):
+            start = time.perf_counter()
+            predict(row)
+            timings.append(time.perf_counter() - start)
+        print(f"{name:>8} single row: p50 {np.percentile(timings, 50) * 1e3:.2f} ms, "
+              f"p99 {np.percentile(timings, 99) * 1e3:.2f} ms")
@@ -0,0 +1,389 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# -----------------------------
+# Config
+# -----------------------------
+DEFAULT_MIX   = 'player=4,similar_players=3,get_player_id=1,predict_cluster=2'
+RESULTS_DIR   = os.environ.get('LOADTEST_RESULTS_DIR', 'loadtest_results')
+TOLERANCE     = 0.10   # relative slowdown (or throughput drop) that counts as a regression
+PERCENTILES   = (50, 95, 99)
+FLASK_PORT    = 5055
+CLUSTER_PORT  = 8055
+STUB_TREES    = 100    # same size as the production forest
+
+
+# -----------------------------
+# Servers under test
+# -----------------------------
+class StubModel:
+    # Random-data forest with the production forest's size, fitted the first time it
+    # sees a request so it always matches the API's feature count. No registry needed.
+    def __init__(self, n_trees = STUB_TREES, seed = 42):
+        self.n_trees = n_trees
+        self.seed    = seed
+        self.flat    = None
+        self.lock    = threading.Lock()
+
+    def predict(self, X):
+        with self.lock:
+            if self.flat is None:
+                import forest
+                from sklearn.ensemble import RandomForestClassifier
+                rng = np.random.RandomState(self.seed)
+                X_fit = rng.rand(2000, X.shape[1]).astype(np.float32)
+                model = RandomForestClassifier(n_estimators = self.n_trees, random_state = self.seed)
+                self.flat = forest.FlatForest.from_sklearn(model.fit(X_fit, rng.randint(0, 8, len(X_fit))))
+        return self.flat.predict(X)
+
+def install_stub_model():
+    # Must run before app_cluster_predict is imported: it loads its model at import time
+    import model_cache
+
+    def load_initial(self):
+        self.model, self.version, self.poll_seconds = StubModel(), 'stub', 0
+        return self
+    model_cache.ModelManager.load_initial = load_initial
+
+def start_flask(port = FLASK_PORT):
+    from werkzeug.serving import make_server
+    import app as flask_app
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)   # no access log line per request
+    server = make_server('127.0.0.1', port, flask_app.app, threaded = True)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return f"http://127.0.0.1:{port}", server.shutdown
+
+def start_cluster(port = CLUSTER_PORT):
+    import uvicorn
+    install_stub_model()
+    import app_cluster_predict
+    server = uvicorn.Server(uvicorn.Config(app_cluster_predict.app, host = '127.0.0.1', port = port, log_level = 'warning'))
+    thread = threading.Thread(target = server.run, daemon = True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return f"http://127.0.0.1:{port}", stop
+
+STARTERS = {'flask': start_flask, 'cluster': start_cluster}
+
+def start_local(name, port):
+    # Same server in a child process, so client and server do not share a GIL
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', name, '--port', str(port)])
+    url  = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout = 1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            break
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{name} server exited with {proc.returncode}")
+            time.sleep(0.2)
+    else:
+        proc.kill()
+        raise RuntimeError(f"{name} server did not come up on port {port}")
+
+    def stop():
+        proc.terminate()
+        proc.wait()
+    return url, stop
+
+
+# -----------------------------
+# Request mix
+# -----------------------------
+class Workload:
+    # Builds (target, method, path, body) for each endpoint from real player ids and names
+    def __init__(self, flask_url, cluster_url):
+        self.urls = {'flask': flask_url, 'cluster': cluster_url}
+        self.ids, self.names, self.fields = [], [], []
+
+        if flask_url:
+            import player_store
+            store      = player_store.open_store()
+            self.ids   = store.ids.tolist()
+            self.names = store.column('full_name')
+        if cluster_url:
+            # Request fields come from the running API, so the payload always matches its schema
+            schema = json.loads(fetch(cluster_url, '/openapi.json'))
+            self.fields = list(schema['components']['schemas']['PlayerRequest']['properties'])
+
+    def build(self, endpoint, rng):
+        if endpoint == 'player':
+            return 'flask', 'GET', f"/player/{rng.choice(self.ids)}", None
+        if endpoint == 'similar_players':
+            return 'flask', 'GET', f"/similar_players/{rng.choice(self.ids)}", None
+        if endpoint == 'get_player_id':
+            return 'flask', 'POST', '/get_player_id', {'name': rng.choice(self.names)}
+        if endpoint == 'search':
+            name = rng.choice(self.names)
+            return 'flask', 'GET', f"/search?q={name[:rng.randint(2, 6)].replace(' ', '+')}", None
+        if endpoint == 'predict_cluster':
+            return 'cluster', 'POST', '/predict-cluster', {f: rng.random() * 100 for f in self.fields}
+        raise ValueError(f"Unknown endpoint {endpoint!r}")
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+def fetch(base_url, path):
+    url  = urlsplit(base_url)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout = 10)
+    conn.request('GET', path)
+    return conn.getresponse().read()
+
+
+# -----------------------------
+# Client
+# -----------------------------
+class Client:
+    # One keep-alive connection per target and thread
+    def __init__(self, urls, timeout = 30):
+        self.urls    = {name: urlsplit(url) for name, url in urls.items() if url}
+        self.timeout = timeout
+        self.local   = threading.local()
+
+    def _conn(self, target):
+        conns = self.local.__dict__.setdefault('conns', {})
+        if target not in conns:
+            url = self.urls[target]
+            conns[target] = http.client.HTTPConnection(url.hostname, url.port, timeout = self.timeout)
+        return conns[target]
+
+    def send(self, target, method, path, body):
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        conn    = self._conn(target)
+        try:
+            conn.request(method, path, payload, headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self.local.conns.pop(target, None)
+            return 0
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = []   # (endpoint, latency seconds, ok)
+        self.lock    = threading.Lock()
+
+    def add(self, endpoint, latency, ok):
+        with self.lock:
+            self.samples.append((endpoint, latency, ok))
+
+
+def _pick(rng, mix):
+    names, weights = list(mix), list(mix.values())
+    return rng.choices(names, weights)[0]
+
+def closed_loop(client, workload, mix, concurrency, duration, warmup = 2.0, seed = 0):
+    # Fixed number of users, each sending its next request as soon as the last one returns
+    recorder = Recorder()
+    start    = time.perf_counter()
+    measure  = start + warmup
+    stop     = measure + duration
+
+    def user(i):
+        rng = random.Random(seed + i)
+        while True:
+            now = time.perf_counter()
+            if now >= stop:
+                return
+            endpoint = _pick(rng, mix)
+            status   = client.send(*workload.build(endpoint, rng))
+            end      = time.perf_counter()
+            if now >= measure:
+                recorder.add(endpoint, end - now, 200 <= status < 400)
+
+    threads = [threading.Thread(target = user, args = (i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder.samples, duration
+
+def open_loop(client, workload, mix, rate, duration, max_inflight = 256, poisson = True, warmup = 2.0, seed = 0):
+    # Requests arrive on a schedule whether or not earlier ones finished. Latency is
+    # measured from the scheduled send time, so client-side queueing counts against it.
+    recorder = Recorder()
+    rng      = random.Random(seed)
+    total    = warmup + duration
+    arrivals, t = [], 0.0
+    while t < total:
+        arrivals.append(t)
+        t += rng.expovariate(rate) if poisson else 1.0 / rate
+
+    def send(scheduled, endpoint, request):
+        status = client.send(*request)
+        if scheduled - start >= warmup:
+            recorder.add(endpoint, time.perf_counter() - scheduled, 200 <= status < 400)
+
+    with ThreadPoolExecutor(max_workers = max_inflight) as pool:
+        start = time.perf_counter()
+        for offset in arrivals:
+            scheduled = start + offset
+            delay     = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint = _pick(rng, mix)
+            pool.submit(send, scheduled, endpoint, workload.build(endpoint, rng))
+    return recorder.samples, duration
+
+
+# -----------------------------
+# Report
+# -----------------------------
+def summarize(samples, duration):
+    def stats(rows):
+        latency = np.array([lat for _, lat, _ in rows]) * 1e3
+        errors  = sum(not ok for _, _, ok in rows)
+        out = {'requests': len(rows), 'errors': errors, 'error_rate': errors / len(rows) if rows else 0.0,
+               'throughput_rps': len(rows) / duration}
+        for p in PERCENTILES:
+            out[f"p{p}_ms"] = float(np.percentile(latency, p)) if len(rows) else None
+        out['mean_ms'] = float(latency.mean()) if len(rows) else None
+        out['max_ms']  = float(latency.max()) if len(rows) else None
+        return out
+
+    by_endpoint = {}
+    for sample in samples:
+        by_endpoint.setdefault(sample[0], []).append(sample)
+    return {'overall': stats(samples), 'endpoints': {name: stats(rows) for name, rows in sorted(by_endpoint.items())}}
+
+def print_summary(summary):
+    header = f"{'endpoint':<18}{'requests':>9}{'errors':>8}{'rps':>9}" + ''.join(f"{f'p{p} ms':>10}" for p in PERCENTILES)
+    print(header)
+    rows = list(summary['endpoints'].items()) + [('overall', summary['overall'])]
+    for name, s in rows:
+        print(f"{name:<18}{s['requests']:>9}{s['errors']:>8}{s['throughput_rps']:>9.1f}"
+              + ''.join(f"{s[f'p{p}_ms']:>10.2f}" if s[f'p{p}_ms'] is not None else f"{'-':>10}" for p in PERCENTILES))
+
+def compare(current, baseline, tolerance = TOLERANCE):
+    # Regressions of the current run against a saved one, as readable strings
+    regressions = []
+    for name, base in list(baseline['endpoints'].items()) + [('overall', baseline['overall'])]:
+        now = current['overall'] if name == 'overall' else current['endpoints'].get(name)
+        if now is None or not base['requests']:
+            continue
+        for p in PERCENTILES:
+            key = f"p{p}_ms"
+            if now[key] is not None and now[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name} {key}: {base[key]:.2f} -> {now[key]:.2f}")
+        if now['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name} throughput: {base['throughput_rps']:.1f} -> {now['throughput_rps']:.1f} rps")
+        if now['error_rate'] > base['error_rate'] + 0.01:
+            regressions.append(f"{name} error rate: {base['error_rate']:.3f} -> {now['error_rate']:.3f}")
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr = subprocess.DEVNULL,
+                                       cwd = os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Load test the Flask app and the cluster API')
+    parser.add_argument('--mix', default = DEFAULT_MIX,
+                        help = 'endpoint=weight list; endpoints: player, similar_players, get_player_id, search, predict_cluster')
+    parser.add_argument('--mode', choices = ['closed', 'open'], default = 'closed')
+    parser.add_argument('--concurrency', type = int, default = 16, help = 'Closed loop: concurrent users')
+    parser.add_argument('--rate', type = float, default = 200, help = 'Open loop: requests per second')
+    parser.add_argument('--arrivals', choices = ['poisson', 'uniform'], default = 'poisson')
+    parser.add_argument('--max-inflight', type = int, default = 256, help = 'Open loop: client threads')
+    parser.add_argument('--duration', type = float, default = 20)
+    parser.add_argument('--warmup', type = float, default = 2)
+    parser.add_argument('--servers', choices = ['inprocess', 'local'], default = 'local',
+                        help = 'Start the apps in this process or as child processes (ignored for --*-url targets)')
+    parser.add_argument('--flask-url', help = 'Test an already running Flask app instead of starting one')
+    parser.add_argument('--cluster-url', help = 'Test an already running cluster API instead of starting one')
+    parser.add_argument('--output', help = 'Results JSON (default loadtest_results/<commit>-<mode>.json)')
+    parser.add_argument('--baseline', help = 'Earlier results JSON; exit 1 on regressions beyond --tolerance')
+    parser.add_argument('--tolerance', type = float, default = TOLERANCE)
+    parser.add_argument('--serve', choices = list(STARTERS), help = argparse.SUPPRESS)
+    parser.add_argument('--port', type = int, help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        # Child process of --servers local
+        STARTERS[args.serve](args.port)
+        threading.Event().wait()
+
+    mix     = parse_mix(args.mix)
+    targets = {'flask': args.flask_url, 'cluster': args.cluster_url}
+    needed  = {'cluster' if name == 'predict_cluster' else 'flask' for name in mix}
+    ports   = {'flask': FLASK_PORT, 'cluster': CLUSTER_PORT}
+    stops   = []
+    for name in sorted(needed):
+        if not targets[name]:
+            start = STARTERS[name] if args.servers == 'inprocess' else (lambda port, name = name: start_local(name, port))
+            targets[name], stop = start(ports[name])
+            stops.append(stop)
+
+    try:
+        workload = Workload(targets['flask'] if 'flask' in needed else None,
+                            targets['cluster'] if 'cluster' in needed else None)
+        client   = Client(targets)
+        if args.mode == 'closed':
+            samples, duration = closed_loop(client, workload, mix, args.concurrency, args.duration, args.warmup)
+        else:
+            samples, duration = open_loop(client, workload, mix, args.rate, args.duration, args.max_inflight,
+                                          args.arrivals == 'poisson', args.warmup)
+    finally:
+        for stop in stops:
+            stop()
+
+    summary = summarize(samples, duration)
+    result  = {
+        'commit':    git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config':    {'mode': args.mode, 'mix': mix, 'concurrency': args.concurrency, 'rate': args.rate,
+                      'arrivals': args.arrivals, 'duration': args.duration, 'servers': args.servers,
+                      'cpu_count': os.cpu_count(), 'python': sys.version.split()[0]},
+        **summary,
+    }
+    print_summary(summary)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{result['commit']}-{args.mode}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok = True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent = 2)
+    print(f"\nWrote results to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ('mode', 'mix', 'concurrency', 'rate', 'servers'):
+            if baseline['config'].get(key) != result['config'][key]:
+                print(f"Warning: baseline was run with {key}={baseline['config'].get(key)}, this run with {result['config'][key]}")
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
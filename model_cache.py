@@ -0,0 +1,214 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import mlflow
+import mlflow.sklearn
+from mlflow.tracking import MlflowClient
+from prometheus_client import Counter, Gauge, Histogram, Info
+
+# -----------------------------
+# Config
+# -----------------------------
+MODEL_NAME   = os.environ.get('MODEL_NAME', 'player_cluster_model')
+MODEL_STAGE  = os.environ.get('MODEL_STAGE', 'Production')
+CACHE_DIR    = os.environ.get('MODEL_CACHE_DIR', 'model_cache')
+POLL_SECONDS = float(os.environ.get('MODEL_POLL_SECONDS', 30))
+
+# -----------------------------
+# Prometheus metrics
+# -----------------------------
+load_seconds   = Histogram('model_load_seconds', 'Time to fetch (if needed), load and warm up a model version',
+                           ['source'], buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120])
+active_version = Gauge('model_active_version', 'Registry version of the model currently serving requests')
+active_info    = Info('model_active', 'Model currently serving requests')
+model_swaps    = Counter('model_swaps_total', 'Times a newly promoted model version was swapped in')
+load_failures  = Counter('model_load_failures_total', 'Failed attempts to load a model version')
+
+
+# -----------------------------
+# Content-addressed cache
+# -----------------------------
+# <cache>/objects/<sha256 of the artifact tree>/   the downloaded MLmodel directory
+# <cache>/refs/<name>/<version>                    -> sha256
+# <cache>/refs/<name>/<stage>.json                 last version served for that stage
+def _tree_hash(path):
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file = os.path.join(root, name)
+            digest.update(os.path.relpath(file, path).encode())
+            with open(file, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+def _write_atomic(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class ModelCache:
+    def __init__(self, cache_dir = CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok = True)
+
+    def _ref_path(self, name, version):
+        return os.path.join(self.cache_dir, 'refs', name, str(version))
+
+    def _stage_path(self, name, stage):
+        return os.path.join(self.cache_dir, 'refs', name, f"{stage}.json")
+
+    def object_path(self, digest):
+        return os.path.join(self.cache_dir, 'objects', digest)
+
+    def lookup(self, name, version):
+        ref = self._ref_path(name, version)
+        if not os.path.exists(ref):
+            return None
+        with open(ref) as f:
+            path = self.object_path(f.read().strip())
+        return path if os.path.isdir(path) else None
+
+    def fetch(self, name, version, uri = None):
+        # Returns the local directory for a registry version (or any immutable artifact
+        # uri filed under name/version), downloading it only once
+        path = self.lookup(name, version)
+        if path is not None:
+            return path
+
+        tmp_dir = tempfile.mkdtemp(dir = self.cache_dir, prefix = '.download-')
+        try:
+            local  = mlflow.artifacts.download_artifacts(artifact_uri = uri or f"models:/{name}/{version}",
+                                                         dst_path = tmp_dir)
+            digest = _tree_hash(local)
+            path   = self.object_path(digest)
+            if not os.path.isdir(path):
+                # Identical artifacts registered twice share one object
+                os.replace(local, path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors = True)
+
+        _write_atomic(self._ref_path(name, version), digest)
+        return path
+
+    def remember(self, name, stage, version):
+        _write_atomic(self._stage_path(name, stage), json.dumps({'version': str(version)}))
+
+    def last_served(self, name, stage):
+        # Lets a worker start from disk when the registry is unreachable
+        path = self._stage_path(name, stage)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            version = json.load(f)['version']
+        return version if self.lookup(name, version) else None
+
+
+# -----------------------------
+# Hot-swappable model
+# -----------------------------
+class ModelManager:
+    # Serves one registry stage. A watcher thread polls the registry; a newly
+    # promoted version is loaded and warmed up off the request path and then
+    # swapped in with a single reference assignment, so in-flight predicts finish
+    # on the old model and the next batch uses the new one.
+
+    def __init__(self, name = MODEL_NAME, stage = MODEL_STAGE, cache = None, poll_seconds = POLL_SECONDS, loader = None,
+                 on_activate = None):
+        self.name         = name
+        self.stage        = stage
+        self.cache        = cache or ModelCache()
+        self.poll_seconds = poll_seconds
+        self.loader       = loader or mlflow.sklearn.load_model
+        self.on_activate  = on_activate   # called with (model, version) after every swap
+        self.client       = MlflowClient()
+        self.model        = None
+        self.version      = None
+        self._stop        = threading.Event()
+        self._thread      = None
+
+    def predict(self, batch):
+        return self.model.predict(batch)
+
+    def latest_version(self):
+        versions = self.client.get_latest_versions(self.name, stages = [self.stage])
+        if not versions:
+            return None
+        return max(versions, key = lambda v: int(v.version))
+
+    def _load(self, path, source):
+        with load_seconds.labels(source).time():
+            model = self.loader(path)
+            n_features = getattr(model, 'n_features_in_', None)
+            if n_features:
+                # First predict pays for lazy allocations; do it before taking traffic
+                model.predict(np.zeros((1, n_features), dtype = np.float32))
+        return model
+
+    def _activate(self, model, version):
+        self.model, self.version = model, str(version)
+        active_version.set(int(version))
+        active_info.info({'name': self.name, 'stage': self.stage, 'version': str(version)})
+        self.cache.remember(self.name, self.stage, version)
+        if self.on_activate is not None:
+            self.on_activate(model, version)
+
+    def load_initial(self):
+        try:
+            if not self.refresh():
+                raise RuntimeError(f"No {self.stage} version registered for {self.name}")
+        except Exception as e:
+            version = self.cache.last_served(self.name, self.stage)
+            if version is None:
+                raise
+            print(f"Registry unavailable ({e}); serving cached {self.name} v{version}")
+            self._activate(self._load(self.cache.lookup(self.name, version), 'cache'), version)
+        return self
+
+    def refresh(self):
+        # Returns True when a model is active afterwards
+        latest = self.latest_version()
+        if latest is None:
+            return self.model is not None
+        if str(latest.version) == self.version:
+            return True
+
+        source = 'cache' if self.cache.lookup(self.name, latest.version) else 'registry'
+        path   = self.cache.fetch(self.name, latest.version)
+        model  = self._load(path, source)
+
+        previous = self.version
+        self._activate(model, latest.version)
+        if previous is not None:
+            model_swaps.inc()
+            print(f"Swapped {self.name} v{previous} -> v{latest.version}")
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the current model; the next poll tries again
+                load_failures.inc()
+                print(f"Model refresh failed: {e}")
+
+    def start_watcher(self):
+        if self._thread is None and self.poll_seconds > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target = self._watch, name = 'model-watcher', daemon = True)
+            self._thread.start()
+
+    def stop_watcher(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,142 @@
+import re
+import time
+import bisect
+import unicodedata
+import numpy as np
+
+# -----------------------------
+# Config
+# -----------------------------
+DEFAULT_LIMIT  = 10
+MAX_LIMIT      = 50
+MIN_SIMILARITY = 0.3   # trigram similarity below this is not offered as a fuzzy match
+
+# Rank tiers, best first
+FULL_PREFIX  = 0   # the whole name starts with the query: "malang s"
+TOKEN_PREFIX = 1   # every query word starts some word of the name: "sarr mal"
+FUZZY        = 2   # trigram match, for typos: "malng sar"
+
+
+def fold(text):
+    # Accent and case folded, punctuation dropped: "N'Diaye" -> "ndiaye", "Konaté" -> "konate"
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    text = re.sub(r"['\u2019.]", '', text)
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', text).split())
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _postings(pairs):
+    # (sorted keys, offsets, rows): rows of keys[i] are rows[offsets[i]:offsets[i + 1]].
+    # A prefix is a contiguous range of the sorted keys, so a prefix lookup is two
+    # binary searches and one slice.
+    pairs   = sorted(set(pairs))
+    keys    = sorted({key for key, _ in pairs})
+    counts  = np.zeros(len(keys), dtype = np.int64)
+    where   = {key: i for i, key in enumerate(keys)}
+    for key, _ in pairs:
+        counts[where[key]] += 1
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    rows    = np.array([row for _, row in pairs], dtype = np.int64)
+    return keys, offsets, rows
+
+
+class NameIndex:
+    def __init__(self, ids, names, clubs):
+        self.ids    = np.asarray(ids, dtype = np.int64)
+        self.names  = list(names)
+        self.clubs  = list(clubs)
+        self.folded = [fold(name) for name in self.names]
+
+        # Prefix side: whole folded names, and every word of them
+        self.full_keys, self.full_offsets, self.full_rows = _postings(
+            (name, row) for row, name in enumerate(self.folded))
+        self.word_keys, self.word_offsets, self.word_rows = _postings(
+            (word, row) for row, name in enumerate(self.folded) for word in name.split())
+
+        # Fuzzy side: trigram -> rows, and the trigram count of every name
+        grams = [trigrams(name) for name in self.folded]
+        self.gram_rows  = {}
+        for row, name_grams in enumerate(grams):
+            for gram in name_grams:
+                self.gram_rows.setdefault(gram, []).append(row)
+        self.gram_rows  = {gram: np.array(rows, dtype = np.int64) for gram, rows in self.gram_rows.items()}
+        self.gram_count = np.array([len(g) for g in grams], dtype = np.int64)
+
+    @classmethod
+    def from_store(cls, store):
+        return cls(store.ids, store.column('full_name'), store.column('club'))
+
+    def __len__(self):
+        return len(self.ids)
+
+    # -----------------------------
+    # Lookups
+    # -----------------------------
+    @staticmethod
+    def _prefix_rows(keys, offsets, rows, prefix):
+        lo = bisect.bisect_left(keys, prefix)
+        hi = bisect.bisect_left(keys, prefix + '\uffff')
+        return rows[offsets[lo]:offsets[hi]]
+
+    def exact(self, name):
+        # Every id whose name folds to the same string, in store order
+        rows = self._prefix_rows(self.full_keys, self.full_offsets, self.full_rows, fold(name))
+        rows = [row for row in rows if self.folded[row] == fold(name)]
+        return [int(self.ids[row]) for row in sorted(rows)]
+
+    def _fuzzy(self, query):
+        grams = [self.gram_rows[g] for g in trigrams(query) if g in self.gram_rows]
+        if not grams:
+            return np.empty(0, dtype = np.int64), np.empty(0)
+        shared = np.bincount(np.concatenate(grams), minlength = len(self.ids))
+        score  = shared / (len(trigrams(query)) + self.gram_count - shared)
+        rows   = np.flatnonzero(score >= MIN_SIMILARITY)
+        return rows, score[rows]
+
+    def search(self, query, limit = DEFAULT_LIMIT):
+        # Ranked [{'id', 'name', 'club'}]: full-name prefix hits, then word prefix hits,
+        # then fuzzy hits; shorter names first inside a tier
+        query = fold(query)
+        limit = max(0, min(int(limit), MAX_LIMIT))
+        if not query or not limit:
+            return []
+
+        full = self._prefix_rows(self.full_keys, self.full_offsets, self.full_rows, query)
+
+        words = None
+        for word in query.split():
+            rows  = np.unique(self._prefix_rows(self.word_keys, self.word_offsets, self.word_rows, word))
+            words = rows if words is None else np.intersect1d(words, rows, assume_unique = True)
+        words = np.setdiff1d(words, full, assume_unique = True)
+
+        tiers = [(FULL_PREFIX, full, np.ones(len(full))), (TOKEN_PREFIX, words, np.ones(len(words)))]
+        if len(full) + len(words) < limit:
+            fuzzy, score = self._fuzzy(query)
+            keep = ~np.isin(fuzzy, np.concatenate([full, words]))
+            tiers.append((FUZZY, fuzzy[keep], score[keep]))
+
+        hits = []
+        for tier, rows, score in tiers:
+            if len(hits) >= limit:
+                break
+            lengths = np.array([len(self.folded[row]) for row in rows], dtype = np.int64)
+            order   = np.lexsort((rows, lengths, -score))[:limit - len(hits)]
+            hits.extend({'id': int(self.ids[row]), 'name': self.names[row], 'club': self.clubs[row]}
+                        for row in rows[order])
+        return hits
+
+
+if __name__ == '__main__':
+    import sys
+    import player_store
+
+    index = NameIndex.from_store(player_store.open_store())
+    for query in sys.argv[1:] or ['mal', 'sarr', 'malng sar', 'konate', 'van d']:
+        start = time.perf_counter()
+        hits  = index.search(query)
+        print(f"{query!r} ({(time.perf_counter() - start) * 1e3:.3f} ms): "
+              + ', '.join(f"{h['name']} ({h['club']})" for h in hits))
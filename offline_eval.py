@@ -1,118 +1,181 @@
+import os
+import json
+import argparse
+import numpy as np
 import pandas as pd
-import re
 import mlflow
 from mlflow.tracking import MlflowClient
 import mlflow.sklearn
-from sklearn.metrics import classification_report, accuracy_score, confusion_matrix
-from sklearn.model_selection import train_test_split
-import ast
-#with help from chatgpt 
+from sklearn.metrics import classification_report, accuracy_score, confusion_matrix, f1_score
+import player_store
+import forest
+from model_cache import ModelCache
+from features import load_features, read_source, frame, split_indices
+#with help from chatgpt
 mlflow.set_tracking_uri(uri="http://129.114.26.77:8000")
 
-
-def is_percentage_string(val):
-    if not isinstance(val, str):
-        return False
-    return bool(re.match(r'^\s*-?\d+\.?\d*\s*%\s*$', val))
-
-def convert_to_float(val):
-    if isinstance(val, str):
-        try:
-            return round(float(val.strip().rstrip('%').strip()) / 100, 2)
-        except ValueError:
-            return val
-    return val
-
-# Load and preprocess test data
-data = pd.read_parquet('final_player_df.parquet')
-
-# Save full copy for cluster/knn role analysis later
-raw_data = data.copy()
-
-# Feature preprocessing for model input
-final_data = data.drop(columns=data.loc[:, 'id':'image_url'])
-final_data = final_data.drop(['clearances', 'top_knn_ids'], axis=1)
-
-for col in final_data.columns:
-    if is_percentage_string(final_data[col].iloc[0]):
-        final_data[col] = final_data[col].apply(convert_to_float)
-
-X = final_data.iloc[:, :-1]
-y = final_data.iloc[:, -1]
-
-# Use only the test split (same random split method as in train.py)
-_, X_val, _, y_val = train_test_split(X, y, test_size=0.2, random_state=42)
-X_val, X_test, y_val, y_test = train_test_split(X_val, y_val, test_size=0.5, random_state=42)
-
-# Dynamically get the latest model run containing "football_model"
-client = MlflowClient()
-experiment = client.get_experiment_by_name("MLflow Quickstart")
-runs = client.search_runs(experiment.experiment_id, "attributes.status = 'FINISHED'", order_by=["start_time DESC"])
-
-model_uri = None
-for run in runs:
-    if any(a.path == "football_model" for a in client.list_artifacts(run.info.run_id)):
-        model_uri = f"runs:/{run.info.run_id}/football_model"
-        break
-
-if model_uri is None:
-    raise RuntimeError("No run found with 'football_model' artifact")
-
-model = mlflow.sklearn.load_model(model_uri)
-
-# Helper to safely parse KNN ID strings
-def parse_knn(knn_str):
-    try:
-        return ast.literal_eval(knn_str)
-    except:
-        return []
-
-# Predict and evaluate
-y_pred = model.predict(X_test)
-acc = accuracy_score(y_test, y_pred)
-report = classification_report(y_test, y_pred, output_dict=True)
-conf_matrix = confusion_matrix(y_test, y_pred)
-
-print("Evaluation Metrics:")
-print(f"Accuracy: {acc:.4f}")
-print("\nClassification Report:")
-print(classification_report(y_test, y_pred))
-print("Confusion Matrix:")
-print(conf_matrix)
-
-# Find misclassified players
-misclassified_indices = y_test.index[y_test != y_pred]
-misclassified_df = raw_data.loc[misclassified_indices]
-
-print("\nMisclassified Player Analysis:")
-cluster_agreement = []
-knn_agreement = []
-
-for _, row in misclassified_df.iterrows():
-    player_role = row['role']
-    cluster = row['cluster']
-    knn_ids = parse_knn(row['top_knn_ids'])
-
-    # Cluster role agreement
-    cluster_members = raw_data[raw_data['cluster'] == cluster]
-    if len(cluster_members) > 0:
-        cluster_same_role = (cluster_members['role'] == player_role).sum()
-        cluster_agreement.append(cluster_same_role / len(cluster_members))
-
-    # KNN role agreement
-    if knn_ids:
-        knn_roles = raw_data[raw_data['id'].isin(knn_ids)]['role']
-        knn_same_role = (knn_roles == player_role).sum()
-        knn_agreement.append(knn_same_role / len(knn_roles))
-
-if cluster_agreement:
-    cluster_score = sum(cluster_agreement)/len(cluster_agreement)
-    print(f"Average cluster role agreement: {cluster_score:.2f}")
-else:
-    print("No cluster agreement data available.")
-
-if knn_agreement:
-    knn_score = sum(knn_agreement)/len(knn_agreement)
-    print(f"Average KNN role agreement: {knn_score:.2f}")
-else:
-    print("No KNN agreement data available.")
+EXPERIMENT_NAME = "MLflow Quickstart"
+ARTIFACT_PATH   = "football_model"
+# run_id -> whether it logged a football_model artifact; finished runs never change
+RUN_CACHE_PATH  = os.environ.get('EVAL_RUN_CACHE', os.path.join('model_cache', 'eval_runs.json'))
+
+
+# -----------------------------
+# Model lookup (cached)
+# -----------------------------
+def _load_run_cache():
+    if os.path.exists(RUN_CACHE_PATH):
+        with open(RUN_CACHE_PATH) as f:
+            return json.load(f)
+    return {}
+
+def _save_run_cache(cache):
+    os.makedirs(os.path.dirname(RUN_CACHE_PATH) or '.', exist_ok = True)
+    tmp_path = f"{RUN_CACHE_PATH}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, RUN_CACHE_PATH)
+
+def latest_model_run(client):
+    # Latest finished run with a football_model artifact. list_artifacts is only
+    # called for runs that have not been seen before.
+    experiment = client.get_experiment_by_name(EXPERIMENT_NAME)
+    runs  = client.search_runs(experiment.experiment_id, "attributes.status = 'FINISHED'", order_by=["start_time DESC"])
+    cache = _load_run_cache()
+    found = None
+    for run in runs:
+        run_id = run.info.run_id
+        if run_id not in cache:
+            cache[run_id] = any(a.path == ARTIFACT_PATH for a in client.list_artifacts(run_id))
+        if cache[run_id]:
+            found = run_id
+            break
+    _save_run_cache(cache)
+
+    if found is None:
+        raise RuntimeError("No run found with 'football_model' artifact")
+    return found
+
+def load_models(client, model_name, versions):
+    # label -> model; artifacts come from the local content-addressed model cache
+    cache = ModelCache()
+    if not versions:
+        run_id = latest_model_run(client)
+        path   = cache.fetch('runs', run_id, f"runs:/{run_id}/{ARTIFACT_PATH}")
+        return {f"run {run_id[:8]}": mlflow.sklearn.load_model(path)}
+    return {f"{model_name} v{v}": mlflow.sklearn.load_model(cache.fetch(model_name, v)) for v in versions}
+
+
+# -----------------------------
+# Role agreement tables
+# -----------------------------
+def role_agreement(raw_data):
+    # Per-row cluster and KNN role agreement for every player in raw_data.
+    # cluster: share of the player's (true) cluster with the same role.
+    # knn: share of the raw_data rows whose id is in this row's own top_knn_ids that have
+    # the same role, so every row (duplicated ids included) scores exactly as in the
+    # per-row loop. NaN if the row has no neighbors in raw_data.
+    role_codes, _ = pd.factorize(raw_data['role'])  # missing roles -> -1, never equal to anything
+    clusters, cluster_index = pd.factorize(raw_data['cluster'])
+    n_roles = role_codes.max() + 2                    # last column collects missing roles
+
+    role_col = np.where(role_codes >= 0, role_codes, n_roles - 1)
+    counts   = np.zeros((len(cluster_index), n_roles), dtype = np.int64)
+    np.add.at(counts, (clusters, role_col), 1)
+    same_cluster = np.where(role_codes >= 0, counts[clusters, role_col], 0)
+    cluster_score = same_cluster / counts.sum(axis = 1)[clusters]
+
+    # Rows per (id, role), so each neighbor id counts all of its raw_data rows like isin() did
+    id_codes, id_index = pd.factorize(raw_data['id'])
+    id_roles = np.zeros((len(id_index), n_roles), dtype = np.int64)
+    np.add.at(id_roles, (id_codes, role_col), 1)
+
+    # (row, neighbor id) pairs, each id once per row
+    knn_lists = [pd.unique(np.asarray(player_store.parse_knn_ids(v), dtype = np.int64)) for v in raw_data['top_knn_ids']]
+    owner     = np.repeat(np.arange(len(raw_data)), [len(ids) for ids in knn_lists])
+    codes     = pd.Index(id_index).get_indexer(np.concatenate(knn_lists + [np.empty(0, dtype = np.int64)]))
+    owner, codes = owner[codes >= 0], codes[codes >= 0]
+
+    total = np.bincount(owner, weights = id_roles[codes].sum(axis = 1), minlength = len(raw_data))
+    same  = np.bincount(owner, weights = np.where(role_codes[owner] >= 0, id_roles[codes, role_col[owner]], 0),
+                        minlength = len(raw_data))
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        knn_score = np.where(total > 0, same / total, np.nan)
+    return cluster_score, knn_score
+
+
+# -----------------------------
+# Evaluation
+# -----------------------------
+def evaluate(label, model, X_test, y_test, test_rows, cluster_score, knn_score, verbose = True):
+    y_pred = model.predict(X_test)
+
+    # The cluster API serves the flattened forest, so it has to agree with sklearn here
+    if hasattr(model, 'estimators_'):
+        forest.check_against(model, forest.flatten(model), X_test)
+
+    acc = accuracy_score(y_test, y_pred)
+    conf_matrix = confusion_matrix(y_test, y_pred)
+
+    if verbose:
+        print(f"\n=== {label} ===")
+        print("Evaluation Metrics:")
+        print(f"Accuracy: {acc:.4f}")
+        print("\nClassification Report:")
+        print(classification_report(y_test, y_pred))
+        print("Confusion Matrix:")
+        print(conf_matrix)
+
+    # Agreement over the misclassified test players, straight from the precomputed tables
+    misclassified_rows = test_rows[y_test != y_pred]
+    cluster_agreement  = cluster_score[misclassified_rows]
+    knn_agreement      = knn_score[misclassified_rows]
+    knn_agreement      = knn_agreement[~np.isnan(knn_agreement)]
+
+    if verbose:
+        print("\nMisclassified Player Analysis:")
+        if len(cluster_agreement):
+            print(f"Average cluster role agreement: {cluster_agreement.mean():.2f}")
+        else:
+            print("No cluster agreement data available.")
+        if len(knn_agreement):
+            print(f"Average KNN role agreement: {knn_agreement.mean():.2f}")
+        else:
+            print("No KNN agreement data available.")
+
+    return {
+        'model':             label,
+        'accuracy':          acc,
+        'macro_f1':          f1_score(y_test, y_pred, average='macro'),
+        'misclassified':     len(misclassified_rows),
+        'cluster_agreement': cluster_agreement.mean() if len(cluster_agreement) else np.nan,
+        'knn_agreement':     knn_agreement.mean() if len(knn_agreement) else np.nan,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-name", default="football_model", help="Registered model to evaluate")
+    parser.add_argument("--versions", nargs="*", default=[],
+                        help="Registered versions to compare side by side; default is the latest football_model run")
+    args = parser.parse_args()
+
+    # Load and preprocess test data
+    raw_data = read_source()
+
+    # Feature matrix comes from the shared pipeline (cached by source file hash)
+    features = load_features()
+
+    # Use only the test split (same random split method as in train.py)
+    _, _, test_rows = split_indices(len(features.y))
+    X_test, y_test  = frame(features, test_rows), features.y[test_rows]
+
+    cluster_score, knn_score = role_agreement(raw_data)
+
+    models  = load_models(MlflowClient(), args.model_name, args.versions)
+    results = [evaluate(label, model, X_test, y_test, test_rows, cluster_score, knn_score)
+               for label, model in models.items()]
+
+    if len(results) > 1:
+        print("\nSide by side:")
+        print(pd.DataFrame(results).set_index('model').to_string(float_format=lambda v: f"{v:.4f}"))
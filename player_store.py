@@ -0,0 +1,214 @@
+import os
+import re
+import hashlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+
+# -----------------------------
+# Paths
+# -----------------------------
+SOURCE_PATH  = os.environ.get('PLAYER_DATA_PATH', 'final_player_df.parquet')
+STORE_PATH   = os.environ.get('PLAYER_STORE_PATH', 'player_store.arrow')
+INDEX_SUFFIX = '.index.npy'
+KNN_SUFFIX   = '.knn_ids.npy'
+DIST_SUFFIX  = '.knn_dist.npy'
+# Content version of the source a store was built from; written last, so it also marks a complete store
+VERSION_SUFFIX = '.version'
+
+# Columns never sent to the UI as part of a player record
+HIDDEN_COLUMNS = ['id']
+
+# Columns returned for each entry of a similar players list
+SIMILAR_COLUMNS = ['id', 'full_name', 'club', 'role', 'image_url']
+
+
+# -----------------------------
+# Source loading
+# -----------------------------
+def parse_knn_ids(val):
+    # The CSV export stores numpy print output, e.g. "[  3644  85113 ...]"
+    if isinstance(val, str):
+        return [int(tok) for tok in re.findall(r'-?\d+', val)]
+    if val is None or (isinstance(val, float) and np.isnan(val)):
+        return []
+    return [int(v) for v in val]
+
+def load_source(source_path = SOURCE_PATH):
+    if source_path.endswith('.csv'):
+        df = pd.read_csv(source_path)
+    else:
+        df = pd.read_parquet(source_path)
+    df['top_knn_ids'] = df['top_knn_ids'].apply(parse_knn_ids)
+    return df
+
+
+# -----------------------------
+# Build
+# -----------------------------
+def _format_display_fields(df):
+    # Done once at build time instead of on every /player request
+    expiry = pd.to_datetime(df['contract_expiration_date'], format = '%Y-%m-%d %H:%M:%S', errors = 'coerce')
+    df['contract_expiration_date'] = expiry.dt.strftime('%Y-%m-%d').astype(object).where(expiry.notna(), None)
+    df['market_value_in_eur']      = df['market_value_in_eur'].map(lambda v: "€{:,.0f}".format(v) if pd.notna(v) else None)
+    df['density_plot_url']         = '/density_plot/' + df['id'].astype(str) + '.png'
+    return df
+
+def save_array(path, array):
+    # np.save appends ".npy" to bare paths, so hand it an open file instead
+    with open(path, 'wb') as f:
+        np.save(f, array)
+
+def write_text(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+def _atomic_write(path, write):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def build_neighbor_matrix(knn_lists, known_ids):
+    # Fixed width N x k matrix of neighbor ids, -1 padded. Duplicate and unknown
+    # ids are dropped here so readers can gather without any checks.
+    known = set(known_ids)
+    lists = [[nid for nid in pd.unique(np.asarray(ids, dtype = np.int64)) if nid in known] for ids in knn_lists]
+    k     = max((len(ids) for ids in lists), default = 0)
+
+    knn_ids = np.full((len(lists), k), -1, dtype = np.int64)
+    for i, ids in enumerate(lists):
+        knn_ids[i, :len(ids)] = ids
+
+    # The offline matching notebook does not export distances, so they start out unknown
+    knn_dist = np.full((len(lists), k), np.nan, dtype = np.float32)
+    return knn_ids, knn_dist
+
+def source_version(source_path):
+    digest = hashlib.sha256()
+    with open(source_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def build_store(source_path = SOURCE_PATH, store_path = STORE_PATH):
+    version = source_version(source_path)
+    df = load_source(source_path)
+
+    # The player table contains exact duplicate rows; keep the first one per id
+    df = df.drop_duplicates('id', keep = 'first').reset_index(drop = True)
+    df = _format_display_fields(df)
+
+    knn_ids, knn_dist = build_neighbor_matrix(df['top_knn_ids'], df['id'])
+    df = df.drop(columns = ['top_knn_ids'])
+
+    table = pa.Table.from_pandas(df, preserve_index = False)
+
+    def write_table(path):
+        # Uncompressed IPC file so readers can memory-map it without copying
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    # Dense id -> row offset lookup, -1 for unknown ids
+    ids   = df['id'].to_numpy(dtype = np.int64)
+    index = np.full(int(ids.max()) + 1, -1, dtype = np.int32)
+    index[ids] = np.arange(len(ids), dtype = np.int32)
+
+    _atomic_write(store_path, write_table)
+    _atomic_write(store_path + INDEX_SUFFIX, lambda path: save_array(path, index))
+    _atomic_write(store_path + KNN_SUFFIX, lambda path: save_array(path, knn_ids))
+    _atomic_write(store_path + DIST_SUFFIX, lambda path: save_array(path, knn_dist))
+    _atomic_write(store_path + VERSION_SUFFIX, lambda path: write_text(path, version))
+
+    print(f"Built player store with {len(df)} players at {store_path}")
+    return store_path
+
+
+# -----------------------------
+# Read side
+# -----------------------------
+class PlayerStore:
+    def __init__(self, store_path = STORE_PATH):
+        self.path     = store_path
+        # Read before the data files: a rebuild racing this open leaves an older label, never a newer one
+        self.version  = read_version(store_path)
+        self.table    = pa.ipc.open_file(pa.memory_map(store_path, 'r')).read_all()
+        self.index    = np.load(store_path + INDEX_SUFFIX, mmap_mode = 'r')
+        self.knn_ids  = np.load(store_path + KNN_SUFFIX, mmap_mode = 'r')
+        self.knn_dist = np.load(store_path + DIST_SUFFIX, mmap_mode = 'r')
+        self.ids      = self.table.column('id').to_numpy()
+        self._display = self.table.drop_columns([c for c in HIDDEN_COLUMNS if c in self.table.column_names])
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __contains__(self, player_id):
+        return self.row_of(player_id) is not None
+
+    def row_of(self, player_id):
+        if 0 <= player_id < len(self.index):
+            row = int(self.index[player_id])
+            if row >= 0:
+                return row
+        return None
+
+    def column(self, name):
+        return self.table.column(name).to_pylist()
+
+    def record(self, row):
+        return self._display.slice(row, 1).to_pylist()[0]
+
+    def rows_of(self, player_ids):
+        player_ids = np.asarray(player_ids, dtype = np.int64)
+        in_range   = (player_ids >= 0) & (player_ids < len(self.index))
+        rows       = np.full(len(player_ids), -1, dtype = np.int64)
+        rows[in_range] = self.index[player_ids[in_range]]
+        return rows
+
+    def take(self, rows, columns = SIMILAR_COLUMNS):
+        return self.table.select(columns).take(np.asarray(rows)).to_pylist()
+
+    def neighbor_ids(self, row):
+        ids = self.knn_ids[row]
+        return ids[ids >= 0]
+
+    def similar(self, rows, columns = SIMILAR_COLUMNS):
+        # One gather over the neighbor matrix and one take() for all requested rows
+        neighbors = self.knn_ids[np.asarray(rows)]
+        valid     = neighbors >= 0
+        records   = self.table.select(columns).take(self.index[neighbors[valid]]).to_pylist()
+        offsets   = np.concatenate([[0], np.cumsum(valid.sum(axis = 1))])
+        return [records[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def read_version(store_path = STORE_PATH):
+    path = store_path + VERSION_SUFFIX
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip()
+
+def _is_stale(source_path, store_path):
+    for suffix in ['', INDEX_SUFFIX, KNN_SUFFIX, DIST_SUFFIX, VERSION_SUFFIX]:
+        if not os.path.exists(store_path + suffix):
+            return True
+    if not os.path.exists(source_path):
+        return False
+    return os.path.getmtime(source_path) > os.path.getmtime(store_path)
+
+def refresh_store(source_path = SOURCE_PATH, store_path = STORE_PATH):
+    # Rebuilds a stale store and returns the version now on disk. Processes sharing the
+    # store compare this with the version they have open, not file times, since
+    # whichever process rebuilds first makes the store newer than the source for all
+    if _is_stale(source_path, store_path):
+        build_store(source_path, store_path)
+    return read_version(store_path)
+
+def open_store(source_path = SOURCE_PATH, store_path = STORE_PATH):
+    refresh_store(source_path, store_path)
+    return PlayerStore(store_path)
+
+
+if __name__ == '__main__':
+    build_store()
@@ -0,0 +1,176 @@
+import os
+import time
+import argparse
+import threading
+import numpy as np
+import features
+import model_cache
+
+# -----------------------------
+# Config
+# -----------------------------
+TABLE_DIR    = os.environ.get('PREDICTION_TABLE_DIR', os.path.join(model_cache.CACHE_DIR, 'predictions'))
+CHUNK_ROWS   = int(os.environ.get('PREDICTION_CHUNK_ROWS', 4096))
+POLL_SECONDS = float(os.environ.get('PREDICTION_SOURCE_POLL_SECONDS', 60))
+
+
+# -----------------------------
+# Batch scoring
+# -----------------------------
+def score(model, X, chunk_rows = CHUNK_ROWS):
+    # (clusters, float32 class probabilities) for every row, chunk by chunk
+    proba = np.empty((len(X), len(model.classes_)), dtype = np.float32)
+    for start in range(0, len(X), chunk_rows):
+        proba[start:start + chunk_rows] = model.predict_proba(np.asarray(X[start:start + chunk_rows], dtype = np.float32))
+    return np.asarray(model.classes_).take(np.argmax(proba, axis = 1)), proba
+
+def table_path(name, version, feature_key, table_dir = TABLE_DIR):
+    return os.path.join(table_dir, name, f"{version}-{feature_key}.npz")
+
+def build_table(model, name, version, source_path = features.SOURCE_PATH, table_dir = TABLE_DIR):
+    # Scores every player of the source table once per (model version, source file)
+    path = table_path(name, version, features.cache_key(source_path), table_dir)
+    if os.path.exists(path):
+        return path
+
+    data = features.load_features(source_path)
+    if data.X.shape[1] != getattr(model, 'n_features_in_', data.X.shape[1]):
+        raise ValueError(f"{name} v{version} takes {model.n_features_in_} features, "
+                         f"the player table has {data.X.shape[1]}")
+
+    start = time.perf_counter()
+    # Duplicate rows of the same player: keep the first, like the player store
+    ids, first = np.unique(data.ids, return_index = True)
+    X = np.asarray(data.X[first])
+    clusters, proba = score(model, X)
+
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, ids = ids, X = X, clusters = clusters, proba = proba, classes = np.asarray(model.classes_),
+                 version = str(version))
+    os.replace(tmp_path, path)
+    print(f"Scored {len(ids)} players with {name} v{version} in {time.perf_counter() - start:.2f}s -> {path}")
+    return path
+
+
+# -----------------------------
+# Serving side
+# -----------------------------
+class Table:
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.ids      = data['ids']
+            self.X        = data['X']
+            self.clusters = data['clusters']
+            self.proba    = data['proba']
+            self.classes  = data['classes']
+            self.version  = str(data['version'])
+
+    def row_of(self, player_id):
+        i = np.searchsorted(self.ids, player_id)
+        return i if i < len(self.ids) and self.ids[i] == player_id else None
+
+
+class PredictionTable:
+    # (player id, model version) -> cluster and probabilities for the players in the
+    # source table. Rebuilt in the background when a new version is activated or the
+    # source file changes; until then lookups that do not match fall back to live inference.
+
+    def __init__(self, name = model_cache.MODEL_NAME, source_path = features.SOURCE_PATH, table_dir = TABLE_DIR,
+                 poll_seconds = POLL_SECONDS):
+        self.name          = name
+        self.source_path   = source_path
+        self.table_dir     = table_dir
+        self.poll_seconds  = poll_seconds
+        self.table         = None
+        self.current       = None   # (ids, X) of the source file as it is now
+        self.model         = None
+        self.version       = None
+        self._source_mtime = None
+        self._next_poll    = 0.0
+        self._lock         = threading.Lock()
+        # Loaded here rather than by the first rebuild, so live lookups work from startup
+        if os.path.exists(source_path):
+            try:
+                self._load_current()
+            except Exception as e:
+                print(f"Player features from {source_path} not loaded: {e}")
+
+    def _load_current(self):
+        data = features.load_features(self.source_path)
+        ids, first = np.unique(data.ids, return_index = True)
+        self.current = (ids, np.asarray(data.X[first]))
+        self._source_mtime = os.path.getmtime(self.source_path)
+
+    def rebuild(self, model = None, version = None):
+        # Runs off the request path: on model activation and when the source file changes
+        with self._lock:
+            if model is not None:
+                self.model, self.version = model, str(version)
+            if self.model is None or not os.path.exists(self.source_path):
+                return None
+            try:
+                self._load_current()
+                path  = build_table(self.model, self.name, self.version, self.source_path, self.table_dir)
+                table = Table(path)
+            except Exception as e:
+                print(f"Prediction table for {self.name} v{self.version} not built: {e}")
+                return None
+            self.table = table
+            return path
+
+    def rebuild_async(self, model = None, version = None):
+        threading.Thread(target = self.rebuild, args = (model, version), name = 'prediction-table', daemon = True).start()
+
+    def _poll_source(self):
+        now = time.monotonic()
+        if now < self._next_poll:
+            return
+        self._next_poll = now + self.poll_seconds
+        if (self._source_mtime is not None and os.path.exists(self.source_path)
+                and os.path.getmtime(self.source_path) != self._source_mtime):
+            self.rebuild_async()
+
+    def lookup(self, player_id, version):
+        # (cluster, classes, probabilities) when the table was built by this model
+        # version from the player's current feature vector, otherwise None
+        self._poll_source()
+        table, current = self.table, self.current
+        if table is None or table.version != str(version):
+            return None
+        row = table.row_of(player_id)
+        if row is None:
+            return None
+        if current is not None:
+            i = np.searchsorted(current[0], player_id)
+            if i < len(current[0]) and current[0][i] == player_id and not np.array_equal(current[1][i], table.X[row]):
+                return None
+        return table.clusters[row], table.classes, table.proba[row]
+
+    @property
+    def ready(self):
+        return self.current is not None
+
+    def features_of(self, player_id):
+        # Current feature vector for live inference, or None for players not in the source
+        # table (or before it is loaded, see ready)
+        if self.current is None:
+            return None
+        ids, X = self.current
+        i = np.searchsorted(ids, player_id)
+        return X[i:i + 1] if i < len(ids) and ids[i] == player_id else None
+
+
+if __name__ == '__main__':
+    import forest
+    parser = argparse.ArgumentParser(description = 'Score the whole player table with a registered model version')
+    parser.add_argument('--model-name', default = model_cache.MODEL_NAME)
+    parser.add_argument('--stage', default = model_cache.MODEL_STAGE)
+    parser.add_argument('--version', help = 'Registry version (default: latest in --stage)')
+    args = parser.parse_args()
+
+    manager = model_cache.ModelManager(args.model_name, args.stage, loader = forest.load_model)
+    version = args.version or manager.latest_version().version
+    model   = forest.load_model(manager.cache.fetch(args.model_name, version))
+    build_table(model, args.model_name, version)
@@ -0,0 +1,118 @@
+import os
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from prometheus_client import Counter, Gauge
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# -----------------------------
+# Config
+# -----------------------------
+MAX_ENTRIES    = int(os.environ.get('RESPONSE_CACHE_ENTRIES', 20000))
+MIN_COMPRESS   = 512   # bytes; smaller bodies are sent as they are
+GZIP_LEVEL     = 6
+BROTLI_QUALITY = 5
+CACHE_CONTROL  = 'no-cache'   # browsers keep the body but revalidate, so a new dataset shows up at once
+
+# -----------------------------
+# Prometheus metrics
+# -----------------------------
+cache_hits     = Counter('response_cache_hits_total', 'Responses served from the response cache', ['endpoint'])
+cache_misses   = Counter('response_cache_misses_total', 'Responses built and serialized on request', ['endpoint'])
+not_modified   = Counter('response_cache_not_modified_total', 'Conditional requests answered with 304', ['endpoint'])
+cache_entries  = Gauge('response_cache_entries', 'Serialized responses held in the response cache')
+cache_version  = Gauge('response_cache_dataset_info', 'Dataset version the cached responses belong to', ['version'])
+
+
+class Entry:
+    # One serialized response and its precompressed variants
+    def __init__(self, body, etag):
+        self.etag     = etag
+        self.bodies   = {'identity': body}
+        if len(body) >= MIN_COMPRESS:
+            self.bodies['gzip'] = gzip.compress(body, GZIP_LEVEL, mtime = 0)
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(body, quality = BROTLI_QUALITY)
+
+    def etag_for(self, encoding):
+        # Strong ETags are per representation, so each encoding gets its own
+        return self.etag if encoding == 'identity' else f"{self.etag}-{encoding}"
+
+    def etags(self):
+        return {self.etag_for(encoding) for encoding in self.bodies}
+
+
+class ResponseCache:
+    # (endpoint, key, dataset version) -> serialized JSON bytes. Only 200s are kept,
+    # and changing the dataset version drops everything.
+
+    def __init__(self, version, dumps, max_entries = MAX_ENTRIES):
+        self.dumps       = dumps
+        self.max_entries = max_entries
+        self.entries     = OrderedDict()
+        self.lock        = threading.Lock()
+        self.version     = None
+        self.set_version(version)
+
+    def set_version(self, version):
+        with self.lock:
+            if version == self.version:
+                return False
+            if self.version is not None:
+                cache_version.remove(self.version)
+            self.version = version
+            self.entries.clear()
+            cache_entries.set(0)
+            cache_version.labels(version).set(1)
+            return True
+
+    def get(self, endpoint, key, build):
+        # Entry for the current dataset, or (payload, status) from build() when that is not a 200
+        cache_key = (endpoint, key, self.version)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None:
+                self.entries.move_to_end(cache_key)
+        if entry is not None:
+            cache_hits.labels(endpoint).inc()
+            return entry
+
+        cache_misses.labels(endpoint).inc()
+        payload, status = build()
+        if status != 200:
+            return payload, status
+
+        body  = self.dumps(payload).encode()
+        entry = Entry(body, hashlib.sha256(body).hexdigest()[:32])
+        with self.lock:
+            if cache_key[2] == self.version:
+                self.entries[cache_key] = entry
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last = False)
+                cache_entries.set(len(self.entries))
+        return entry
+
+    def respond(self, endpoint, key, build, request, response_class):
+        entry = self.get(endpoint, key, build)
+        if not isinstance(entry, Entry):
+            payload, status = entry
+            return response_class(self.dumps(payload), status = status, mimetype = 'application/json')
+
+        encoding = next((e for e in ('br', 'gzip') if e in entry.bodies and request.accept_encodings[e]), 'identity')
+        if any(tag in entry.etags() for tag in request.if_none_match):
+            not_modified.labels(endpoint).inc()
+            response = response_class(status = 304)
+        else:
+            response = response_class(entry.bodies[encoding], mimetype = 'application/json')
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(entry.etag_for(encoding))
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        response.vary.add('Accept-Encoding')
+        return response
@@ -0,0 +1,158 @@
+import os
+import time
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+from sklearn.metrics import accuracy_score
+import features
+
+try:
+    import psutil
+except ImportError:  # fall back to /proc or getrusage for memory readings
+    psutil = None
+
+# -----------------------------
+# Config
+# -----------------------------
+SEARCH_WORKERS = int(os.environ.get('SEARCH_WORKERS', os.cpu_count() or 1))
+ETA            = 3      # keep the best 1/ETA of the candidates at each rung
+MIN_FRACTION   = 1 / 9  # share of the training rows used at the first rung
+N_CANDIDATES   = 27     # per model family in random mode
+
+# Model family -> (estimator, parameter space)
+SEARCH_SPACE = {
+    'random_forest': (RandomForestClassifier, {
+        'n_estimators':     [100, 200, 400],
+        'max_depth':        [None, 10, 20],
+        'min_samples_leaf': [1, 2, 4],
+        'max_features':     ['sqrt', 0.5],
+    }),
+    'extra_trees': (ExtraTreesClassifier, {
+        'n_estimators':     [100, 200, 400],
+        'max_depth':        [None, 10, 20],
+        'min_samples_leaf': [1, 2, 4],
+        'max_features':     ['sqrt', 0.5],
+    }),
+}
+
+
+def candidates(mode = 'random', n_candidates = N_CANDIDATES, random_state = 42):
+    out = []
+    for family, (_, space) in SEARCH_SPACE.items():
+        params = ParameterGrid(space) if mode == 'grid' else ParameterSampler(space, n_candidates, random_state = random_state)
+        out.extend((family, dict(p)) for p in params)
+    return out
+
+
+# -----------------------------
+# Memory sampling
+# -----------------------------
+def _rss():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class PeakMemory:
+    # Samples resident memory on a side thread while a fit runs; tree building
+    # allocates outside Python, so tracemalloc would miss most of it
+    def __init__(self, interval = 0.01):
+        self.interval = interval
+        self.peak     = 0
+
+    def __enter__(self):
+        self.baseline = self.peak = _rss()
+        self._stop    = threading.Event()
+        self._thread  = threading.Thread(target = self._sample, daemon = True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss())
+
+    @property
+    def peak_mb(self):
+        return (self.peak - self.baseline) / 1e6
+
+
+# -----------------------------
+# Worker side
+# -----------------------------
+_data = None
+
+def _init_worker(entry):
+    # Each worker maps the cached feature matrix once; nothing large is pickled per trial
+    global _data
+    _data = features.open_entry(entry)
+
+def make_model(family, params, random_state = 42, n_jobs = 1):
+    estimator, _ = SEARCH_SPACE[family]
+    return estimator(random_state = random_state, n_jobs = n_jobs, **params)
+
+def run_trial(trial):
+    family, params, train_rows, val_rows = trial['family'], trial['params'], trial['train_rows'], trial['val_rows']
+    model = make_model(family, params)
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        model.fit(_data.X[train_rows], _data.y[train_rows])
+        fit_seconds = time.perf_counter() - start
+    val_accuracy = accuracy_score(_data.y[val_rows], model.predict(_data.X[val_rows]))
+    # The allocator keeps memory freed by earlier trials, so report the absolute peak as well
+    return dict(trial, val_accuracy = float(val_accuracy), fit_seconds = fit_seconds,
+                peak_memory_mb = memory.peak_mb, peak_rss_mb = memory.peak / 1e6)
+
+
+# -----------------------------
+# Successive halving
+# -----------------------------
+def rung_sizes(n_train, n_candidates, eta = ETA, min_fraction = MIN_FRACTION):
+    # Training rows per rung: grows by eta while there are candidates left to cut,
+    # the last rung always uses the full train split
+    sizes, fraction = [], min_fraction
+    while fraction < 1 and n_candidates > 1:
+        sizes.append(max(1, int(n_train * fraction)))
+        fraction     *= eta
+        n_candidates  = max(1, n_candidates // eta)
+    return sizes + [n_train]
+
+def successive_halving(entry, train_rows, val_rows, trials, workers = SEARCH_WORKERS, eta = ETA,
+                       min_fraction = MIN_FRACTION, on_result = None, random_state = 42):
+    # Every candidate starts on a small slice of the training rows; only the best
+    # 1/eta move on to a larger slice. Returns (best, all results).
+    order   = np.random.RandomState(random_state).permutation(train_rows)
+    sizes   = rung_sizes(len(train_rows), len(trials), eta, min_fraction)
+    alive   = list(trials)
+    results = []
+
+    with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker, initargs = (entry,)) as pool:
+        for rung, size in enumerate(sizes):
+            jobs = [{'family': family, 'params': params, 'rung': rung, 'n_train': size,
+                     'train_rows': np.sort(order[:size]), 'val_rows': val_rows} for family, params in alive]
+            scored = []
+            for result in pool.map(run_trial, jobs):
+                result = {k: v for k, v in result.items() if k not in ('train_rows', 'val_rows')}
+                results.append(result)
+                scored.append(result)
+                if on_result is not None:
+                    on_result(result)
+
+            print(f"Rung {rung}: {len(jobs)} candidates on {size} rows, best val accuracy "
+                  f"{max(r['val_accuracy'] for r in scored):.4f}")
+            # Ties go to the cheaper fit
+            scored.sort(key = lambda r: (-r['val_accuracy'], r['fit_seconds']))
+            if rung < len(sizes) - 1:
+                alive = [(r['family'], r['params']) for r in scored[:max(1, len(scored) // eta)]]
+
+    return scored[0], results
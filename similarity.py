@@ -0,0 +1,261 @@
+import os
+import json
+import threading
+from collections import namedtuple
+import numpy as np
+import player_store
+import features
+
+try:
+    import hnswlib
+except ImportError:  # fall back to exact search
+    hnswlib = None
+
+# -----------------------------
+# Config
+# -----------------------------
+INDEX_PATH     = os.environ.get('SIMILARITY_INDEX_PATH', 'similarity_index')
+HEATMAP_PATH   = os.environ.get('HEATMAP_FEATURES_PATH', 'player_heatmap_features.npz')
+WEIGHT_FACTOR  = 5.0   # same spatial weighting as "4. Player Matching.ipynb"
+HNSW_M         = 16
+HNSW_EF_BUILD  = 100
+HNSW_EF_QUERY  = 64
+# Filters that leave fewer candidates than this are answered by brute force,
+# which is both exact and faster than a heavily filtered graph walk
+EXACT_SEARCH_LIMIT = 2048
+
+# Similarity uses every stat column, clearances included
+STAT_COLUMNS = features.STAT_COLUMNS
+
+
+# Player heatmap grid features, rows sorted by id
+SpatialFeatures = namedtuple('SpatialFeatures', ['ids', 'features'])
+
+
+# -----------------------------
+# Feature matrix
+# -----------------------------
+def _normalise_columns(df):
+    # process_data() emits "Matches Played" style names, the player table uses snake case
+    return df.rename(columns = lambda c: c.lower().replace(' ', '_'))
+
+def stat_matrix(df):
+    # Unrounded percentages, unlike the cluster model's inputs
+    return np.nan_to_num(features.transform(df, STAT_COLUMNS, decimals = None), nan = 0.0)
+
+def load_spatial_features(path = HEATMAP_PATH):
+    # Dense (ids, float32 matrix) from source/heatmap_features.py; the old
+    # [{playerId, features}] JSON export is still read
+    if not path or not os.path.exists(path):
+        return None
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            ids, matrix = data['ids'].astype(np.int64), data['features'].astype(np.float32)
+    else:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        ids    = np.array([int(entry['playerId']) for entry in data], dtype = np.int64)
+        matrix = np.array([entry['features'] for entry in data], dtype = np.float32).reshape(len(data), -1)
+    order = np.argsort(ids, kind = 'stable')
+    return SpatialFeatures(ids[order], matrix[order])
+
+def spatial_matrix(ids, spatial, dims = None):
+    # Rows for ids by binary search over the sorted feature ids; unknown players get zeros
+    if dims is None:
+        dims = spatial.features.shape[1] if spatial is not None else 0
+    out = np.zeros((len(ids), dims), dtype = np.float32)
+    if spatial is None or not len(spatial.ids) or not dims:
+        return out
+    ids   = np.asarray(ids, dtype = np.int64)
+    pos   = np.minimum(np.searchsorted(spatial.ids, ids), len(spatial.ids) - 1)
+    found = spatial.ids[pos] == ids
+    out[found] = spatial.features[pos[found]]
+    return out * WEIGHT_FACTOR
+
+
+def matching_vectors(df, spatial = None):
+    # (deduplicated df, vectors, data_min, data_scale): MinMax-scaled stats as in the
+    # matching notebook plus the weighted heatmap features
+    df    = _normalise_columns(df).drop_duplicates('id', keep = 'first').reset_index(drop = True)
+    stats = stat_matrix(df)
+
+    # The scale is kept so streamed players use the same one
+    data_min   = stats.min(axis = 0)
+    data_scale = stats.max(axis = 0) - data_min
+    data_scale[data_scale == 0] = 1.0
+
+    space   = spatial_matrix(df['id'].to_numpy(dtype = np.int64), spatial)
+    vectors = np.hstack([(stats - data_min) / data_scale, space]).astype(np.float32)
+    return df, vectors, data_min, data_scale
+
+
+# -----------------------------
+# Engine
+# -----------------------------
+class SimilarityEngine:
+    def __init__(self, ids, roles, values, vectors, data_min, data_scale, spatial_dims, index = None):
+        self.ids          = ids
+        self.roles        = roles
+        self.values       = values
+        self.vectors      = vectors
+        self.data_min     = data_min
+        self.data_scale   = data_scale
+        self.spatial_dims = spatial_dims
+        self.index        = index
+        self.row_by_id    = {int(pid): i for i, pid in enumerate(ids)}
+        self._lock        = threading.RLock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, player_id):
+        return player_id in self.row_by_id
+
+    @classmethod
+    def build(cls, df, spatial = None):
+        df, vectors, data_min, data_scale = matching_vectors(df, spatial)
+        # Copies: add_players updates roles / values in place, and pandas hands out read-only views
+        engine = cls(df['id'].to_numpy(dtype = np.int64), df['role'].to_numpy(dtype = object, copy = True),
+                     df['market_value_in_eur'].to_numpy(dtype = np.float64, copy = True),
+                     vectors, data_min, data_scale, vectors.shape[1] - len(STAT_COLUMNS))
+        engine._build_index()
+        return engine
+
+    def _build_index(self):
+        if hnswlib is None:
+            return
+        index = hnswlib.Index(space = 'l2', dim = self.vectors.shape[1])
+        index.init_index(max_elements = max(len(self.ids), 1), ef_construction = HNSW_EF_BUILD, M = HNSW_M)
+        index.add_items(self.vectors, np.arange(len(self.ids)))
+        index.set_ef(HNSW_EF_QUERY)
+        self.index = index
+
+    def transform(self, df, spatial = None):
+        stats = stat_matrix(df)
+        ids   = df['id'].to_numpy(dtype = np.int64)
+        space = spatial_matrix(ids, spatial, self.spatial_dims)
+        return np.hstack([(stats - self.data_min) / self.data_scale, space]).astype(np.float32)
+
+    # -----------------------------
+    # Queries
+    # -----------------------------
+    def _allowed(self, role, max_value):
+        allowed = np.ones(len(self.ids), dtype = bool)
+        if role is not None:
+            allowed &= self.roles == role
+        if max_value is not None:
+            allowed &= self.values <= max_value  # unknown market values never pass
+        return allowed
+
+    def query(self, player_id, k = 10, role = None, max_value = None):
+        with self._lock:
+            row     = self.row_by_id[player_id]
+            allowed = self._allowed(role, max_value)
+            allowed[row] = False
+            n_allowed = int(allowed.sum())
+            k = min(k, n_allowed)
+            if k <= 0:
+                return []
+
+            query = self.vectors[row:row + 1]
+            if self.index is None or n_allowed <= EXACT_SEARCH_LIMIT:
+                candidates = np.flatnonzero(allowed)
+                dists      = np.linalg.norm(self.vectors[candidates] - query, axis = 1)
+                top        = np.argpartition(dists, k - 1)[:k] if k < len(dists) else np.arange(len(dists))
+                top        = top[np.argsort(dists[top], kind = 'stable')]
+                labels, dists = candidates[top], dists[top]
+            else:
+                self.index.set_ef(max(HNSW_EF_QUERY, k))
+                labels, dists = self.index.knn_query(query, k = k, filter = lambda label: allowed[label])
+                labels, dists = labels[0].astype(np.int64), np.sqrt(dists[0])
+
+            return [(int(self.ids[label]), float(dist)) for label, dist in zip(labels, dists)]
+
+    # -----------------------------
+    # Live insertion
+    # -----------------------------
+    def add_players(self, df, spatial = None):
+        # Upserts players from a final_player_df / process_data() shaped frame
+        df = _normalise_columns(df).drop_duplicates('id', keep = 'last').reset_index(drop = True)
+        vectors = self.transform(df, spatial)
+        # Streamed stat frames carry no role / market value; existing metadata is kept for those
+        has_meta = 'role' in df and 'market_value_in_eur' in df
+        roles    = df['role'].to_numpy(dtype = object) if has_meta else np.full(len(df), None, dtype = object)
+        values   = df['market_value_in_eur'].to_numpy(dtype = np.float64) if has_meta else np.full(len(df), np.nan)
+
+        with self._lock:
+            labels = np.empty(len(df), dtype = np.int64)
+            new    = []
+            for i, pid in enumerate(df['id'].to_numpy(dtype = np.int64)):
+                row = self.row_by_id.get(int(pid))
+                if row is None:
+                    row = len(self.ids) + len(new)
+                    new.append(i)
+                    self.row_by_id[int(pid)] = row
+                labels[i] = row
+
+            if new:
+                self.ids     = np.concatenate([self.ids, df['id'].to_numpy(dtype = np.int64)[new]])
+                self.roles   = np.concatenate([self.roles, roles[new]])
+                self.values  = np.concatenate([self.values, values[new]])
+                self.vectors = np.concatenate([self.vectors, np.zeros((len(new), self.vectors.shape[1]), dtype = np.float32)])
+
+            self.vectors[labels] = vectors
+            if has_meta:
+                self.roles[labels]  = roles
+                self.values[labels] = values
+
+            if self.index is not None:
+                if len(self.ids) > self.index.get_max_elements():
+                    self.index.resize_index(max(len(self.ids), 2 * self.index.get_max_elements()))
+                # Re-adding an existing label replaces its vector in place
+                self.index.add_items(vectors, labels)
+
+        return len(new)
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def save(self, path = INDEX_PATH):
+        with self._lock:
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            with open(tmp_path + '.npz', 'wb') as f:
+                np.savez(f, ids = self.ids, roles = self.roles.astype(str), role_known = self.roles != None,
+                         values = self.values, vectors = self.vectors, data_min = self.data_min,
+                         data_scale = self.data_scale, spatial_dims = self.spatial_dims)
+            if self.index is not None:
+                self.index.save_index(tmp_path + '.hnsw')
+                os.replace(tmp_path + '.hnsw', path + '.hnsw')
+            os.replace(tmp_path + '.npz', path + '.npz')
+
+    @classmethod
+    def load(cls, path = INDEX_PATH):
+        meta  = np.load(path + '.npz')
+        roles = meta['roles'].astype(object)
+        roles[~meta['role_known']] = None
+        engine = cls(meta['ids'], roles, meta['values'], meta['vectors'], meta['data_min'],
+                     meta['data_scale'], int(meta['spatial_dims']))
+
+        if hnswlib is not None and os.path.exists(path + '.hnsw'):
+            index = hnswlib.Index(space = 'l2', dim = engine.vectors.shape[1])
+            index.load_index(path + '.hnsw', max_elements = len(engine.ids))
+            index.set_ef(HNSW_EF_QUERY)
+            engine.index = index
+        else:
+            engine._build_index()
+        return engine
+
+
+def open_engine(path = INDEX_PATH, source_path = player_store.SOURCE_PATH):
+    if os.path.exists(path + '.npz') and not (os.path.exists(source_path) and
+                                              os.path.getmtime(source_path) > os.path.getmtime(path + '.npz')):
+        return SimilarityEngine.load(path)
+    engine = SimilarityEngine.build(player_store.load_source(source_path), load_spatial_features())
+    engine.save(path)
+    return engine
+
+
+if __name__ == '__main__':
+    engine = SimilarityEngine.build(player_store.load_source(), load_spatial_features())
+    engine.save()
+    print(f"Built similarity index over {len(engine)} players ({engine.vectors.shape[1]} dims) at {INDEX_PATH}")
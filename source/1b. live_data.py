@@ -1,24 +1,53 @@
+import os
+import random
 import pandas as pd
 import asyncio
 import time
-import statsbombapi
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
 from prometheus_client import Counter, start_http_server, Gauge, Histogram
+import event_store
+from checkpoint import Checkpoint
 
 # -----------------------------
 # Global State
 # -----------------------------
-api = statsbombapi.StatsbombPublic()
 MATCH_BUFFER = []
-all_event_dfs = []  # Store all processed events
-PROCESSED_MATCH_IDS = set()
-BUFFER_SIZE = 5
-SLEEP_TIME = 0.2  # simulate I/O delay
+# Durable record of written matches; restarts resume from here instead of refetching everything
+checkpoint = Checkpoint()
+PROCESSED_MATCHES = checkpoint.processed_matches()  # match_id -> last_updated of the written version
+QUEUED_MATCH_IDS = set()  # buffered or in flight in this process
+BUFFER_SIZE = int(os.environ.get('BUFFER_SIZE', 32))
 
-dataframe_decoder = statsbombapi.decoders.CompositeDecoder(
-    statsbombapi.decoders.JsonDecoder(),
-    statsbombapi.decoders.UniformDecoder(pd.DataFrame)
-)
-df_client = statsbombapi.StatsbombPublic(decoder=dataframe_decoder)
+# StatsBomb open data; point this at a local fixture server (e.g. `python -m http.server`
+# over a checkout of the open-data repo) to test without hitting GitHub
+BASE_URL = os.environ.get('STATSBOMB_BASE_URL', 'https://raw.githubusercontent.com/statsbomb/open-data/master/data')
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', 16))
+FETCH_RETRIES = int(os.environ.get('FETCH_RETRIES', 4))
+FETCH_BACKOFF = float(os.environ.get('FETCH_BACKOFF', 0.5))  # seconds, doubled per retry
+FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', 30))
+
+COMPETITION_ID = 11
+DEFAULT_SEASON_IDS = [1, 2]
+BACKFILL_SEASON_IDS = [1, 2, 4, 21, 22, 23, 24, 25, 26, 27, 37, 38, 39, 40, 41, 42, 86, 90, 278]
+if os.environ.get('STATSBOMB_SEASON_IDS'):
+    SEASON_IDS = [int(s) for s in os.environ['STATSBOMB_SEASON_IDS'].split(',')]
+elif os.environ.get('STATSBOMB_BACKFILL'):
+    SEASON_IDS = BACKFILL_SEASON_IDS
+else:
+    SEASON_IDS = DEFAULT_SEASON_IDS
+
+# One pooled HTTP session shared by all fetch workers
+session = requests.Session()
+adapter = requests.adapters.HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS)
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+fetch_slots = asyncio.Semaphore(FETCH_WORKERS)
+
+# Matches carry their competition/season so events can be partitioned on write
+MatchRef = namedtuple('MatchRef', ['id', 'competition_id', 'season_id', 'last_updated'])
 
 # # Prometheus metrics
 # matches_processed = Counter('matches_processed_total', 'Total matches processed in batches')
@@ -29,6 +58,12 @@ matches_processed = Counter('matches_processed_total', 'Total matches processed
 batches_processed = Counter('batches_processed_total', 'Total batches processed')
 match_buffer_size = Gauge('match_buffer_size', 'Current size of the match buffer')
 processing_duration = Histogram('match_batch_processing_seconds', 'Time spent processing a batch of matches')
+events_written = Counter('events_written_total', 'Events written to the Parquet event store')
+match_fetch_latency = Histogram('match_fetch_seconds', 'Time to fetch the events of a single match, including retries',
+                                buckets=[0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60])
+matches_in_flight = Gauge('match_fetch_in_flight', 'Match event requests currently in flight')
+fetch_retries = Counter('match_fetch_retries_total', 'Retried StatsBomb requests')
+fetch_failures = Counter('match_fetch_failures_total', 'Matches that failed after all retries')
 
 match_buffer_size.set(len(MATCH_BUFFER))
 
@@ -83,38 +118,94 @@ start_http_server(8000)
 #         await process_match_batch(MATCH_BUFFER)
 #         MATCH_BUFFER = []
 
-@processing_duration.time()
-async def process_match_batch(batch):
-    await asyncio.sleep(SLEEP_TIME)
-    match_ids = [m.id for m in batch]
-    print(f"Processing batch: {match_ids}")
-    
-    batch_dfs = []
+# -----------------------------
+# HTTP fetching
+# -----------------------------
+def get_json(path, etag=None):
+    # Returns (data, etag); data is None when the server answers 304 Not Modified
+    headers = {'If-None-Match': etag} if etag else {}
+    response = session.get(f"{BASE_URL}/{path}", headers=headers, timeout=FETCH_TIMEOUT)
+    if response.status_code == 304:
+        return None, etag
+    response.raise_for_status()
+    return response.json(), response.headers.get('ETag')
 
-    for match_id in match_ids:
+def _is_retryable(error):
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, requests.RequestException)
+
+async def fetch_json(path, etag=None):
+    loop = asyncio.get_running_loop()
+    attempt = 0
+    while True:
         try:
-            df = df_client.events(match_id=match_id)
-            df['match_id'] = match_id
-            batch_dfs.append(df)
+            return await loop.run_in_executor(executor, get_json, path, etag)
         except Exception as e:
-            print(f"Error processing match {match_id}: {e}")
+            if attempt >= FETCH_RETRIES or not _is_retryable(e):
+                raise
+        fetch_retries.inc()
+        # Exponential backoff with jitter so parallel retries do not line up
+        await asyncio.sleep(FETCH_BACKOFF * 2 ** attempt * (0.5 + random.random()))
+        attempt += 1
+
+# -----------------------------
+# Async Batch Processor
+# -----------------------------
+async def process_match(match):
+    async with fetch_slots:
+        matches_in_flight.inc()
+        try:
+            with match_fetch_latency.time():
+                events, _ = await fetch_json(f"events/{match.id}.json")
+        finally:
+            matches_in_flight.dec()
+
+    df = pd.DataFrame(events)
+    df['match_id'] = match.id
+    # Each match is flushed to its own Parquet partition straight away
+    path = await asyncio.get_running_loop().run_in_executor(
+        executor, event_store.write_match, df, match.competition_id, match.season_id, match.id)
 
-    if batch_dfs:
-        combined_df = pd.concat(batch_dfs, ignore_index=True)
-        all_event_dfs.append(combined_df)
-        print(f"Combined events from {len(match_ids)} matches. Final shape: {combined_df.shape}")
-    else:
-        print("No events processed in this batch.")
+    # The partition is in place before it is recorded, so the checkpoint never
+    # lists a match whose events are missing
+    checkpoint.record_match(match.id, match.competition_id, match.season_id, match.last_updated, path, len(df))
+    PROCESSED_MATCHES[match.id] = match.last_updated
+    return len(df)
 
-    matches_processed.inc(len(match_ids))
-    batches_processed.inc()
+async def process_match_batch(batch):
+    with processing_duration.time():
+        match_ids = [m.id for m in batch]
+        print(f"Processing batch: {match_ids}")
+
+        results = await asyncio.gather(*[process_match(m) for m in batch], return_exceptions=True)
+
+        n_events = 0
+        for match, result in zip(batch, results):
+            QUEUED_MATCH_IDS.discard(match.id)
+            if isinstance(result, Exception):
+                # Not checkpointed, so it is picked up again on the next poll
+                fetch_failures.inc()
+                print(f"Error processing match {match.id}: {result}")
+            else:
+                n_events += result
+
+        if n_events:
+            events_written.inc(n_events)
+            print(f"Wrote {n_events} events from {len(match_ids)} matches to {event_store.EVENTS_DIR}")
+        else:
+            print("No events processed in this batch.")
+
+        matches_processed.inc(len(match_ids))
+        batches_processed.inc()
 
 async def stream_matches(matches):
     global MATCH_BUFFER
     for match in matches:
-        if match.id not in PROCESSED_MATCH_IDS:
+        if match.id not in QUEUED_MATCH_IDS:
             MATCH_BUFFER.append(match)
-            PROCESSED_MATCH_IDS.add(match.id)
+            QUEUED_MATCH_IDS.add(match.id)
 
         match_buffer_size.set(len(MATCH_BUFFER))
 
@@ -123,40 +214,77 @@ async def stream_matches(matches):
             MATCH_BUFFER = []
             match_buffer_size.set(0)
 
+    # Final leftover batch
+    if MATCH_BUFFER:
+        await process_match_batch(MATCH_BUFFER)
+        MATCH_BUFFER = []
+        match_buffer_size.set(0)
+
 # -----------------------------
 # Fetch New Matches Only
 # -----------------------------
+def is_new_match(match, high_water):
+    if match['match_id'] not in PROCESSED_MATCHES:
+        return True
+    # Already written: only refetch if StatsBomb updated it after the version we hold
+    updated = match.get('last_updated')
+    written = PROCESSED_MATCHES[match['match_id']]
+    return updated is not None and updated > (high_water or '') and updated > (written or '')
+
+async def fetch_season_matches(comp):
+    high_water, etag = checkpoint.season_state(comp['competition_id'], comp['season_id'])
+    async with fetch_slots:
+        matches, new_etag = await fetch_json(f"matches/{comp['competition_id']}/{comp['season_id']}.json", etag)
+    return high_water, matches, new_etag
+
 async def fetch_new_matches():
-    competitions = api.competitions()
-    desired_season_ids = [1, 2]#, 4, 21, 22, 23, 24, 25, 26, 27, 37, 38, 39, 40, 41, 42, 86, 90, 278]
-    comps = [c for c in competitions if c.competition_id == 11 and c.season_id in desired_season_ids]
+    competitions, _ = await fetch_json("competitions.json")
+    comps = [c for c in competitions if c['competition_id'] == COMPETITION_ID and c['season_id'] in SEASON_IDS]
 
     if not comps:
         print("No matching competitions found!")
-        return []
+        return [], []
 
     all_matches = []
-    for comp in comps:
-        try:
-            matches = await asyncio.to_thread(api.matches, comp.competition_id, comp.season_id)
-            new_matches = [m for m in matches if m.id not in PROCESSED_MATCH_IDS]
-            all_matches.extend(new_matches)
-        except Exception as e:
-            print(f"Failed to load matches for comp {comp.competition_id}, season {comp.season_id}: {e}")
+    season_updates = []
+    results = await asyncio.gather(*[fetch_season_matches(c) for c in comps], return_exceptions=True)
+    for comp, result in zip(comps, results):
+        if isinstance(result, Exception):
+            print(f"Failed to load matches for comp {comp['competition_id']}, season {comp['season_id']}: {result}")
+            continue
+        high_water, matches, etag = result
+        if matches is None:
+            continue  # 304: nothing changed since the last complete poll
+
+        new_matches = [MatchRef(m['match_id'], comp['competition_id'], comp['season_id'], m.get('last_updated'))
+                       for m in matches if m['match_id'] not in QUEUED_MATCH_IDS and is_new_match(m, high_water)]
+        all_matches.extend(new_matches)
+
+        updates = [m.get('last_updated') for m in matches if m.get('last_updated')]
+        season_updates.append((comp['competition_id'], comp['season_id'], max(updates + [high_water or '']) or None,
+                               etag, new_matches))
+
+    return all_matches, season_updates
 
-    return all_matches
+def commit_seasons(season_updates):
+    # A season's high-water mark and ETag only advance once every match from
+    # that listing is checkpointed; otherwise a 304 could hide unfetched matches
+    for competition_id, season_id, high_water, etag, matches in season_updates:
+        if all(m.id in PROCESSED_MATCHES and PROCESSED_MATCHES[m.id] == m.last_updated for m in matches):
+            checkpoint.record_season(competition_id, season_id, high_water, etag)
 
 # -----------------------------
 # Main Streaming Loop
 # -----------------------------
 async def main_streaming_loop():
     while True:
-        new_matches = await fetch_new_matches()
+        new_matches, season_updates = await fetch_new_matches()
         if new_matches:
             print(f"Found {len(new_matches)} new matches.")
             await stream_matches(new_matches)
         else:
             print("No new matches. Sleeping...")
+        commit_seasons(season_updates)
         await asyncio.sleep(5)
 
 # -----------------------------
@@ -166,9 +294,7 @@ if __name__ == "__main__":
     try:
         asyncio.run(main_streaming_loop())
     except KeyboardInterrupt:
+        # Events are already on disk, one partition per processed match
         print("Streaming stopped.")
-        # Optional: Combine and save data
-        if all_event_dfs:
-            final_df = pd.concat(all_event_dfs, ignore_index=True)
-            final_df.to_csv("/mnt/block/data/final_datasets/streamed_data.csv", index=False)
-            print(f"Saved {len(final_df)} events to CSV.")
+    finally:
+        checkpoint.close()
@@ -1,10 +1,34 @@
+import os
+import argparse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import json
 import numpy as np
 import ast
-from functools import reduce
-
-def process_data():
+import pyarrow as pa
+import pyarrow.compute as pc
+import event_store
+
+# Parquet partitions written by the live streamer; a .csv path still works for old dumps
+EVENTS_PATH = event_store.EVENTS_DIR
+
+# Top-level event columns the aggregator needs
+EVENT_COLUMNS = ['type', 'player', 'match_id', 'shot', 'pass', 'duel', 'dribble', 'goalkeeper']
+
+COLUMNS = ['Id', 'Matches Played',
+           'Total Shots', 'Accurate Shots', 'Shot Accuracy', 'Goals', 'Shot Conversion', 'Penalties Taken', 'Penalties Scored', 'Penalty Conversion', 'Free Kick Shots',
+           'Total Passes', 'Accurate Passes', 'Pass Accuracy', 'Key Passes', 'Assists', 'Crosses', 'Free Kick Crosses', 
+           'Run Attempts With Ball', 'Successful Runs With Ball', 'Perc Successful Runs With Ball', 'Dribbles',
+           'Aerial Duels', 'Aerial Duels Won', 'Perc Aerial Duels Won', 'Ground Defensive duels Won', 'Loose Ball Duels', 'Loose Balls Won', 'Perc Loose Balls Won',
+           'Sliding Tackles', 'Interceptions', 'Clearances', 'Blocks', 'Possession Regained', 'Own Goals',
+           'GK Balls Attacked', 'GK Save Attempts', 'GK Successful Save Attempts', 'Perc GK Save Success'
+          ]
+
+# -----------------------------
+# Load
+# -----------------------------
+def load_events_csv(path):
     
     # Columns to convert
     columns_to_convert = [
@@ -29,193 +53,484 @@ def process_data():
     converters = {col: safe_eval for col in columns_to_convert}
 
     # Load the CSV with the converters
-    df = pd.read_csv("/mnt/block/data/final_datasets/streamed_data.csv", converters=converters)
-    
-    columns = ['Id', 'Matches Played',
-               'Total Shots', 'Accurate Shots', 'Shot Accuracy', 'Goals', 'Shot Conversion', 'Penalties Taken', 'Penalties Scored', 'Penalty Conversion', 'Free Kick Shots',
-               'Total Passes', 'Accurate Passes', 'Pass Accuracy', 'Key Passes', 'Assists', 'Crosses', 'Free Kick Crosses', 
-               'Run Attempts With Ball', 'Successful Runs With Ball', 'Perc Successful Runs With Ball', 'Dribbles',
-               'Aerial Duels', 'Aerial Duels Won', 'Perc Aerial Duels Won', 'Ground Defensive duels Won', 'Loose Ball Duels', 'Loose Balls Won', 'Perc Loose Balls Won',
-               'Sliding Tackles', 'Interceptions', 'Clearances', 'Blocks', 'Possession Regained', 'Own Goals',
-               'GK Balls Attacked', 'GK Save Attempts', 'GK Successful Save Attempts', 'Perc GK Save Success'
-              ]
-    
-    # Ensure player name is accessible
-    df['Id'] = df['player'].apply(lambda x: x['id'] if pd.notnull(x) else None)
-
-
-
-    # Replace None with np.nan to avoid issues in aggregations
-    df = df.replace({None: np.nan})
-
-    # Matches Played – since all events are from a single match, we set it as 1 for all
-    matches_played         = df.groupby('Id')['match_id'].nunique().reset_index()
-    matches_played.columns = ['Id', 'Matches Played']
-
-    # Shots
-    shots                           = df[df['type'].apply(lambda x: x.get('name') == 'Shot')].copy()
-    shots['Accurate Shot']          = shots['shot'].apply(lambda x: x.get('outcome', {}).get('name') == 'Goal' or x.get('outcome', {}).get('name') in ['On Target', 'Saved'])
-    shots['Goal']                   = shots['shot'].apply(lambda x: x.get('outcome', {}).get('name') == 'Goal')
-    shots_agg                       = shots.groupby('Id').agg(Total_Shots      = ('Id', 'count'),
-                                                              Accurate_Shots   = ('Accurate Shot', 'sum'),
-                                                              Goals            = ('Goal', 'sum'),
-                                                              Penalties_Taken  = ('shot', lambda x: sum(1 for s in x if s.get('type', {}).get('name') == 'Penalty')),
-                                                              Penalties_Scored = ('shot', lambda x: sum(1 for s in x if s.get('type', {}).get('name') == 'Penalty' and s.get('outcome', {}).get('name') == 'Goal')),
-                                                              Free_Kick_Shots  = ('shot', lambda x: sum(1 for s in x if s.get('type', {}).get('name') == 'Free Kick'))
-                                                             ).reset_index()
-
-    shots_agg['Shot Accuracy']      = shots_agg['Accurate_Shots'] / shots_agg['Total_Shots']
-    shots_agg['Shot Conversion']    = shots_agg['Goals'] / shots_agg['Total_Shots']
-    shots_agg['Penalty Conversion'] = shots_agg['Penalties_Scored'] / shots_agg['Penalties_Taken'].replace({0: np.nan})
-
-    # Passes
-    passes             = df[df['type'].apply(lambda x: x.get('name') == 'Pass')].copy()
-    passes['accurate'] = passes['pass'].apply(lambda x: x.get('outcome') is None)
-    passes['key_pass'] = passes['pass'].apply(lambda x: x.get('type', {}).get('name') == 'Key Pass')
-
-    passes_agg         = passes.groupby('Id').agg(Total_Passes      = ('Id', 'count'),
-                                                  Accurate_Passes   = ('accurate', 'sum'),
-                                                  Key_Passes        = ('key_pass', 'sum'),
-                                                  Crosses           = ('pass', lambda x: sum(1 for s in x if s.get('height', {}).get('name') == 'High Pass')),
-                                                  Free_Kick_Crosses = ('pass', lambda x: sum(1 for s in x if s.get('type', {}).get('name') == 'Free Kick' and s.get('height', {}).get('name') == 'High Pass'))
-                                                 ).reset_index()
-
-    passes_agg['Pass Accuracy'] = passes_agg['Accurate_Passes'] / passes_agg['Total_Passes']
-
-    # Assists
-    goals           = shots[shots['Goal']]
-    goals['Assist'] = goals['pass'].apply(lambda x: x.get('recipient', {}).get('name') if isinstance(x, dict) else np.nan)
-    assists_agg     = goals.groupby('Assist').agg(Assists=('Assist', 'count')).rename_axis('Id').reset_index()
-
-    # Carries / Runs With Ball
-    carries     = df[df['type'].apply(lambda x: x.get('name') == 'Carry')].copy()
-    carries_agg = carries.groupby('Id').agg(Run_Attempts_With_Ball=('Id', 'count'),
-                                            Successful_Runs_With_Ball=('Id', 'count')
-                                           ).reset_index()
-
-    # Dribbles
-    dribbles             = df[df['type'].apply(lambda x: x.get('name') == 'Dribble')].copy()
-    dribbles['Dribbles'] = dribbles['dribble'].apply(lambda x: x.get('outcome', {}).get('name') == 'Complete')
-    dribbles_agg         = dribbles.groupby('Id').agg(Dribbles = ('Dribbles', 'sum')).reset_index()
-
-    # Defensive duels, aerials, and other duels
-    duels           = df[df['type'].apply(lambda x: x.get('name') == 'Duel')].copy()
-    duels['aerial'] = duels['duel'].apply(lambda x: x.get('type', {}).get('name') == 'Aerial Duel')
-    duels['won']    = duels['duel'].apply(lambda x: x.get('outcome', {}).get('name') == 'Won')
-    aerials         = duels[duels['aerial']]
-    aerials_agg     = aerials.groupby('Id').agg(Aerial_Duels = ('Id', 'count'),
-                                                Aerial_Duels_Won=('won', 'sum')
-                                               ).reset_index()
-    aerials_agg['Perc Aerial Duels Won'] = aerials_agg['Aerial_Duels_Won'] / aerials_agg['Aerial_Duels']
-
-    ground_def_duels = df[df['type'].apply(lambda x: x.get('name') == 'Duel')].copy()
-    ground_def_duels = ground_def_duels[ground_def_duels['duel'].apply(lambda x: x.get('type', {}).get('name') == 'Ground defending duel')]
-
-    ground_def_duels['won'] = ground_def_duels['duel'].apply(lambda x: x.get('outcome', {}).get('name') == 'Won')
-
-    ground_def_duels_agg = ground_def_duels.groupby('Id').agg(Ground_Defensive_Duels = ('Id', 'count'),
-                                                              Ground_Defensive_Duels_Won=('won', 'sum')
-                                                             ).reset_index()
-
-    ground_def_duels_agg['Perc Ground Defensive Duels Won'] = (
-        ground_def_duels_agg['Ground_Defensive_Duels_Won'] / ground_def_duels_agg['Ground_Defensive_Duels'].replace(0, np.nan)
-                                                              )
-
-    loose_ball_duels = df[df['type'].apply(lambda x: x.get('name') == 'Duel')].copy()
-    loose_ball_duels = loose_ball_duels[loose_ball_duels['duel'].apply(lambda x: x.get('type', {}).get('name') == 'Loose Ball')]
-
-    loose_ball_duels['won'] = loose_ball_duels['duel'].apply(lambda x: x.get('outcome', {}).get('name') == 'Won')
-
-    loose_ball_duels_agg    = loose_ball_duels.groupby('Id').agg(Loose_Ball_Duels = ('Id', 'count'),
-                                                                 Loose_Balls_Won = ('won', 'sum')
-                                                                ).reset_index()
-
-    loose_ball_duels_agg['Perc Loose Balls Won'] = (
-        loose_ball_duels_agg['Loose_Balls_Won'] / loose_ball_duels_agg['Loose_Ball_Duels'].replace(0, np.nan)
-                                                   )
-
-    # Sliding tackles, interceptions, clearances, blocks, possession regain
-    interceptions     = df[df['type'].apply(lambda x: x.get('name') == 'Interception')].copy()
-    interceptions_agg = interceptions.groupby('Id').agg(Interceptions = ('Id', 'count')).reset_index()
-
-    tackles     = df[df['type'].apply(lambda x: x.get('name') == 'Block')].copy()
-    tackles_agg = tackles.groupby('Id').agg(Sliding_Tackles = ('Id', 'count')).reset_index()
-
-    # Clearances
-    clearances     = df[df['type'].apply(lambda x: x.get('name') == 'Clearance')]
-    clearances_agg = clearances.groupby('Id').agg(Clearances = ('Id', 'count')).reset_index()
-
-    # Ball recoveries
-    recoveries     = df[df['type'].apply(lambda x: x.get('name') == 'Ball Recovery')]
-    recoveries_agg = recoveries.groupby('Id').agg(Possession_Regained = ('Id', 'count')).reset_index()
-
-    blocks         = df[df['type'].apply(lambda x: x.get('name') == 'Block')].copy()
-
-    blocks_agg = blocks.groupby('Id').agg(Blocks = ('Id', 'count')).reset_index()
-
-    shots     = df[df['type'].apply(lambda x: x.get('name') == 'Shot')].copy()
-    own_goals = shots[shots['shot'].apply(lambda x: x.get('outcome', {}).get('name') == 'Own Goal')]
-
-    own_goals_agg = own_goals.groupby('Id').agg(Own_Goals = ('Id', 'count')).reset_index()
-
-    # Goalkeeper
-    gk            = df[df['type'].apply(lambda x: x.get('name') == 'Goal Keeper')].copy()
-    gk['save']    = gk['goalkeeper'].apply(lambda x: x.get('type', {}).get('name') == 'Shot Saved')
-    gk['success'] = gk['goalkeeper'].apply(lambda x: x.get('outcome', {}).get('name') == 'Success')
-    gk_agg        = gk.groupby('Id').agg(GK_Balls_Attacked           = ('Id', 'count'),
-                                         GK_Save_Attempts            = ('save', 'sum'),
-                                         GK_Successful_Save_Attempts = ('success', 'sum')
-                                        ).reset_index()
-    gk_agg['Perc GK Save Success'] = gk_agg['GK_Successful_Save_Attempts'] / gk_agg['GK_Save_Attempts'].replace(0, np.nan)
-
-    # Combine all
-    dfs = [matches_played, shots_agg, passes_agg, assists_agg, carries_agg, dribbles_agg,
-           aerials_agg, ground_def_duels_agg, loose_ball_duels_agg,
-           interceptions_agg, tackles_agg, clearances_agg, recoveries_agg, blocks_agg, own_goals_agg,
-           gk_agg]
-
-    final_df = reduce(lambda left, right: pd.merge(left, right, on = 'Id', how = 'outer'), dfs)
-    final_df = final_df.fillna(0)
-
-    # Add percentage of successful runs
-    final_df['Perc Successful Runs With Ball'] = final_df['Successful_Runs_With_Ball'] / final_df['Run_Attempts_With_Ball'].replace(0, np.nan)
-
-    # Rename for final output
-    final_df = final_df.rename(columns = {'Total_Shots': 'Total Shots',
-                                          'Accurate_Shots': 'Accurate Shots',
-                                          'Goals': 'Goals',
-                                          'Shot Accuracy': 'Shot Accuracy',
-                                          'Shot Conversion': 'Shot Conversion',
-                                          'Penalties_Taken': 'Penalties Taken',
-                                          'Penalties_Scored': 'Penalties Scored',
-                                          'Penalty Conversion': 'Penalty Conversion',
-                                          'Free_Kick_Shots': 'Free Kick Shots',
-                                          'Total_Passes': 'Total Passes',
-                                          'Accurate_Passes': 'Accurate Passes',
-                                          'Pass Accuracy': 'Pass Accuracy',
-                                          'Key_Passes': 'Key Passes',
-                                          'Crosses': 'Crosses',
-                                          'Free_Kick_Crosses': 'Free Kick Crosses',
-                                          'Run_Attempts_With_Ball': 'Run Attempts With Ball',
-                                          'Successful_Runs_With_Ball': 'Successful Runs With Ball',
-                                          'Dribbles': 'Dribbles',
-                                          'Aerial_Duels': 'Aerial Duels',
-                                          'Aerial_Duels_Won': 'Aerial Duels Won',
-                                          'Perc Aerial Duels Won': 'Perc Aerial Duels Won',
-                                          'Ground_Defensive_Duels_Won': 'Ground Defensive duels Won',
-                                          'Loose_Ball_Duels': 'Loose Ball Duels',
-                                          'Loose_Balls_Won': 'Loose Balls Won',
-                                          'Possession_Regained': 'Possession Regained',
-                                          'Sliding_Tackles': 'Sliding Tackles',
-                                          'Own_Goals': 'Own Goals',
-                                          'GK_Balls_Attacked': 'GK Balls Attacked',
-                                          'GK_Save_Attempts': 'GK Save Attempts',
-                                          'GK_Successful_Save_Attempts': 'GK Successful Save Attempts',
-                                          'Perc GK Save Success': 'Perc GK Save Success'
-                                         })
-    final_df = final_df[columns]
-    
-    return final_df
+    return pd.read_csv(path, converters=converters)
+
+
+# -----------------------------
+# Flatten
+# -----------------------------
+def _nested(values, *path):
+    # Walks a StatsBomb dict column once, e.g. _nested(shots, 'outcome', 'name')
+    out = np.empty(len(values), dtype = object)
+    for i, x in enumerate(values):
+        for key in path:
+            x = x.get(key) if isinstance(x, dict) else None
+        out[i] = x
+    return out
+
+def _nested_on(df, col, mask, *path):
+    # Only the rows of the matching event type carry a dict in `col`
+    out  = np.full(len(df), None, dtype = object)
+    rows = np.flatnonzero(mask)
+    out[rows] = _nested(df[col].to_numpy()[rows], *path)
+    return out
+
+def _names_on(df, col, mask, *path):
+    return pd.Categorical(_nested_on(df, col, mask, *path, 'name'))
+
+def flatten_events(df):
+    event_type = pd.Categorical(_nested(df['type'].to_numpy(), 'name'))
+    is_shot    = np.asarray(event_type == 'Shot')
+    is_pass    = np.asarray(event_type == 'Pass')
+    is_duel    = np.asarray(event_type == 'Duel')
+    is_gk      = np.asarray(event_type == 'Goal Keeper')
+
+    return pd.DataFrame({
+        'Id':              pd.to_numeric(pd.Series(_nested(df['player'].to_numpy(), 'id'), index = df.index), errors = 'coerce'),
+        'match_id':        df['match_id'].to_numpy(),
+        'type':            event_type,
+        'shot_outcome':    _names_on(df, 'shot', is_shot, 'outcome'),
+        'shot_type':       _names_on(df, 'shot', is_shot, 'type'),
+        'shot_assist':     _names_on(df, 'pass', is_shot, 'recipient'),
+        'pass_outcome':    pd.notna(_nested_on(df, 'pass', is_pass, 'outcome')),
+        'pass_type':       _names_on(df, 'pass', is_pass, 'type'),
+        'pass_height':     _names_on(df, 'pass', is_pass, 'height'),
+        'duel_type':       _names_on(df, 'duel', is_duel, 'type'),
+        'duel_outcome':    _names_on(df, 'duel', is_duel, 'outcome'),
+        'dribble_outcome': _names_on(df, 'dribble', np.asarray(event_type == 'Dribble'), 'outcome'),
+        'gk_type':         _names_on(df, 'goalkeeper', is_gk, 'type'),
+        'gk_outcome':      _names_on(df, 'goalkeeper', is_gk, 'outcome'),
+    }, index = df.index)
+
+
+def _field(arr, *path):
+    # Struct child lookup that tolerates fields a given match never produced
+    for key in path:
+        if arr is None or not pa.types.is_struct(arr.type) or arr.type.get_field_index(key) < 0:
+            return None
+        arr = pc.struct_field(arr, key)
+    return arr
+
+def _table_values(table, decoded, col, *path):
+    # A nested child as an Arrow array (struct columns) or an object array (JSON fallback
+    # columns, already decoded); None when the column or field never occurs
+    if col in decoded:
+        return _nested(decoded[col], *path)
+    return _field(table.column(col), *path) if col in table.column_names else None
+
+def _table_names(table, decoded, col, *path):
+    values = _table_values(table, decoded, col, *path, 'name')
+    if values is None:
+        return pd.Categorical(np.full(table.num_rows, None, dtype = object))
+    return pd.Categorical(values if isinstance(values, np.ndarray) else values.to_pandas())
+
+def flatten_table(table):
+    # Same output as flatten_events, straight from struct-typed Arrow columns
+    decoded   = {col: event_store.decode_json(table.column(col)) for col in event_store.json_columns(table)
+                 if col in table.column_names}
+    player_id = _table_values(table, decoded, 'player', 'id')
+    outcome   = _table_values(table, decoded, 'pass', 'outcome')
+    if outcome is None:
+        pass_outcome = np.zeros(table.num_rows, dtype = bool)
+    elif isinstance(outcome, np.ndarray):
+        pass_outcome = pd.notna(outcome)
+    else:
+        pass_outcome = outcome.is_valid().to_numpy()
+
+    if player_id is None:
+        player_id = np.full(table.num_rows, np.nan)
+    elif isinstance(player_id, np.ndarray):
+        player_id = pd.to_numeric(pd.Series(player_id), errors = 'coerce')
+    else:
+        player_id = player_id.to_pandas()
+
+    return pd.DataFrame({
+        'Id':              player_id,
+        'match_id':        table.column('match_id').to_numpy(),
+        'type':            _table_names(table, decoded, 'type'),
+        'shot_outcome':    _table_names(table, decoded, 'shot', 'outcome'),
+        'shot_type':       _table_names(table, decoded, 'shot', 'type'),
+        'shot_assist':     _table_names(table, decoded, 'pass', 'recipient'),
+        'pass_outcome':    pass_outcome,
+        'pass_type':       _table_names(table, decoded, 'pass', 'type'),
+        'pass_height':     _table_names(table, decoded, 'pass', 'height'),
+        'duel_type':       _table_names(table, decoded, 'duel', 'type'),
+        'duel_outcome':    _table_names(table, decoded, 'duel', 'outcome'),
+        'dribble_outcome': _table_names(table, decoded, 'dribble', 'outcome'),
+        'gk_type':         _table_names(table, decoded, 'goalkeeper', 'type'),
+        'gk_outcome':      _table_names(table, decoded, 'goalkeeper', 'outcome'),
+    })
+
+def _concat_flat(frames):
+    # Categories differ per match, so unify them before concatenating
+    frames = [f for f in frames if len(f)]
+    if not frames:
+        return flatten_events(pd.DataFrame({col: pd.Series(dtype = object) for col in EVENT_COLUMNS}))
+    return pd.concat(frames, ignore_index = True).astype({
+        col: 'category' for col in frames[0].columns if isinstance(frames[0][col].dtype, pd.CategoricalDtype)
+    })
+
+def load_flat_events(path = EVENTS_PATH):
+    if path.endswith('.csv'):
+        return flatten_events(load_events_csv(path))
+    return _concat_flat([flatten_table(event_store.read_match(file, EVENT_COLUMNS))
+                         for _, _, _, file in event_store.match_partitions(path)])
+
+
+# -----------------------------
+# Per-event counters
+# -----------------------------
+def event_counters(flat):
+    t = flat['type']
+
+    shot    = t == 'Shot'
+    goal    = shot & (flat['shot_outcome'] == 'Goal')
+    penalty = shot & (flat['shot_type'] == 'Penalty')
+
+    passes  = t == 'Pass'
+    high    = passes & (flat['pass_height'] == 'High Pass')
+
+    duel    = t == 'Duel'
+    won     = duel & (flat['duel_outcome'] == 'Won')
+    aerial  = duel & (flat['duel_type'] == 'Aerial Duel')
+    ground  = duel & (flat['duel_type'] == 'Ground defending duel')
+    loose   = duel & (flat['duel_type'] == 'Loose Ball')
+
+    dribble = t == 'Dribble'
+    block   = t == 'Block'
+    gk      = t == 'Goal Keeper'
+
+    return pd.DataFrame({
+        'shots':                 shot,
+        'accurate_shots':        shot & flat['shot_outcome'].isin(['Goal', 'On Target', 'Saved']),
+        'goals':                 goal,
+        'penalties_taken':       penalty,
+        'penalties_scored':      penalty & (flat['shot_outcome'] == 'Goal'),
+        'free_kick_shots':       shot & (flat['shot_type'] == 'Free Kick'),
+        'own_goals':             shot & (flat['shot_outcome'] == 'Own Goal'),
+        'passes':                passes,
+        'accurate_passes':       passes & ~flat['pass_outcome'],
+        'key_passes':            passes & (flat['pass_type'] == 'Key Pass'),
+        'crosses':               high,
+        'free_kick_crosses':     high & (flat['pass_type'] == 'Free Kick'),
+        'carries':               t == 'Carry',
+        'dribble_events':        dribble,
+        'dribbles':              dribble & (flat['dribble_outcome'] == 'Complete'),
+        'aerial_duels':          aerial,
+        'aerial_duels_won':      aerial & won,
+        'ground_duels':          ground,
+        'ground_duels_won':      ground & won,
+        'loose_ball_duels':      loose,
+        'loose_balls_won':       loose & won,
+        'interceptions':         t == 'Interception',
+        'blocks':                block,
+        'clearances':            t == 'Clearance',
+        'recoveries':            t == 'Ball Recovery',
+        'gk_events':             gk,
+        'gk_save_attempts':      gk & (flat['gk_type'] == 'Shot Saved'),
+        'gk_successes':          gk & (flat['gk_outcome'] == 'Success'),
+    }, index = flat.index)
+
+COUNTER_COLUMNS = ['shots', 'accurate_shots', 'goals', 'penalties_taken', 'penalties_scored', 'free_kick_shots', 'own_goals',
+                   'passes', 'accurate_passes', 'key_passes', 'crosses', 'free_kick_crosses',
+                   'carries', 'dribble_events', 'dribbles',
+                   'aerial_duels', 'aerial_duels_won', 'ground_duels', 'ground_duels_won', 'loose_ball_duels', 'loose_balls_won',
+                   'interceptions', 'blocks', 'clearances', 'recoveries',
+                   'gk_events', 'gk_save_attempts', 'gk_successes']
+
+def count_events(flat):
+    # Single grouped pass: every additive per-player counter plus matches played
+    counters = event_counters(flat)
+    counters['Id']       = flat['Id']
+    counters['match_id'] = flat['match_id']
+
+    grouped = counters.groupby('Id', sort = True)
+    counts  = grouped[COUNTER_COLUMNS].sum()
+    counts['matches'] = grouped['match_id'].nunique()
+
+    goals   = flat[np.asarray(counters['goals']) & flat['shot_assist'].notna()]
+    assists = goals.groupby('shot_assist', observed = True).size()
+    return counts, assists
+
+
+# -----------------------------
+# Derived stats
+# -----------------------------
+# Output column -> (counter, counter whose presence decides whether the player had that event type at all)
+COUNT_OUTPUTS = {
+    'Total Shots':                 ('shots', 'shots'),
+    'Accurate Shots':              ('accurate_shots', 'shots'),
+    'Goals':                       ('goals', 'shots'),
+    'Penalties Taken':             ('penalties_taken', 'shots'),
+    'Penalties Scored':            ('penalties_scored', 'shots'),
+    'Free Kick Shots':             ('free_kick_shots', 'shots'),
+    'Total Passes':                ('passes', 'passes'),
+    'Accurate Passes':             ('accurate_passes', 'passes'),
+    'Key Passes':                  ('key_passes', 'passes'),
+    'Crosses':                     ('crosses', 'passes'),
+    'Free Kick Crosses':           ('free_kick_crosses', 'passes'),
+    'Run Attempts With Ball':      ('carries', 'carries'),
+    'Successful Runs With Ball':   ('carries', 'carries'),
+    'Dribbles':                    ('dribbles', 'dribble_events'),
+    'Aerial Duels':                ('aerial_duels', 'aerial_duels'),
+    'Aerial Duels Won':            ('aerial_duels_won', 'aerial_duels'),
+    'Ground Defensive duels Won':  ('ground_duels_won', 'ground_duels'),
+    'Loose Ball Duels':            ('loose_ball_duels', 'loose_ball_duels'),
+    'Loose Balls Won':             ('loose_balls_won', 'loose_ball_duels'),
+    'Interceptions':               ('interceptions', 'interceptions'),
+    'Sliding Tackles':             ('blocks', 'blocks'),
+    'Clearances':                  ('clearances', 'clearances'),
+    'Possession Regained':         ('recoveries', 'recoveries'),
+    'Blocks':                      ('blocks', 'blocks'),
+    'Own Goals':                   ('own_goals', 'own_goals'),
+    'GK Balls Attacked':           ('gk_events', 'gk_events'),
+    'GK Save Attempts':            ('gk_save_attempts', 'gk_events'),
+    'GK Successful Save Attempts': ('gk_successes', 'gk_events'),
+}
+
+# Output column -> (numerator, denominator); players with a zero denominator get 0
+RATIO_OUTPUTS = {
+    'Shot Accuracy':         ('Accurate Shots', 'Total Shots'),
+    'Shot Conversion':       ('Goals', 'Total Shots'),
+    'Penalty Conversion':    ('Penalties Scored', 'Penalties Taken'),
+    'Pass Accuracy':         ('Accurate Passes', 'Total Passes'),
+    'Perc Aerial Duels Won': ('Aerial Duels Won', 'Aerial Duels'),
+    'Perc Loose Balls Won':  ('Loose Balls Won', 'Loose Ball Duels'),
+    'Perc GK Save Success':  ('GK Successful Save Attempts', 'GK Save Attempts'),
+}
+
+def derive_stats(counts, assists):
+    # Turns additive counters into the final per-player table. Dtypes follow the
+    # original merge-based implementation: a count column stays integer only when
+    # every player had at least one event of that type.
+    final_df = pd.DataFrame({'Id': counts.index.to_numpy(), 'Matches Played': counts['matches'].to_numpy()})
+
+    for name, (counter, presence) in COUNT_OUTPUTS.items():
+        values = counts[counter].to_numpy()
+        final_df[name] = values if (counts[presence] > 0).all() else values.astype(np.float64)
+
+    for name, (num, den) in RATIO_OUTPUTS.items():
+        final_df[name] = (final_df[num] / final_df[den].replace(0, np.nan)).fillna(0)
+
+    # Assists are keyed by recipient name, so they are joined the same way as before
+    assists_agg = assists.rename('Assists').rename_axis('Id').reset_index()
+    if len(assists_agg):
+        final_df = pd.merge(final_df, assists_agg, on = 'Id', how = 'outer').fillna(0)
+    else:
+        final_df['Assists'] = 0.0
+
+    # Unlike the other ratios this one is computed after the zero fill and keeps NaN
+    final_df['Perc Successful Runs With Ball'] = final_df['Successful Runs With Ball'] / final_df['Run Attempts With Ball'].replace(0, np.nan)
+
+    return final_df[COLUMNS]
+
+
+def aggregate_events(df):
+    return derive_stats(*count_events(flatten_events(df)))
+
+def process_data(path = EVENTS_PATH):
+    return derive_stats(*count_events(load_flat_events(path)))
+
+
+# -----------------------------
+# Parallel aggregation
+# -----------------------------
+# Matches never straddle partitions, so per-partition counters (matches played
+# included) add up to the serial ones and only derive_stats runs on the merged totals
+AGGREGATION_WORKERS = int(os.environ.get('AGGREGATION_WORKERS', os.cpu_count() or 1))
+TASKS_PER_WORKER    = 4   # smaller tasks even out uneven match sizes
+
+def split_matches(files, n_parts):
+    # Largest match first onto the lightest partition, by file size
+    parts = [[] for _ in range(n_parts)]
+    sizes = [0] * n_parts
+    for file in sorted(files, key = os.path.getsize, reverse = True):
+        i = sizes.index(min(sizes))
+        parts[i].append(file)
+        sizes[i] += os.path.getsize(file)
+    return [part for part in parts if part]
+
+def partition_counts(files):
+    # Map: one grouped pass over a partition's matches
+    return count_events(_concat_flat([flatten_table(event_store.read_match(file, EVENT_COLUMNS)) for file in files]))
+
+def merge_counts(partials):
+    # Reduce: per-player and per-recipient sums, in the order the serial grouping produces
+    counts  = pd.concat([counts for counts, _ in partials]).groupby(level = 0, sort = True).sum()
+    assists = pd.concat([assists.set_axis(assists.index.astype(object)) for _, assists in partials])
+    assists = assists.groupby(level = 0, sort = True).sum()
+    return counts, assists.set_axis(pd.CategoricalIndex(assists.index, name = 'shot_assist'))
+
+def process_data_parallel(path = EVENTS_PATH, workers = AGGREGATION_WORKERS):
+    files = [file for _, _, _, file in event_store.match_partitions(path)]
+    if workers <= 1 or len(files) < 2:
+        return process_data(path)
+    parts = split_matches(files, min(len(files), workers * TASKS_PER_WORKER))
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        partials = list(pool.map(partition_counts, parts))
+    return derive_stats(*merge_counts(partials))
+
+
+# -----------------------------
+# Incremental aggregation
+# -----------------------------
+# The additive counters are kept between runs, so a refresh only reads partitions
+# written (or rewritten) since the last one; ratios are derived on read
+STATE_DIR     = os.environ.get('AGGREGATION_STATE_DIR', '/mnt/block/data/final_datasets/aggregation_state')
+STATE_FILE    = 'state.npz'
+COUNT_COLUMNS = COUNTER_COLUMNS + ['matches']
+
+def _save_npz(path, **arrays):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+def _pack(counts, assists):
+    return {'ids':          counts.index.to_numpy(dtype = np.float64),
+            'counts':       counts[COUNT_COLUMNS].to_numpy(dtype = np.int64),
+            'assist_names': np.asarray(assists.index.astype(str), dtype = str),
+            'assists':      assists.to_numpy(dtype = np.int64)}
+
+def _unpack(arrays):
+    counts  = pd.DataFrame(arrays['counts'], index = pd.Index(arrays['ids'], name = 'Id'), columns = COUNT_COLUMNS)
+    assists = pd.Series(arrays['assists'], index = pd.Index(arrays['assist_names'].astype(object), name = 'shot_assist'))
+    return counts, assists
+
+def _empty_counts():
+    return _unpack({'ids': np.empty(0, dtype = np.float64), 'counts': np.empty((0, len(COUNT_COLUMNS)), dtype = np.int64),
+                    'assist_names': np.empty(0, dtype = str), 'assists': np.empty(0, dtype = np.int64)})
+
+def match_counts(path):
+    # Same float Id / plain string index the state uses, so partials add up exactly.
+    # Also returns whether the match's Ids were float, i.e. some event had no player
+    counts, assists = count_events(flatten_table(event_store.read_match(path, EVENT_COLUMNS)))
+    return (*_unpack(_pack(counts, assists)), not pd.api.types.is_integer_dtype(counts.index))
+
+
+class AggregationState:
+    # Running per-player totals plus, for every folded match, the partial counts it
+    # contributed (keyed by partition mtime) so a re-fetched match can be backed out
+
+    def __init__(self, state_dir = STATE_DIR):
+        self.state_dir   = state_dir
+        self.partial_dir = os.path.join(state_dir, 'partials')
+        os.makedirs(self.partial_dir, exist_ok = True)
+
+        path = os.path.join(state_dir, STATE_FILE)
+        if os.path.exists(path):
+            with np.load(path) as arrays:
+                self.counts, self.assists = _unpack(arrays)
+                self.folded = dict(zip(arrays['match_ids'].tolist(), arrays['versions'].tolist()))
+                self.float_ids = set(arrays['float_id_matches'].tolist()) if 'float_id_matches' in arrays else set()
+        else:
+            self.counts, self.assists = _empty_counts()
+            self.folded = {}
+            # Matches with an event without a player; the serial path has float Ids if there are any
+            self.float_ids = set()
+
+    def _partial_path(self, match_id, version):
+        return os.path.join(self.partial_dir, f"match_{match_id}-{version}.npz")
+
+    def _add(self, counts, assists, sign):
+        totals = self.counts.add(sign * counts, fill_value = 0).astype(np.int64)
+        # A player whose only matches were backed out drops out entirely
+        self.counts = totals[totals['matches'] > 0].sort_index()
+        assists = self.assists.add(sign * assists, fill_value = 0).astype(np.int64)
+        self.assists = assists[assists != 0].sort_index()
+
+    def _unfold(self, match_id):
+        with np.load(self._partial_path(match_id, self.folded.pop(match_id))) as arrays:
+            self._add(*_unpack(arrays), -1)
+        self.float_ids.discard(match_id)
+
+    def fold(self, match_id, path, version):
+        counts, assists, float_ids = match_counts(path)
+        if match_id in self.folded:
+            self._unfold(match_id)
+        self._add(counts, assists, 1)
+        _save_npz(self._partial_path(match_id, version), **_pack(counts, assists))
+        self.folded[match_id] = version
+        if float_ids:
+            self.float_ids.add(match_id)
+
+    def refresh(self, root = EVENTS_PATH):
+        # Only partitions that are new or were replaced since the last refresh are read
+        seen, n_folded = set(), 0
+        for _, _, match_id, path in event_store.match_partitions(root):
+            seen.add(match_id)
+            version = os.stat(path).st_mtime_ns
+            if self.folded.get(match_id) != version:
+                self.fold(match_id, path, version)
+                n_folded += 1
+        for match_id in set(self.folded) - seen:
+            self._unfold(match_id)
+        self.save()
+        return n_folded
+
+    def save(self):
+        _save_npz(os.path.join(self.state_dir, STATE_FILE),
+                  match_ids = np.array(list(self.folded), dtype = np.int64),
+                  versions  = np.array(list(self.folded.values()), dtype = np.int64),
+                  float_id_matches = np.array(sorted(self.float_ids), dtype = np.int64),
+                  **_pack(self.counts, self.assists))
+        # Partials are only dropped once the totals that no longer include them are on disk
+        keep = {os.path.basename(self._partial_path(m, v)) for m, v in self.folded.items()}
+        for name in os.listdir(self.partial_dir):
+            if name.endswith('.npz') and name not in keep:
+                os.remove(os.path.join(self.partial_dir, name))
+
+    def stats(self):
+        # count_events hands derive_stats a categorical assist index; keep the merge identical
+        assists = self.assists.set_axis(pd.CategoricalIndex(self.assists.index, name = 'shot_assist'))
+        counts  = self.counts
+        if not self.float_ids:
+            # Every event had a player, so the serial grouping keys are integer
+            counts = counts.set_axis(counts.index.astype(np.int64))
+        return derive_stats(counts, assists)
+
+
+def process_data_incremental(path = EVENTS_PATH, state_dir = STATE_DIR):
+    state    = AggregationState(state_dir)
+    n_folded = state.refresh(path)
+    print(f"Folded {n_folded} new or updated matches; {len(state.folded)} matches, {len(state.counts)} players")
+    return state.stats()
+
+# -----------------------------
+# Similarity engine feed
+# -----------------------------
+SIMILARITY_URL = os.environ.get('SIMILARITY_PUSH_URL', '')   # e.g. http://flask:5000/similar_players/players
+PUSH_BATCH     = 500
+
+def push_stats(final_df, url = SIMILARITY_URL, batch_size = PUSH_BATCH):
+    # Upserts the aggregated players into the app's similarity engine. Assist rows keyed
+    # by recipient name (see derive_stats) have no player id and are skipped
+    ids     = pd.to_numeric(final_df['Id'], errors = 'coerce')
+    players = final_df[ids.notna()].assign(Id = ids[ids.notna()].astype(np.int64))
+    records = json.loads(players.to_json(orient = 'records'))
+    for start in range(0, len(records), batch_size):
+        body    = json.dumps({'players': records[start:start + batch_size]}).encode()
+        request = urllib.request.Request(url, data = body, headers = {'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout = 60) as response:
+            response.read()
+    print(f"Pushed {len(records)} players to {url}")
+    return len(records)
 
 if __name__ == "__main__":
-    process_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action = 'store_true',
+                        help = 'Fold only new match partitions into the saved counter state')
+    parser.add_argument('--workers', type = int, default = 1,
+                        help = 'Aggregate match partitions on this many processes and merge the counters')
+    parser.add_argument('--push-url', default = SIMILARITY_URL,
+                        help = "POST the per-player stats to the app's /similar_players/players endpoint")
+    args = parser.parse_args()
+
+    if args.incremental:
+        final_df = process_data_incremental()
+    elif args.workers > 1:
+        final_df = process_data_parallel(workers = args.workers)
+    else:
+        final_df = process_data()
+    if args.push_url:
+        push_stats(final_df, args.push_url)
@@ -0,0 +1,75 @@
+import os
+import time
+import sqlite3
+
+# Durable streamer state: which matches were written (the partition manifest),
+# per-season high-water marks and the ETag of the last fully processed match list
+CHECKPOINT_PATH = os.environ.get('STREAM_CHECKPOINT', '/mnt/block/data/final_datasets/stream_checkpoint.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    match_id        INTEGER PRIMARY KEY,
+    competition_id  INTEGER NOT NULL,
+    season_id       INTEGER NOT NULL,
+    last_updated    TEXT,
+    path            TEXT NOT NULL,
+    n_events        INTEGER NOT NULL,
+    written_at      REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS seasons (
+    competition_id  INTEGER NOT NULL,
+    season_id       INTEGER NOT NULL,
+    high_water      TEXT,
+    etag            TEXT,
+    polled_at       REAL NOT NULL,
+    PRIMARY KEY (competition_id, season_id)
+);
+"""
+
+
+class Checkpoint:
+    def __init__(self, path = CHECKPOINT_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # -----------------------------
+    # Matches / partition manifest
+    # -----------------------------
+    def processed_matches(self):
+        # match_id -> last_updated of the version that was written
+        return dict(self.conn.execute("SELECT match_id, last_updated FROM matches"))
+
+    def record_match(self, match_id, competition_id, season_id, last_updated, path, n_events):
+        # Called only after the partition file has been renamed into place, so a
+        # crash in between just means the match is fetched and replaced again
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (match_id, competition_id, season_id, last_updated, path, n_events, time.time()))
+
+    def partitions(self, competition_id = None, season_id = None):
+        query, args = "SELECT competition_id, season_id, match_id, path FROM matches", []
+        if competition_id is not None:
+            query += " WHERE competition_id = ?" + (" AND season_id = ?" if season_id is not None else "")
+            args = [competition_id] + ([season_id] if season_id is not None else [])
+        return list(self.conn.execute(query + " ORDER BY competition_id, season_id, match_id", args))
+
+    # -----------------------------
+    # Seasons
+    # -----------------------------
+    def season_state(self, competition_id, season_id):
+        row = self.conn.execute("SELECT high_water, etag FROM seasons WHERE competition_id = ? AND season_id = ?",
+                                (competition_id, season_id)).fetchone()
+        return row if row else (None, None)
+
+    def record_season(self, competition_id, season_id, high_water, etag):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO seasons VALUES (?, ?, ?, ?, ?)",
+                              (competition_id, season_id, high_water, etag, time.time()))
@@ -0,0 +1,87 @@
+import os
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# -----------------------------
+# Layout
+# -----------------------------
+# <root>/competition_id=<c>/season_id=<s>/match_id=<m>/events.parquet
+EVENTS_DIR = os.environ.get('EVENTS_DIR', '/mnt/block/data/final_datasets/events')
+EVENTS_FILE = 'events.parquet'
+JSON_COLUMNS_KEY = b'json_columns'   # schema metadata: columns the writer had to store as JSON text
+
+
+def partition_dir(root, competition_id, season_id, match_id):
+    return os.path.join(root, f"competition_id={competition_id}", f"season_id={season_id}", f"match_id={match_id}")
+
+
+def _column_to_arrow(series):
+    # Nested StatsBomb dicts become struct columns; anything Arrow cannot type
+    # consistently (mixed scalars/containers) is kept as JSON text instead.
+    # Returns (array, whether the JSON fallback was used)
+    try:
+        return pa.array(series, from_pandas = True), False
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if v is None or (isinstance(v, float) and v != v) else json.dumps(v) for v in series],
+                        type = pa.string()), True
+
+
+def events_to_table(df):
+    arrays, fallback = {}, []
+    for col in df.columns:
+        arrays[col], is_json = _column_to_arrow(df[col])
+        if is_json:
+            fallback.append(col)
+    # Tagged in the schema, so readers tell JSON text apart from genuine string columns
+    return pa.table(arrays, metadata = {JSON_COLUMNS_KEY: json.dumps(fallback)})
+
+
+def write_match(df, competition_id, season_id, match_id, root = EVENTS_DIR):
+    # One file per match, written to a temp name and renamed so readers never
+    # see a partially written partition
+    out_dir = partition_dir(root, competition_id, season_id, match_id)
+    os.makedirs(out_dir, exist_ok = True)
+    path     = os.path.join(out_dir, EVENTS_FILE)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    pq.write_table(events_to_table(df), tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+# -----------------------------
+# Read side
+# -----------------------------
+def _partition_value(name):
+    return int(name.split('=', 1)[1])
+
+def _partition_dirs(path):
+    return [name for name in os.listdir(path) if '=' in name and os.path.isdir(os.path.join(path, name))]
+
+def match_partitions(root = EVENTS_DIR):
+    # Yields (competition_id, season_id, match_id, path) for every complete partition
+    if not os.path.isdir(root):
+        return
+    for comp in sorted(_partition_dirs(root)):
+        for season in sorted(_partition_dirs(os.path.join(root, comp))):
+            season_dir = os.path.join(root, comp, season)
+            for match in sorted(_partition_dirs(season_dir)):
+                path = os.path.join(season_dir, match, EVENTS_FILE)
+                if os.path.exists(path):
+                    yield _partition_value(comp), _partition_value(season), _partition_value(match), path
+
+
+def read_match(path, columns):
+    # Column projection: only the requested top-level columns are decoded. JSON
+    # fallback columns stay strings here; decode_json turns them into Python objects
+    available = set(pq.read_schema(path).names)
+    return pq.read_table(path, columns = [c for c in columns if c in available])
+
+def json_columns(table):
+    metadata = table.schema.metadata or {}
+    return set(json.loads(metadata.get(JSON_COLUMNS_KEY, b'[]')))
+
+def decode_json(column):
+    # Values of a JSON fallback column as Python objects, without Arrow type inference,
+    # which would fail again on the same mixed values
+    return [json.loads(v) if v is not None else None for v in column.to_pylist()]
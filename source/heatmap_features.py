@@ -0,0 +1,109 @@
+import os
+import argparse
+import numpy as np
+import polars as pl
+
+# -----------------------------
+# Config
+# -----------------------------
+MATCHES_PATH   = os.environ.get('MATCH_DETAIL_PATH', '/mnt/block/data/final_datasets/match_detail.parquet')
+OUTPUT_PATH    = os.environ.get('HEATMAP_FEATURES_PATH', '/mnt/block/data/final_datasets/player_heatmap_features.npz')
+POSITIONS_PATH = os.environ.get('PLAYER_POSITIONS_PATH', '/mnt/block/data/final_datasets/player_positions.npz')
+GRID_SIZE      = tuple(int(n) for n in os.environ.get('HEATMAP_GRID', '10x10').split('x'))
+MIN_EVENTS     = 5          # players with fewer located events get no features, as in the notebook
+PITCH_RANGE    = (0, 100)   # wyscout coordinates
+
+INCLUDE_EVENTS = ["Pass", "Shot", "Others on the ball", "Duel", "Save attempt", "Goalkeeper leaving line"]
+
+
+# -----------------------------
+# Positions
+# -----------------------------
+def explode_positions(df_matches, include_events = INCLUDE_EVENTS):
+    # One row per located event: playerId, x, y (first position of the event)
+    return (df_matches.lazy()
+            .filter(pl.col("eventName").is_in(include_events))
+            .select(pl.col("playerId"), pl.col("positions").list.first().alias("pos"))
+            .drop_nulls("pos")
+            .select(pl.col("playerId"), pl.col("pos").struct.field("x"), pl.col("pos").struct.field("y"))
+            .drop_nulls()
+            .collect())
+
+def _bin_index(values, n_bins):
+    # Same binning as np.histogram2d over PITCH_RANGE: right-open bins, the last
+    # one closed, anything outside the pitch dropped (-1)
+    edges = np.linspace(PITCH_RANGE[0], PITCH_RANGE[1], n_bins + 1)
+    index = np.searchsorted(edges, values, side = 'right')
+    index[values == edges[-1]] -= 1
+    return np.where((index >= 1) & (index <= n_bins), index - 1, -1)
+
+
+# -----------------------------
+# Grid features
+# -----------------------------
+def grid_features(positions, grid_size = GRID_SIZE, min_events = MIN_EVENTS):
+    # Every player's normalised grid histogram in one pass: (ids, float32 matrix of
+    # shape (n_players, gx * gy)), cells in np.histogram2d(x, y).flatten() order
+    gx, gy  = grid_size
+    players = positions["playerId"].to_numpy()
+    x       = positions["x"].to_numpy().astype(np.float64)
+    y       = positions["y"].to_numpy().astype(np.float64)
+
+    ids, code, n_events = np.unique(players, return_inverse = True, return_counts = True)
+    bx, by  = _bin_index(x, gx), _bin_index(y, gy)
+    on_grid = (bx >= 0) & (by >= 0)
+
+    cells  = gx * gy
+    counts = np.bincount(code[on_grid] * cells + bx[on_grid] * gy + by[on_grid],
+                         minlength = len(ids) * cells).reshape(len(ids), cells)
+
+    keep = n_events >= min_events
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        features = counts[keep] / counts[keep].sum(axis = 1, keepdims = True)
+    return ids[keep].astype(np.int64), features.astype(np.float32)
+
+
+def _savez_atomic(path, **arrays):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+def save_features(ids, features, grid_size = GRID_SIZE, path = OUTPUT_PATH):
+    return _savez_atomic(path, ids = ids, features = features, grid = np.asarray(grid_size, dtype = np.int64))
+
+def save_positions(positions, path = POSITIONS_PATH):
+    # Every located event grouped by player, for the on-demand density plots:
+    # player ids[i] owns x/y[offsets[i]:offsets[i + 1]], in event order
+    players = positions["playerId"].to_numpy()
+    order   = np.argsort(players, kind = 'stable')
+    ids, counts = np.unique(players[order], return_counts = True)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return _savez_atomic(path, ids = ids.astype(np.int64), offsets = offsets,
+                         x = positions["x"].to_numpy().astype(np.float32)[order],
+                         y = positions["y"].to_numpy().astype(np.float32)[order])
+
+
+def build(matches_path = MATCHES_PATH, output_path = OUTPUT_PATH, grid_size = GRID_SIZE, positions_path = POSITIONS_PATH):
+    positions     = explode_positions(pl.read_parquet(matches_path, columns = ["playerId", "eventName", "positions"]))
+    ids, features = grid_features(positions, grid_size)
+    save_features(ids, features, grid_size, output_path)
+    print(f"Wrote {grid_size[0]}x{grid_size[1]} grid features for {len(ids)} players "
+          f"({len(positions)} located events) to {output_path}")
+    if positions_path:
+        save_positions(positions, positions_path)
+        print(f"Wrote event positions to {positions_path}")
+    return ids, features
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grid', default = 'x'.join(map(str, GRID_SIZE)), help = 'Grid resolution, e.g. 10x10 or 20x13')
+    parser.add_argument('--input', default = MATCHES_PATH)
+    parser.add_argument('--output', default = OUTPUT_PATH)
+    parser.add_argument('--positions', default = POSITIONS_PATH, help = 'Per-player event positions for the density plots ("" to skip)')
+    args = parser.parse_args()
+
+    build(args.input, args.output, tuple(int(n) for n in args.grid.split('x')), args.positions)
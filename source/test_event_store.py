@@ -0,0 +1,49 @@
+import os
+import sys
+import importlib.util
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import event_store
+
+# "2b. process_live_data.py" is not an importable module name
+_spec = importlib.util.spec_from_file_location(
+    'process_live_data', os.path.join(os.path.dirname(os.path.abspath(__file__)), '2b. process_live_data.py'))
+process_live_data = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(process_live_data)
+
+
+def _events():
+    # `pass` mixes a dict outcome with a plain string one, which Arrow cannot type
+    return pd.DataFrame({
+        'type':       [{'id': 30, 'name': 'Pass'}, {'id': 30, 'name': 'Pass'}, {'id': 16, 'name': 'Shot'}],
+        'player':     [{'id': 7, 'name': 'A'}, {'id': 8, 'name': 'B'}, {'id': 7, 'name': 'A'}],
+        'match_id':   [1, 1, 1],
+        'timestamp':  ['00:00:01.000', '00:00:02.000', '00:00:03.000'],
+        'pass':       [{'outcome': {'id': 9, 'name': 'Incomplete'}, 'height': {'name': 'High Pass'}},
+                       {'outcome': 'x'}, {'recipient': {'id': 8, 'name': 'B'}}],
+        'shot':       [None, None, {'outcome': {'name': 'Goal'}, 'type': {'name': 'Open Play'}}],
+    })
+
+
+def test_heterogeneous_nested_column_round_trip(tmp_path):
+    df   = _events()
+    path = event_store.write_match(df, 11, 90, 1, str(tmp_path))
+
+    table = event_store.read_match(path, ['type', 'player', 'match_id', 'timestamp', 'pass', 'shot'])
+    assert event_store.json_columns(table) == {'pass'}
+    assert pa.types.is_struct(table.schema.field('shot').type)
+    # A genuine string column is left alone
+    assert table.column('timestamp').to_pylist() == df['timestamp'].tolist()
+    assert event_store.decode_json(table.column('pass')) == df['pass'].tolist()
+
+
+def test_flatten_table_matches_flatten_events(tmp_path):
+    df   = _events()
+    path = event_store.write_match(df, 11, 90, 1, str(tmp_path))
+
+    flat = process_live_data.flatten_table(event_store.read_match(path, process_live_data.EVENT_COLUMNS))
+    expected = process_live_data.flatten_events(df.reindex(columns = process_live_data.EVENT_COLUMNS))
+    pd.testing.assert_frame_equal(flat.astype(str), expected.reset_index(drop = True).astype(str))
+    assert flat['pass_outcome'].tolist() == [True, True, False]
@@ -1,127 +1,157 @@
 import pandas as pd
-import re
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, accuracy_score, confusion_matrix
 import matplotlib.pyplot as plt
 import mlflow
 from mlflow.models import infer_signature
+import argparse
+import search
+import drift
+from features import load_features, frame, split_indices, cache_entry
 
 mlflow.set_tracking_uri(uri="http://129.114.26.77:8000")
 
 
-def is_percentage_string(val):
-        if not isinstance(val, str):
-            return False
-        # Matches strings like "10%", "10.5%", etc.
-        return bool(re.match(r'^\s*-?\d+\.?\d*\s*%\s*$', val))
-    
-    # Function to convert percentage string to float
-def convert_to_float(val):
-    if isinstance(val, str):
-        # Remove % sign and whitespace, then divide by 100
-        try:
-            return round(float(val.strip().rstrip('%').strip()) / 100, 2)
-        except ValueError:
-            return val
-    return val
-
-
-
-data = pd.read_parquet('final_player_df.parquet')
-final_data = data.drop(columns=data.loc[:, 'id':'image_url'])
-final_data = final_data.drop(['clearances', 'top_knn_ids'], axis=1)
-
-for col in final_data.columns:
-    if is_percentage_string(final_data[col].iloc[0]):
-        final_data[col] = final_data[col].apply(convert_to_float)
-
-X = final_data.iloc[:, :-1]  
-y = final_data.iloc[:, -1]   
-
-# If your target column has a specific name, use this instead:
-# X = data.drop('target_column_name', axis=1)
-# y = data['target_column_name']
-
-# Split data into training and testing sets
-X_train, X_val, y_train, y_val = train_test_split(
-    X, y, test_size=0.2, random_state=42
-)
-# Split the validation set into validation and test sets
-X_val, X_test, y_val, y_test = train_test_split(
-    X_val, y_val, test_size=0.5, random_state=42
-)
-# Print the sizes of the datasets
-print("Dataset sizes:")
-print(f"Total dataset size: {X.shape[0]} samples") 
-print(f"Training set size: {X_train.shape[0]} samples")
-print(f"Validation set size: {X_val.shape[0]} samples")
-print(f"Test set size: {X_test.shape[0]} samples")
-
-# Initialize and train the Random Forest Classifier
-# You can adjust these hyperparameters based on your needs
-
-rf_params = {
-    'n_estimators': 100,  # Number of trees
-    'max_depth': None,    # Maximum depth of trees (None means unlimited)
-    'min_samples_split': 2,
-    'min_samples_leaf': 1,
-    'random_state': 42,
-    'n_jobs': -1  # Use all available cores
-}
-
-rf_classifier = RandomForestClassifier(**rf_params)
-
-# Train the model
-print("\nTraining Random Forest Classifier...")
-rf_classifier.fit(X_train, y_train)
-
-# Make predictions on the test set
-y_pred = rf_classifier.predict(X_test)
-
-# Evaluate the model
-acc = accuracy_score(y_test, y_pred)
-print("\nModel Evaluation:")
-print(f"Accuracy: {acc:.4f}")
-print("\nClassification Report:")
-print(classification_report(y_test, y_pred))
-
-
-# Feature importance
-feature_importance = pd.DataFrame({
-    'Feature': X.columns,
-    'Importance': rf_classifier.feature_importances_
-}).sort_values('Importance', ascending=False)
-
-print("\nFeature Importance:")
-print(feature_importance)
-
-print(-1)
-
-
-# Create a new MLflow Experiment
-mlflow.set_experiment("MLflow Quickstart")
-
-# Start an MLflow run
-with mlflow.start_run(log_system_metrics=True):
-    # Log the hyperparameters
-    mlflow.log_params(rf_params)
-
-    # Log the loss metric
-    mlflow.log_metric("accuracy", acc)
-
-    # Set a tag that we can use to remind ourselves what this run was for
-    mlflow.set_tag("Training Info", "Basic RF Classifier model for football data")
-
-    # Infer the model signature
-    signature = infer_signature(X_train, rf_classifier.predict(X_train))
-
-    # Log the model
-    model_info = mlflow.sklearn.log_model(
-        sk_model=rf_classifier,
-        artifact_path="football_model",
-        signature=signature,
-        input_example=X_train,
-        registered_model_name="football_model",
-    )
+def train_fixed(X, X_train, y_train, X_val, y_val, X_test, y_test):
+    # Initialize and train the Random Forest Classifier
+    # You can adjust these hyperparameters based on your needs
+
+    rf_params = {
+        'n_estimators': 100,  # Number of trees
+        'max_depth': None,    # Maximum depth of trees (None means unlimited)
+        'min_samples_split': 2,
+        'min_samples_leaf': 1,
+        'random_state': 42,
+        'n_jobs': -1  # Use all available cores
+    }
+
+    rf_classifier = RandomForestClassifier(**rf_params)
+
+    # Train the model
+    print("\nTraining Random Forest Classifier...")
+    rf_classifier.fit(X_train, y_train)
+
+    # Validation accuracy, the same held-out split the search scores its candidates on
+    val_acc = accuracy_score(y_val, rf_classifier.predict(X_val))
+
+    # Make predictions on the test set
+    y_pred = rf_classifier.predict(X_test)
+
+    # Evaluate the model
+    acc = accuracy_score(y_test, y_pred)
+    print("\nModel Evaluation:")
+    print(f"Validation accuracy: {val_acc:.4f}")
+    print(f"Accuracy: {acc:.4f}")
+    print("\nClassification Report:")
+    print(classification_report(y_test, y_pred))
+
+
+    # Feature importance
+    feature_importance = pd.DataFrame({
+        'Feature': X.columns,
+        'Importance': rf_classifier.feature_importances_
+    }).sort_values('Importance', ascending=False)
+
+    print("\nFeature Importance:")
+    print(feature_importance)
+
+    print(-1)
+
+
+    # Create a new MLflow Experiment
+    mlflow.set_experiment("MLflow Quickstart")
+
+    # Start an MLflow run
+    with mlflow.start_run(log_system_metrics=True):
+        # Log the hyperparameters
+        mlflow.log_params(rf_params)
+
+        # Log the loss metric
+        mlflow.log_metric("accuracy", acc)
+        mlflow.log_metric("val_accuracy", val_acc)
+
+        # Set a tag that we can use to remind ourselves what this run was for
+        mlflow.set_tag("Training Info", "Basic RF Classifier model for football data")
+
+        # Infer the model signature
+        signature = infer_signature(X_train, rf_classifier.predict(X_train))
+
+        # Log the model
+        # Log the model, with the training distribution of every feature for the drift monitor in the cluster API
+        model_info = drift.log_model_with_reference(
+            mlflow.sklearn.log_model, X_train, "football_model",
+            sk_model=rf_classifier,
+            signature=signature,
+            input_example=X_train,
+            registered_model_name="football_model",
+        )
+
+
+def run_search(features, train_rows, val_rows, test_rows, mode, workers, n_candidates):
+    # Successive halving over search.SEARCH_SPACE; every fit is a nested run under one parent
+    trials = search.candidates(mode, n_candidates)
+    print(f"\nSearching {len(trials)} candidates ({mode}) on {workers} workers...")
+
+    mlflow.set_experiment("MLflow Quickstart")
+    with mlflow.start_run(run_name="hyperparameter_search", log_system_metrics=True):
+        mlflow.log_params({"search_mode": mode, "n_candidates": len(trials), "eta": search.ETA,
+                           "min_fraction": search.MIN_FRACTION, "workers": workers})
+
+        def log_trial(result):
+            with mlflow.start_run(run_name=f"{result['family']}-rung{result['rung']}", nested=True):
+                mlflow.log_params(dict(result['params'], family=result['family'], rung=result['rung'],
+                                       n_train=result['n_train']))
+                mlflow.log_metrics({"val_accuracy": result['val_accuracy'], "fit_seconds": result['fit_seconds'],
+                                    "peak_memory_mb": result['peak_memory_mb'], "peak_rss_mb": result['peak_rss_mb']})
+
+        best, results = search.successive_halving(cache_entry(), train_rows, val_rows, trials,
+                                                  workers=workers, on_result=log_trial)
+        print(f"\nBest of {len(results)} fits: {best['family']} {best['params']} (val accuracy {best['val_accuracy']:.4f})")
+
+        # Refit the winner on the full train split in this process and evaluate on test
+        X_train, X_test = frame(features, train_rows), frame(features, test_rows)
+        model = search.make_model(best['family'], best['params'], n_jobs=-1)
+        model.fit(X_train, features.y[train_rows])
+        acc = accuracy_score(features.y[test_rows], model.predict(X_test))
+        print(f"Test accuracy: {acc:.4f}")
+
+        mlflow.log_params({f"best_{k}": v for k, v in dict(best['params'], family=best['family']).items()})
+        mlflow.log_metrics({"accuracy": acc, "best_val_accuracy": best['val_accuracy']})
+        mlflow.set_tag("Training Info", "Successive halving search for football data")
+        drift.log_model_with_reference(
+            mlflow.sklearn.log_model, X_train, "football_model",
+            sk_model=model,
+            signature=infer_signature(X_train, model.predict(X_train)),
+            input_example=X_train,
+            registered_model_name="football_model",
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--search", choices=["grid", "random"], help="Run a successive halving search instead of the fixed RF")
+    parser.add_argument("--workers", type=int, default=search.SEARCH_WORKERS, help="Processes used for search fits")
+    parser.add_argument("--n-candidates", type=int, default=search.N_CANDIDATES, help="Samples per model family in random mode")
+    args = parser.parse_args()
+
+    # Parsed, float32 feature matrix shared with offline_eval.py; cached by source file hash
+    features = load_features()
+    train_rows, val_rows, test_rows = split_indices(len(features.y))
+
+    X = frame(features)
+    X_train, y_train = frame(features, train_rows), features.y[train_rows]
+    X_val, y_val     = frame(features, val_rows), features.y[val_rows]
+    X_test, y_test   = frame(features, test_rows), features.y[test_rows]
+
+    # Print the sizes of the datasets
+    print("Dataset sizes:")
+    print(f"Total dataset size: {X.shape[0]} samples") 
+    print(f"Training set size: {X_train.shape[0]} samples")
+    print(f"Validation set size: {X_val.shape[0]} samples")
+    print(f"Test set size: {X_test.shape[0]} samples")
+
+    if args.search:
+        run_search(features, train_rows, val_rows, test_rows, args.search, args.workers, args.n_candidates)
+    else:
+        train_fixed(X, X_train, y_train, X_val, y_val, X_test, y_test)